@@ -12,6 +12,11 @@
 #------------------------------------------------------------------
 #    1          Initial Development
 #    2          Cade Bray: Module One assignment finished.
+#    3          Duty cycles come from a gamma corrected table built
+#               once, stepped on absolute deadlines at 1kHz PWM.
+#    4          GPIO 18 is driven by its hardware PWM channel when
+#               the kernel exposes it, with software PWM at the
+#               original 60Hz only as a fallback.
 #------------------------------------------------------------------
 
 # Load the GPIO interface from the Raspberry Pi Python Module
@@ -22,7 +27,81 @@ import RPi.GPIO as GPIO
 # inject a pause into our operation
 import time
 
-# Set up the GPIO interface
+# Load the os module for the sysfs files of the hardware PWM channel
+import os
+
+# Number of steps in each fade and seconds per step
+FADE_STEPS = 20
+STEP_TIME = 0.1
+
+# GPIO 18 is channel 0 of the Pi's PWM block, which appears in sysfs once the pwm overlay is enabled in
+# /boot/config.txt (dtoverlay=pwm). The block makes the waveform itself, so it can run at 1kHz, well above the flicker
+# you can see at 60Hz on a dim LED, without any CPU time between duty cycle changes.
+PWM_CHIP = '/sys/class/pwm/pwmchip0'
+PWM_CHANNEL = 0
+HARDWARE_PWM_FREQUENCY = 1000
+
+# RPi.GPIO software PWM toggles the pin from a Python thread, so every extra cycle costs CPU time and adds jitter. It
+# is only used when there is no hardware channel, at the original 60Hz.
+SOFTWARE_PWM_FREQUENCY = 60
+
+# Our eyes see brightness roughly as the duty cycle to the power of 1 / 2.2. Raising the steps to 2.2 makes the fade
+# look even instead of jumping to bright and lingering there. The table covers one fade in and out and is built once.
+GAMMA = 2.2
+FADE_TABLE = [round(100 * (step / FADE_STEPS) ** GAMMA, 2) for step in range(FADE_STEPS + 1)]
+FADE_TABLE += FADE_TABLE[-2:0:-1]
+
+class HardwarePWM:
+    """
+    HardwarePWM - The hardware PWM channel of GPIO 18 through sysfs, with the ChangeDutyCycle() and stop() calls of an
+    RPi.GPIO PWM instance. The duty_cycle file is kept open so each step is a single write.
+    """
+
+    def __init__(self, frequency):
+        """
+        Export and enable the channel with a 0% duty cycle.
+
+        @param frequency is the PWM frequency in Hz.
+        @raises OSError if the channel isn't there or can't be claimed.
+        """
+        self.path = os.path.join(PWM_CHIP, f'pwm{PWM_CHANNEL}')
+        if not os.path.exists(self.path):
+            with open(os.path.join(PWM_CHIP, 'export'), 'w') as export:
+                export.write(str(PWM_CHANNEL))
+
+        self.period = round(1e9 / frequency)
+        self.write('duty_cycle', 0)
+        self.write('period', self.period)
+        self.write('enable', 1)
+        self.duty_fd = os.open(os.path.join(self.path, 'duty_cycle'), os.O_WRONLY)
+
+    def write(self, name, value):
+        """write - Write one attribute of the channel."""
+        with open(os.path.join(self.path, name), 'w') as attribute:
+            attribute.write(str(value))
+
+    def ChangeDutyCycle(self, duty_cycle):
+        """ChangeDutyCycle - Set the duty cycle as a percentage, 0 to 100."""
+        os.pwrite(self.duty_fd, str(round(duty_cycle * self.period / 100)).encode(), 0)
+
+    def stop(self):
+        """stop - Turn the LED off and disable the channel."""
+        self.ChangeDutyCycle(0)
+        os.close(self.duty_fd)
+        self.write('enable', 0)
+
+
+# Use the hardware PWM channel if the kernel exposes it. Setting up GPIO 18 as an output with RPi.GPIO would take the
+# pin away from the PWM block, so the GPIO setup below is only done for the software fallback.
+pwm18 = None
+if os.path.isdir(PWM_CHIP):
+    try:
+        pwm18 = HardwarePWM(HARDWARE_PWM_FREQUENCY)
+    except OSError:
+        # The channel is busy or we don't have permission, software PWM still works
+        pwm18 = None
+
+# Set up the GPIO interface for software PWM
 #
 # 1. Turn off warnings for now - they can be useful for debugging more
 #    complex code.
@@ -40,48 +119,45 @@ import time
 #    pin will flow through the LED, through the resistor to the ground
 #    pin and the LED will light up.
 
-GPIO.setwarnings(False)
+if pwm18 is None:
+    GPIO.setwarnings(False)
 
-# noinspection PyTypeChecker
-GPIO.setmode(GPIO.BCM)
+    # noinspection PyTypeChecker
+    GPIO.setmode(GPIO.BCM)
 
-# noinspection PyTypeChecker
-GPIO.setup(18, GPIO.OUT)
+    # noinspection PyTypeChecker
+    GPIO.setup(18, GPIO.OUT)
 
-# Configure a PWM instance on GPIO line 18, with a frequency of 60Hz
-pwm18 = GPIO.PWM(18, 60)
+    # Configure a PWM instance on GPIO line 18, with a frequency of 60Hz
+    pwm18 = GPIO.PWM(18, SOFTWARE_PWM_FREQUENCY)
 
-# Start the PWM instance on GPIO line 18 with 0% duty cycle
-pwm18.start(0)
+    # Start the PWM instance on GPIO line 18 with 0% duty cycle
+    pwm18.start(0)
 
 # Configure the loop variable so that we can exit cleanly when the user issues a keyboard interrupt (CTRL-C)
 repeat = True
+
+# Each step is due a fixed time after the previous one was due, so the time spent updating the duty cycle doesn't add
+# up into a slower fade
+deadline = time.monotonic()
 while repeat:
     try:
-        # Loop from 0 to 100 in increments of 5
-        for duty_cycle in range(0, 101, 5):
-
-            # update the dutyCycle accordingly
-            pwm18.ChangeDutyCycle(duty_cycle)
-
-            # pausing 1/10th of a second between each update
-            time.sleep(0.1)
-
-        # Loop from 100 to decrements of -5 reaching zero
-        for duty_cycle in range(100, -1, -5):
+        # Step through one fade in and out
+        for duty_cycle in FADE_TABLE:
 
             # update the dutyCycle accordingly
             pwm18.ChangeDutyCycle(duty_cycle)
 
-            # pausing 1/10th of a second between each update
-            time.sleep(0.1)
+            # pausing until the next step is due
+            deadline += STEP_TIME
+            time.sleep(max(0.0, deadline - time.monotonic()))
 
     except KeyboardInterrupt:
         # Stop the PWM instance on GPIO line 18
         print('Stopping PWM and Cleaning Up')
         pwm18.stop()
-        GPIO.cleanup()
         repeat = False
 
-# Cleanup the GPIO pins used in this application and exit
-GPIO.cleanup()
\ No newline at end of file
+# Cleanup the GPIO pins used in this application and exit. Only the software fallback set any up.
+if not isinstance(pwm18, HardwarePWM):
+    GPIO.cleanup()
\ No newline at end of file
@@ -11,6 +11,9 @@
 # Version   |   Description
 #------------------------------------------------------------------
 #    1          Initial Development
+#
+#    2          Only runs the machine when executed, so the module
+#               can be imported.
 #------------------------------------------------------------------
 
 ##
@@ -138,42 +141,47 @@ class LightMachine(StateMachine):
 
 
 ##
-## Initialize our State Machine
+## The machine only runs when this file is executed, so it can be
+## imported, e.g. by the benchmarks, on simulated hardware
 ##
-lightMachine = LightMachine()
+if __name__ == '__main__':
+    ##
+    ## Initialize our State Machine
+    ##
+    lightMachine = LightMachine()
 
-##
-## greenButton - set up our Button, tied to GPIO 24. Configure the
-## action to be taken when the button is pressed to be the 
-## execution of the processButton function in our State Machine
-##
-greenButton = Button(24)
-greenButton.when_pressed = lightMachine.processButton
+    ##
+    ## greenButton - set up our Button, tied to GPIO 24. Configure the
+    ## action to be taken when the button is pressed to be the 
+    ## execution of the processButton function in our State Machine
+    ##
+    greenButton = Button(24)
+    greenButton.when_pressed = lightMachine.processButton
 
-##
-## Setup loop variable
-##
-repeat = True
+    ##
+    ## Setup loop variable
+    ##
+    repeat = True
 
-##
-## Repeat until the user creates a keyboard interrupt (CTRL-C)
-##
-while repeat:
-    try:
-        ## Only display if the DEBUG flag is set
-        if(DEBUG):
-            print("Killing time in a loop...")
-
-        ## sleep for 20 seconds at a time. This value is not crucial, 
-        ## all the work for this application is handled by the
-        ## Button.when_pressed event process
-        sleep(20)
-    except KeyboardInterrupt:
-        ## Catch the keyboard interrupt (CTRL-C) and exit cleanly
-        ## we do not need to manually clean up the GPIO pins, the 
-        ## gpiozero library handles that process.
-        print("Cleaning up. Exiting...")
-
-        ## Stop the loop
-        repeat = False
-        sleep(1)
\ No newline at end of file
+    ##
+    ## Repeat until the user creates a keyboard interrupt (CTRL-C)
+    ##
+    while repeat:
+        try:
+            ## Only display if the DEBUG flag is set
+            if(DEBUG):
+                print("Killing time in a loop...")
+
+            ## sleep for 20 seconds at a time. This value is not crucial, 
+            ## all the work for this application is handled by the
+            ## Button.when_pressed event process
+            sleep(20)
+        except KeyboardInterrupt:
+            ## Catch the keyboard interrupt (CTRL-C) and exit cleanly
+            ## we do not need to manually clean up the GPIO pins, the 
+            ## gpiozero library handles that process.
+            print("Cleaning up. Exiting...")
+
+            ## Stop the loop
+            repeat = False
+            sleep(1)
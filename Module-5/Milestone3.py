@@ -18,15 +18,26 @@
 #               requirements per industry standard best practices.
 #
 #    3          Cade Bray - Implemented milestone logic
+#
+#    4          Messages are compiled once into a MorseSchedule
+#               and played back on a monotonic clock. Toggling
+#               takes effect at the next symbol boundary.
+#
+#    5          The player drives the machine's own do_* events
+#               with a deadline per state. No handler sleeps or
+#               blocks, so stopping takes effect immediately.
+#
+#    6          The LEDs and display are claimed on first use and
+#               the script only runs when executed, so the module
+#               can be imported (e.g. to graph the machine) on any
+#               machine without touching the hardware.
 #------------------------------------------------------------------
 
+from functools import cached_property  # The devices are claimed on first use rather than when the class is defined
 from threading import Thread
 from time import sleep  # Import required to allow us to pause for a specified length of time
-from gpiozero import Button, LED  # Imports required to handle our Button, and our LED devices
 from statemachine import StateMachine, State  # Imports required to allow us to build a fully functional state machine
-import adafruit_character_lcd.character_lcd as character_lcd
-import board  # 1 of 2. Package for controlling LCD
-import digitalio  # 2 of 2 Package for controlling LCD
+from MorseSchedule import MORSE_CODE, MILESTONE_TIMING, MorsePlayer  # Compiled Morse schedules and their playback
 
 # DEBUG flag - boolean value to indicate whether to print status messages on the console of the program
 DEBUG = True
@@ -45,6 +56,9 @@ class ManagedDisplay:
         You need to make sure that the port mappings match the physical wiring of the display interface to the GPIO
         interface. Compatible with all versions of RPI as of Jan. 2019.
         """
+        import adafruit_character_lcd.character_lcd as character_lcd
+        import board  # 1 of 2. Package for controlling LCD
+        import digitalio  # 2 of 2 Package for controlling LCD
 
         self.lcd_rs = digitalio.DigitalInOut(board.D17)
         self.lcd_en = digitalio.DigitalInOut(board.D27)
@@ -95,10 +109,6 @@ class CWMachine(StateMachine):
     light for a dash.
     """
 
-    # Our two LEDs, utilizing GPIO 18, and GPIO 23
-    red_light = LED(18)
-    blue_light = LED(23)
-
     # Set the contents of our messages
     message1 = 'SOS'
     message2 = 'OK'
@@ -117,25 +127,14 @@ class CWMachine(StateMachine):
     letter_pause = State()  #  letterPause - dark for 750ms
     word_pause = State()  #  wordPause - dark for 3000ms
 
-    # Initialize our display
-    screen_lcd = ManagedDisplay()
-
     # A dictionary of Morse Code - this is a utility that will allow us to convert any common string into Morse code.
-    morse_dict = {
-        "A": ".-", "B": "-...", "C": "-.-.", "D": "-..",
-        "E": ".", "F": "..-.", "G": "--.", "H": "....",
-        "I": "..", "J": ".---", "K": "-.-", "L": ".-..",
-        "M": "--", "N": "-.", "O": "---", "P": ".--.",
-        "Q": "--.-", "R": ".-.", "S": "...", "T": "-",
-        "U": "..-", "V": "...-", "W": ".--", "X": "-..-",
-        "Y": "-.--", "Z": "--..", "0": "-----", "1": ".----",
-        "2": "..---", "3": "...--", "4": "....-", "5": ".....",
-        "6": "-....", "7": "--...", "8": "---..", "9": "----.",
-        "+": ".-.-.", "-": "-....-", "/": "-..-.", "=": "-...-",
-        ":": "---...", ".": ".-.-.-", "$": "...-..-", "?": "..--..",
-        "@": ".--.-.", "&": ".-...", "\"": ".-..-.", "_": "..--.-",
-        "|": "--...-", "(": "-.--.-", ")": "-.--.-"
-    }
+    morse_dict = MORSE_CODE
+
+    # Timing the messages are sent with. Use MorseSchedule.wpm_timing() for standard timing at a given speed.
+    timing = MILESTONE_TIMING
+
+    # Player that sends the compiled messages on our two LEDs, dots on red and dashes on blue
+    player = None
 
     # do_dot - Event that moves between the off-state (all-lights-off) and a 'dot'
     do_dot = (
@@ -162,9 +161,26 @@ class CWMachine(StateMachine):
             off.to(word_pause) | word_pause.to(off)
     )
 
+    @cached_property
+    def red_light(self):
+        """Our red LED, utilizing GPIO 18"""
+        from gpiozero import LED  # Imports required to handle our LED devices
+        return LED(18)
+
+    @cached_property
+    def blue_light(self):
+        """Our blue LED, utilizing GPIO 23"""
+        from gpiozero import LED
+        return LED(23)
+
+    @cached_property
+    def screen_lcd(self):
+        """Our display"""
+        return ManagedDisplay()
+
     def on_enter_dot(self):
         """on_enter_dot - Action performed when the state machine transitions into the dot state"""
-        self.red_light.blink(0.5, 0, 1, False)  # Red light comes on for 500ms
+        self.red_light.on()  # Red light comes on until the player leaves the state at its deadline
 
         if DEBUG:
             print("* Changing state to red - dot")
@@ -175,7 +191,7 @@ class CWMachine(StateMachine):
 
     def on_enter_dash(self):
         """on_enter_dash - Action performed when the state machine transitions into the dash state"""
-        self.blue_light.blink(1.5, 0, 1, False)  # Blue light comes on for 1500ms
+        self.blue_light.on()  # Blue light comes on until the player leaves the state at its deadline
 
         if DEBUG:
             print("* Changing state to blue - dash")
@@ -187,8 +203,7 @@ class CWMachine(StateMachine):
     @staticmethod
     def on_enter_dot_dash_pause():
         """on_enter_dotDashPause - Action performed when the state machine transitions into the dotDashPause state."""
-        sleep(0.25)  # wait for 250ms
-
+        # The pause lasts until the player leaves the state at its deadline
         if DEBUG:
             print("* Pausing Between Dots/Dashes - 250ms")
 
@@ -199,8 +214,7 @@ class CWMachine(StateMachine):
     @staticmethod
     def on_enter_letter_pause():
         """on_enter_letter_pause - Action performed when the state machine transitions into the letterPause state."""
-        sleep(0.75)  # wait for 750ms
-
+        # The pause lasts until the player leaves the state at its deadline
         if DEBUG:
             print("* Pausing Between Letters - 750ms")
 
@@ -211,8 +225,7 @@ class CWMachine(StateMachine):
     @staticmethod
     def on_enter_word_pause():
         """on_enter_word_pause - Action performed when the state machine transitions into the wordPause state"""
-        sleep(3)  # wait for 3000ms
-
+        # The pause lasts until the player leaves the state at its deadline
         if DEBUG:
             print("* Pausing Between Words - 3000ms")
 
@@ -221,14 +234,18 @@ class CWMachine(StateMachine):
         pass
 
     def toggle_message(self):
-        """toggle_message - method used to switch between message1 and message2"""
+        """
+        toggle_message - method used to switch between message1 and message2. The new message is compiled here and
+        starts at the next symbol boundary.
+        """
         if self.active_message == self.message1:
-            self.screen_lcd.update_screen(self.message2)
             self.active_message = self.message2
         else:
-            self.screen_lcd.update_screen(self.message1)
             self.active_message = self.message1
 
+        if self.player is not None:
+            self.player.load(self.active_message)
+
         if DEBUG:
             print(f"* Toggling active message to: {self.active_message} ")
 
@@ -247,94 +264,61 @@ class CWMachine(StateMachine):
         my_thread.start()
 
     def transmit(self):
-        """transmit - utility method used to continuously send a message"""
+        """
+        transmit - utility method used to continuously send a message. The active message is played from its compiled
+        schedule, repeating until we are shutdown. The player sends our do_* events at each state's deadline.
+        """
+        self.player = MorsePlayer(timing=self.timing, machine=self,
+                                  on_start=lambda message: self.screen_lcd.update_screen(f"Sending:\n{message}"))
+        self.player.load(self.active_message)
 
         # Loop until we are shutdown
-        while not self.end_transmission:
-
-            # Display the active message in our 16x2 screen
-            self.screen_lcd.update_screen(f"Sending:\n{self.active_message}")
-
-            # Parse message for individual wordsTAM
-            word_list = self.active_message.split()
-
-            # Setup counter to determine time buffer after words
-            len_words = len(word_list)
-            words_counter = 1
-            for word in word_list:
-
-                # Setup counter to determine time buffer after letters
-                len_word = len(word)
-                word_counter = 1
-                for char in word:
-
-                    # Convert the character to its string in morse code
-                    morse = self.morse_dict.get(char)
-
-                    # Setup counter to determine time buffer after letters
-                    len_morse = len(morse)
-                    morse_counter = 1
-                    for x in morse:
-                        match x:
-                            case '.':
-                                self.on_enter_dot()
-                                self.on_exit_dot()
-                            case '-':
-                                self.on_enter_dash()
-                                self.on_exit_dash()
-
-                        # If we are still sending process a dotDashPause event
-                        if morse_counter <= len_morse:
-                            morse_counter += 1
-                            self.on_enter_dot_dash_pause()
-                            self.on_exit_dot_dash_pause()
-
-                    # If we are still sending process a letterPause event
-                    if word_counter <= len_word:
-                        word_counter += 1
-                        self.on_enter_letter_pause()
-                        self.on_exit_letter_pause()
-
-                # If we are still sending process a wordPause event
-                if words_counter <= len_words:
-                    words_counter += 1
-                    self.on_enter_word_pause()
-                    self.on_exit_word_pause()
+        if not self.end_transmission:
+            self.player.play()
 
         # Cleanup the display i.e. clear it
         self.screen_lcd.cleanup_display()
 
-    # End class CWMachine definition
-
+    def stop_transmission(self):
+        """stop_transmission - Stop sending. The message stops at once rather than after the current word."""
+        self.end_transmission = True
+        if self.player is not None:
+            self.player.stop()
 
-# Initialize our State Machine, and begin transmission
-cwMachine = CWMachine()
-cwMachine.run()
+    # End class CWMachine definition
 
-# greenButton - set up our Button, tied to GPIO 24. Configure the action to be taken when the button is pressed to be
-# the execution of the processButton function in our State Machine.
-greenButton = Button(24)
-greenButton.when_activated = cwMachine.toggle_message
 
-# Setup loop variable
-repeat = True
-while repeat:  # Repeat until the user creates a keyboard interrupt (CTRL-C)
-    try:
-        # Only display if the DEBUG flag is set
-        if DEBUG:
-            print("Killing time in a loop...")
-
-        # sleep for 20 seconds at a time. This value is not crucial, all the work for this application is handled by the
-        # Button.when_pressed event process
-        sleep(20)
-    except KeyboardInterrupt:
-        # Catch the keyboard interrupt (CTRL-C) and exit cleanly we do not need to manually clean up the GPIO pins, the
-        # gpiozero library handles that process.
-        print("Cleaning up. Exiting...")
-
-        # Stop the loop
-        repeat = False
-
-        # Cleanly exit the state machine after completing the last message
-        cwMachine.end_transmission = True
-        sleep(1)
+if __name__ == '__main__':
+    from gpiozero import Button  # Import required to handle our Button
+
+    # Initialize our State Machine, and begin transmission
+    cwMachine = CWMachine()
+    cwMachine.run()
+
+    # greenButton - set up our Button, tied to GPIO 24. Configure the action to be taken when the button is pressed to
+    # be the execution of the processButton function in our State Machine.
+    greenButton = Button(24)
+    greenButton.when_activated = cwMachine.toggle_message
+
+    # Setup loop variable
+    repeat = True
+    while repeat:  # Repeat until the user creates a keyboard interrupt (CTRL-C)
+        try:
+            # Only display if the DEBUG flag is set
+            if DEBUG:
+                print("Killing time in a loop...")
+
+            # sleep for 20 seconds at a time. This value is not crucial, all the work for this application is handled by
+            # the Button.when_pressed event process
+            sleep(20)
+        except KeyboardInterrupt:
+            # Catch the keyboard interrupt (CTRL-C) and exit cleanly we do not need to manually clean up the GPIO pins,
+            # the gpiozero library handles that process.
+            print("Cleaning up. Exiting...")
+
+            # Stop the loop
+            repeat = False
+
+            # Cleanly exit the state machine
+            cwMachine.stop_transmission()
+            sleep(1)
@@ -0,0 +1,212 @@
+# MorseSchedule.py - Compiles a message into a flat Morse code timing
+# schedule and plays it back against a monotonic clock, either on
+# LEDs directly or by driving a state machine's events. The message
+# is compiled once, when it is loaded, into a tuple of
+# (pin, level, duration, event) steps. Playback walks that tuple
+# with absolute deadlines, so the time taken to switch an LED never
+# accumulates into drift.
+#
+# This code works with the test circuit that was built for module 5.
+#
+#------------------------------------------------------------------
+# Change History
+#------------------------------------------------------------------
+# Version   |   Description
+#------------------------------------------------------------------
+#    1          Initial Development
+#
+#    2          Steps carry the state machine event for their
+#               state and the player can drive a state machine.
+#------------------------------------------------------------------
+
+from collections import namedtuple
+from functools import lru_cache  # Each message is only compiled once per timing
+from threading import Event
+from time import monotonic  # A monotonic clock can't jump when the wall clock is adjusted
+
+# A dictionary of Morse Code - this is a utility that will allow us to convert any common string into Morse code.
+MORSE_CODE = {
+    "A": ".-", "B": "-...", "C": "-.-.", "D": "-..",
+    "E": ".", "F": "..-.", "G": "--.", "H": "....",
+    "I": "..", "J": ".---", "K": "-.-", "L": ".-..",
+    "M": "--", "N": "-.", "O": "---", "P": ".--.",
+    "Q": "--.-", "R": ".-.", "S": "...", "T": "-",
+    "U": "..-", "V": "...-", "W": ".--", "X": "-..-",
+    "Y": "-.--", "Z": "--..", "0": "-----", "1": ".----",
+    "2": "..---", "3": "...--", "4": "....-", "5": ".....",
+    "6": "-....", "7": "--...", "8": "---..", "9": "----.",
+    "+": ".-.-.", "-": "-....-", "/": "-..-.", "=": "-...-",
+    ":": "---...", ".": ".-.-.-", "$": "...-..-", "?": "..--..",
+    "@": ".--.-.", "&": ".-...", "\"": ".-..-.", "_": "..--.-",
+    "|": "--...-", "(": "-.--.-", ")": "-.--.-"
+}
+
+# Output index of the LED used for each symbol. Dots are sent on the red LED and dashes on the blue LED.
+DOT_PIN = 0
+DASH_PIN = 1
+
+# Timing - Durations in seconds. Each gap is the whole dark time between two elements, they are not added together.
+Timing = namedtuple('Timing', ['dot', 'dash', 'symbol_gap', 'letter_gap', 'word_gap'])
+
+# The timings in the milestone requirements: dot 500ms, dash 1500ms, 250ms between dots and dashes, 750ms between
+# letters and 3000ms between words.
+MILESTONE_TIMING = Timing(0.5, 1.5, 0.25, 0.75, 3.0)
+
+# Step - One entry of a compiled schedule. The LED at index pin is set to level and held for duration seconds. event is
+# the state machine event that enters the matching state, and leaves it again when sent a second time.
+Step = namedtuple('Step', ['pin', 'level', 'duration', 'event'])
+
+# State machine events for the symbols and for the gap that follows them
+SYMBOL_EVENTS = {'.': 'do_dot', '-': 'do_dash'}
+GAP_EVENTS = {' ': 'do_lp', '/': 'do_wp'}
+
+
+def wpm_timing(wpm):
+    """
+    wpm_timing - Standard Morse timing for a speed in words per minute, using the 50 unit word PARIS. A dot is one unit,
+    a dash three, the gap inside a letter one, between letters three and between words seven.
+
+    @param wpm is the speed in words per minute.
+    @return a Timing.
+    """
+    unit = 1.2 / wpm
+    return Timing(unit, 3 * unit, unit, 3 * unit, 7 * unit)
+
+
+@lru_cache(maxsize=32)
+def compile_message(message, timing=MILESTONE_TIMING):
+    """
+    compile_message - Compile a message into a flat schedule. Every symbol is an on step followed by an off step, and
+    the off step carries whichever gap follows the symbol. The last symbol is followed by a word gap so the schedule
+    can be repeated back to back. Characters that have no Morse code are skipped.
+
+    @param message is the text to send. Case is ignored.
+    @param timing is the Timing to compile with.
+    @return a tuple of Steps, empty if nothing in the message can be sent.
+    """
+    symbols = []
+    for word in message.upper().split():
+        letters = [MORSE_CODE[char] for char in word if char in MORSE_CODE]
+        if not letters:
+            continue
+        for letter in letters:
+            symbols.extend(letter)
+            symbols.append(' ')
+        symbols[-1] = '/'
+
+    steps = []
+    for symbol, following in zip(symbols, symbols[1:] + [None]):
+        if symbol in ' /':
+            continue
+        pin, duration = (DOT_PIN, timing.dot) if symbol == '.' else (DASH_PIN, timing.dash)
+        gap = {' ': timing.letter_gap, '/': timing.word_gap}.get(following, timing.symbol_gap)
+        steps.append(Step(pin, True, duration, SYMBOL_EVENTS[symbol]))
+        steps.append(Step(pin, False, gap, GAP_EVENTS.get(following, 'do_ddp')))
+    return tuple(steps)
+
+
+class MorsePlayer:
+    """
+    MorsePlayer - Plays compiled schedules, repeating the current message until another is loaded or the player is
+    stopped. A newly loaded message takes over at the next symbol boundary, i.e. as soon as the LED that is lit has gone
+    dark again. Each step lasts until its deadline, and the wait for it returns as soon as stop() is called.
+
+    Without a machine the player switches the LEDs itself. With a machine each step's event is sent to enter its state
+    at the start of the step and sent again to leave it at the deadline, and the machine's handlers drive the LEDs.
+    """
+
+    def __init__(self, outputs=(), timing=MILESTONE_TIMING, clock=monotonic, on_start=None, machine=None):
+        """
+        Set up the player with nothing loaded.
+
+        @param outputs is a sequence of LEDs (anything with on() and off()) indexed by the step pins. Not used when a
+        machine is given.
+        @param timing is the Timing messages are compiled with.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param on_start is an optional callable on_start(message) called when a newly loaded message starts playing.
+        @param machine is an optional state machine with the do_dot, do_dash, do_ddp, do_lp and do_wp events.
+        """
+        self.outputs = outputs
+        self.machine = machine
+        self.timing = timing
+        self.clock = clock
+        self.on_start = on_start
+
+        # (message, steps) waiting to take over at the next symbol boundary. Replacing a tuple is atomic.
+        self._pending = None
+
+        self._stop_event = Event()
+        self._wake_event = Event()
+
+        # Statistics
+        self.steps_played = 0
+        self.max_lateness = 0.0
+
+    def load(self, message):
+        """
+        load - Compile a message and queue it to start at the next symbol boundary.
+
+        @param message is the text to send.
+        """
+        self._pending = (message, compile_message(message, self.timing))
+        self._wake_event.set()
+
+    def _enter(self, step):
+        """_enter - Start a step."""
+        if self.machine is not None:
+            self.machine.send(step.event)
+        elif step.level:
+            self.outputs[step.pin].on()
+        else:
+            self.outputs[step.pin].off()
+
+    def _leave(self, step):
+        """_leave - Finish a step. Only a machine has anything to do, it goes back to its off state."""
+        if self.machine is not None:
+            self.machine.send(step.event)
+
+    def stop(self):
+        """stop - Ask play() to return. The LEDs are turned off on the way out."""
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def play(self):
+        """play - Play the loaded messages until stop() is called. Blocks, so run it on its own thread."""
+        steps = ()
+        index = 0
+        deadline = self.clock()
+
+        while not self._stop_event.is_set():
+            # Symbol boundaries fall between an off step and the next on step
+            if index % 2 == 0 and self._pending is not None:
+                message, steps = self._pending
+                self._pending = None
+                index = 0
+                if self.on_start is not None:
+                    self.on_start(message)
+
+            if not steps:
+                # Nothing that can be sent, wait for another message
+                self._wake_event.wait()
+                self._wake_event.clear()
+                deadline = self.clock()
+                continue
+
+            step = steps[index]
+            self.max_lateness = max(self.max_lateness, self.clock() - deadline)
+            self._enter(step)
+            self.steps_played += 1
+
+            # The next deadline comes from the schedule, not from when this step actually started
+            deadline += step.duration
+            index = (index + 1) % len(steps)
+
+            remaining = deadline - self.clock()
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+            self._leave(step)
+
+        for output in self.outputs:
+            output.off()
+
+    # End class MorsePlayer definition
@@ -0,0 +1,88 @@
+#
+# SensorArbiter.py - Shared access to an AHT20 temperature and humidity
+# sensor for the module 6 scripts.
+#
+# Reading adafruit_ahtx0's temperature and then its relative_humidity
+# property triggers two 80ms measurement cycles, one per property. The
+# arbiter triggers one cycle and keeps both values from it, and readers
+# that ask again while that measurement is still fresh get it back
+# without another bus transaction. A reader that asks while another one
+# is measuring waits for that measurement instead of starting its own.
+#
+#------------------------------------------------------------------
+# Change History
+#------------------------------------------------------------------
+# Version   |   Description
+#------------------------------------------------------------------
+#    1          Initial Development
+#------------------------------------------------------------------
+
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+
+# Measurement - One measurement cycle. celsius is degrees Celsius, humidity is percent relative humidity and timestamp
+# is the monotonic time the measurement finished.
+Measurement = namedtuple('Measurement', ['celsius', 'humidity', 'timestamp'])
+
+
+def measure(sensor):
+    """
+    measure - Trigger one measurement cycle and read both values from it.
+
+    @param sensor is an adafruit_ahtx0.AHTx0, or anything with temperature and relative_humidity properties.
+    @return a tuple of (celsius, humidity).
+    """
+    # The driver has no public call that returns both values from one cycle. _readdata() triggers the cycle and
+    # stores both values, and this is the only place that relies on it.
+    if hasattr(sensor, '_readdata'):
+        sensor._readdata()
+        return sensor._temp, sensor._humidity
+    return sensor.temperature, sensor.relative_humidity
+
+
+class SensorArbiter:
+    """
+    SensorArbiter - Serializes the reads of one sensor and shares each measurement between the readers that ask for it
+    within max_age seconds.
+    """
+
+    def __init__(self, sensor, max_age=1.0, clock=monotonic):
+        """
+        Set up the arbiter.
+
+        @param sensor is the sensor, see measure().
+        @param max_age is the oldest a measurement can be, in seconds, and still be handed to a reader.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        """
+        self.sensor = sensor
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = Lock()
+        self._last = None
+
+        # Statistics
+        self.reads = 0
+        self.shared = 0
+
+    def read(self, max_age=None):
+        """
+        read - The latest measurement, taking a new one if the last is older than max_age. Only one reader measures at
+        a time, and readers that waited for it get its result.
+
+        @param max_age overrides the arbiter's max_age for this read. 0 always measures.
+        @return a Measurement.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        with self._lock:
+            last = self._last
+            if last is not None and self.clock() - last.timestamp < max_age:
+                self.shared += 1
+                return last
+
+            celsius, humidity = measure(self.sensor)
+            self._last = Measurement(celsius, humidity, self.clock())
+            self.reads += 1
+            return self._last
+
+    # End class SensorArbiter definition
@@ -21,10 +21,22 @@
 #    2          CB - Revised file to adhere to PEP requirements on
 #                    documentation and docstrings.
 #    3          CB - Adjusted process button to toggle temp unit.
+#
+#    4          Each display refresh takes one sensor measurement
+#               and reads the temperature and humidity from it.
+#
+#    5          The LEDs, display and sensor are claimed on first
+#               use and the script only runs when executed, so the
+#               module can be imported without the hardware.
+#
+#    6          The sensor is read through a SensorArbiter, and the
+#               getters refresh any measurement older than a second
+#               instead of returning the first one forever.
 #------------------------------------------------------------------
 
-#Imports required to handle our Button, and our LED devices
-from gpiozero import Button, LED
+# The devices are claimed on first use rather than when the class is defined. The driver packages are imported where
+# each device is created, so importing this module doesn't need them.
+from functools import cached_property
 
 # Imports required to allow us to build a fully functional state machine
 from statemachine import StateMachine, State
@@ -33,21 +45,18 @@ from statemachine import StateMachine, State
 from time import sleep
 from datetime import datetime
 
-# These are the packages that we need to pull in so that we can work with the GPIO interface on the Raspberry Pi board
-# and work with the 16x2 LCD
-import board
-import digitalio
-import adafruit_character_lcd.character_lcd as characterlcd
-
-# This is the package we need for our Temperature Sensor
-import adafruit_ahtx0
-
 # Threads are required so that we can manage multiple tasks at the same time
 from threading import Thread
 
+# One measurement cycle shared by every reader of the sensor
+from SensorArbiter import SensorArbiter
+
 # DEBUG flag - boolean value to indicate whether to print status messages on the console of the program
 DEBUG = True
 
+# Oldest a measurement can be, in seconds, before the getters take a new one. The display refreshes every second.
+MAX_AGE = 1.0
+
 
 class ManagedDisplay:
     """
@@ -62,6 +71,12 @@ class ManagedDisplay:
         the port mappings match the physical wiring of the display interface to the GPIO interface. Compatible with
         all versions of RPI as of Jan. 2019
         """
+        # These are the packages that we need to pull in so that we can work with the GPIO interface on the Raspberry
+        # Pi board and work with the 16x2 LCD
+        import board
+        import digitalio
+        import adafruit_character_lcd.character_lcd as characterlcd
+
         self.lcd_rs = digitalio.DigitalInOut(board.D17)
         self.lcd_en = digitalio.DigitalInOut(board.D27)
         self.lcd_d4 = digitalio.DigitalInOut(board.D5)
@@ -110,10 +125,6 @@ class TempMachine(StateMachine):
     necessary state to display temperature information in Celsius or Fahrenheit
     """
 
-    # Our two LEDs, utilizing GPIO 18, and GPIO 23
-    redLight = LED(18)
-    blueLight = LED(23)
-
     # Set the contents of our scale
     scale1 = 'F'
     scale2 = 'C'
@@ -127,18 +138,35 @@ class TempMachine(StateMachine):
     Celsius = State(initial = True)
     Fahrenheit = State()
 
-    # Configure our display
-    screen = ManagedDisplay()
-
-    # Configure our temperature sensor
-    i2c = board.I2C()
-    thSensor = adafruit_ahtx0.AHTx0(i2c)
-
     # doDot - Event that moves between the off-state (all-lights-off) and a 'dot'
     cycle = (
         Celsius.to(Fahrenheit) | Fahrenheit.to(Celsius)
     )
 
+    @cached_property
+    def redLight(self):
+        """Our red LED, utilizing GPIO 18"""
+        from gpiozero import LED  # Imports required to handle our LED devices
+        return LED(18)
+
+    @cached_property
+    def blueLight(self):
+        """Our blue LED, utilizing GPIO 23"""
+        from gpiozero import LED
+        return LED(23)
+
+    @cached_property
+    def screen(self):
+        """Our display"""
+        return ManagedDisplay()
+
+    @cached_property
+    def thSensor(self):
+        """Our temperature sensor on the I2C bus, read through an arbiter so readers share each measurement"""
+        import board
+        import adafruit_ahtx0  # This is the package we need for our Temperature Sensor
+        return SensorArbiter(adafruit_ahtx0.AHTx0(board.I2C()), MAX_AGE)
+
     def on_enter_celsius(self):
         """on_enter_Celsius - Action performed when the state machine transitions into the Celsius state"""
         self.activeScale = self.scale2
@@ -172,18 +200,25 @@ class TempMachine(StateMachine):
         my_thread = Thread(target=self.display_temp)
         my_thread.start()
 
+    def read_sensor(self):
+        """
+        read_sensor - The latest measurement of both values, taken with one measurement cycle if the last one is older
+        than MAX_AGE. Reading the temperature and relative_humidity properties would trigger an 80ms cycle each.
+        """
+        return self.thSensor.read()
+
     def get_fahrenheit(self):
-        """Get the temperature in Fahrenheit"""
-        t = self.thSensor.temperature
+        """Get the measured temperature in Fahrenheit"""
+        t = self.get_celsius()
         return ((9 / 5) * t) + 32
 
     def get_celsius(self):
-        """Get the temperature in Celsius"""
-        return self.thSensor.temperature
+        """Get the measured temperature in Celsius, no older than MAX_AGE"""
+        return self.read_sensor().celsius
 
     def get_rh(self):
-        """Get the Relative Humidity"""
-        return self.thSensor.relative_humidity
+        """Get the measured Relative Humidity, no older than MAX_AGE"""
+        return self.read_sensor().humidity
 
     # Flag to indicate whether to shut down the thread
     endDisplay = False
@@ -198,11 +233,12 @@ class TempMachine(StateMachine):
             # Setup line 1
             line1 = datetime.now().strftime('%b %d  %H:%M:%S\n')
 
-            # Setup line 2
+            # Setup line 2 from a single measurement
+            celsius, humidity, _ = self.read_sensor()
             if self.activeScale == 'C':
-                line2 = f"T:{self.get_celsius():0.1f}C H:{self.get_rh():0.1f}%"
+                line2 = f"T:{celsius:0.1f}C H:{humidity:0.1f}%"
             else:
-                line2 = f"T:{self.get_fahrenheit():0.1f}F H:{self.get_rh():0.1f}%"
+                line2 = f"T:{((9 / 5) * celsius) + 32:0.1f}F H:{humidity:0.1f}%"
 
             self.screen.update_screen(line1 + line2)
             sleep(1)
@@ -212,36 +248,39 @@ class TempMachine(StateMachine):
     # End class CWMachine definition
 
 
-# Initialize our State Machine, and begin transmission
-tempMachine = TempMachine()
-tempMachine.run()
+if __name__ == '__main__':
+    from gpiozero import Button  # Import required to handle our Button
 
-# greenButton - set up our Button, tied to GPIO 24. Configure the action to be taken when the button is pressed to be the
-# execution of the processButton function in our State Machine
-greenButton = Button(24)
-greenButton.when_pressed = tempMachine.process_button
+    # Initialize our State Machine, and begin transmission
+    tempMachine = TempMachine()
+    tempMachine.run()
 
-# Setup loop variable
-repeat = True
+    # greenButton - set up our Button, tied to GPIO 24. Configure the action to be taken when the button is pressed to
+    # be the execution of the processButton function in our State Machine
+    greenButton = Button(24)
+    greenButton.when_pressed = tempMachine.process_button
 
-# Repeat until the user creates a keyboard interrupt (CTRL-C)
-while repeat:
-    try:
-        # Only display if the DEBUG flag is set
-        if DEBUG:
-            print("Killing time in a loop...")
-
-        # sleep for 20 seconds at a time. This value is not crucial, all the work for this application is handled by the
-        # Button.when_pressed event process
-        sleep(20)
-    except KeyboardInterrupt:
-        # Catch the keyboard interrupt (CTRL-C) and exit cleanly we do not need to manually clean up the GPIO pins, the
-        # gpiozero library handles that process.
-        print("Cleaning up. Exiting...")
-
-        # Stop the loop
-        repeat = False
-        
-        # Cleanly exit the state machine after completing the last message
-        tempMachine.endDisplay = True
-        sleep(1)
\ No newline at end of file
+    # Setup loop variable
+    repeat = True
+
+    # Repeat until the user creates a keyboard interrupt (CTRL-C)
+    while repeat:
+        try:
+            # Only display if the DEBUG flag is set
+            if DEBUG:
+                print("Killing time in a loop...")
+
+            # sleep for 20 seconds at a time. This value is not crucial, all the work for this application is handled by
+            # the Button.when_pressed event process
+            sleep(20)
+        except KeyboardInterrupt:
+            # Catch the keyboard interrupt (CTRL-C) and exit cleanly we do not need to manually clean up the GPIO pins,
+            # the gpiozero library handles that process.
+            print("Cleaning up. Exiting...")
+
+            # Stop the loop
+            repeat = False
+
+            # Cleanly exit the state machine after completing the last message
+            tempMachine.endDisplay = True
+            sleep(1)
@@ -10,6 +10,12 @@
 # Version   |   Description
 #------------------------------------------------------------------
 #    1          Initial Development
+#
+#    2          Read the temperature and humidity from a single
+#               measurement cycle instead of one cycle each.
+#
+#    3          The measurement is taken through SensorArbiter
+#               instead of the driver's private attributes.
 #------------------------------------------------------------------
 
 ## Import necessary to provide timing in the main loop
@@ -23,6 +29,11 @@ from time import sleep
 import board
 import adafruit_ahtx0
 
+##
+## Arbiter that takes one measurement cycle for both values
+##
+from SensorArbiter import SensorArbiter
+
 ##
 ## Create an I2C instance so that we can communicate with
 ## devices on the I2C bus.
@@ -32,7 +43,7 @@ i2c = board.I2C()
 ##
 ## Initialize our Temperature and Humidity sensor
 ##
-thSensor = adafruit_ahtx0.AHTx0(i2c)
+thSensor = SensorArbiter(adafruit_ahtx0.AHTx0(i2c))
 
 ##
 ## Set up the flag that will control our main loop
@@ -51,8 +62,12 @@ while repeat:
         ## should be +/- .3 degrees for tempeature and 
         ## +/- 2% for humidity
         ##
-        print("\nTemperature: %0.1f C" % thSensor.temperature)
-        print("RH: %0.1f %%" % thSensor.relative_humidity)
+        ## Each property access triggers its own 80ms measurement,
+        ## so trigger one and read both values from it.
+        ##
+        measurement = thSensor.read()
+        print("\nTemperature: %0.1f C" % measurement.celsius)
+        print("RH: %0.1f %%" % measurement.humidity)
         sleep(5)
     except KeyboardInterrupt:
         ## Catch the keyboard interrupt and exit gracefully
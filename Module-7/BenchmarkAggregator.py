@@ -0,0 +1,122 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+BenchmarkAggregator.py - Measures the sustained throughput and per-line latency of the ThermostatAggregator as the
+number of devices grows. Each simulated thermostat is a pty pair. A writer thread sends report lines into the pty
+controllers as fast as they are accepted, and the aggregator reads the other ends on its event loop. Latency is the time
+from a line being written to it being parsed into the device table.
+
+Usage: python BenchmarkAggregator.py [seconds per run] [device counts ...]
+"""
+
+import asyncio
+import os
+import sys
+import tty
+
+from collections import deque
+from threading import Thread, Event
+from time import perf_counter, sleep
+
+from ThermostatAggregator import TelemetryAggregator
+
+# Lines written to a device per turn of the writer thread
+BATCH = 16
+
+LINES = [b'heat,71.3F,72F\n', b'cool,74.8F,70F\n', b'off,69.0F,68F\n']
+
+
+def percentile(values, fraction):
+    """
+    percentile - Nearest rank percentile.
+
+    @param values is a sorted list.
+    @param fraction is the percentile as a fraction, e.g. 0.99.
+    @return the value at that percentile, or 0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def writer(controllers, sent, stop):
+    """
+    writer - Write batches of report lines round robin into every pty until stopped. The writes block when a pty is
+    full, so the writer runs exactly as fast as the aggregator drains the ptys.
+
+    @param controllers is the list of pty controller file descriptors.
+    @param sent is a list of deques, one per device, that the send time of every line is appended to.
+    @param stop is the Event that ends the writer.
+    """
+    payload = b''.join(LINES[i % len(LINES)] for i in range(BATCH))
+    while not stop.is_set():
+        for fd, times in zip(controllers, sent):
+            # Times are queued before the write so the aggregator can never parse a line before its time is recorded
+            times.extend([perf_counter()] * BATCH)
+            os.write(fd, payload)
+        sleep(0)
+
+
+async def run(devices, seconds):
+    """
+    run - Benchmark one device count.
+
+    @param devices is the number of simulated thermostats.
+    @param seconds is how long to run.
+    @return a tuple of (lines per second, sorted latencies in seconds).
+    """
+    pairs = [os.openpty() for _ in range(devices)]
+    for controller, device in pairs:
+        tty.setraw(device)
+
+    sent = [deque() for _ in range(devices)]
+    latencies = []
+    index = {f'dev{number}': number for number in range(devices)}
+
+    def on_report(name, state):
+        latencies.append(perf_counter() - sent[index[name]].popleft())
+
+    aggregator = TelemetryAggregator(on_report)
+    tasks = [asyncio.create_task(aggregator.watch_fd(f'dev{number}', device))
+             for number, (_, device) in enumerate(pairs)]
+
+    stop = Event()
+    thread = Thread(target=writer, args=([controller for controller, _ in pairs], sent, stop), daemon=True)
+    started = perf_counter()
+    thread.start()
+
+    await asyncio.sleep(seconds)
+    stop.set()
+    elapsed = perf_counter() - started
+
+    # Let the aggregator drain whatever the writer still has in flight so its last write can complete
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for controller, device in pairs:
+        os.close(controller)
+        os.close(device)
+
+    latencies.sort()
+    return aggregator.reports / elapsed, latencies
+
+
+if __name__ == '__main__':
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    counts = [int(argument) for argument in sys.argv[2:]] or [1, 2, 4, 8, 16, 32, 64]
+
+    print(f"{'devices':>8} {'lines/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for count in counts:
+        rate, latency = asyncio.run(run(count, duration))
+        print(f"{count:>8} {rate:>10.0f} {percentile(latency, 0.5) * 1000:>8.2f} "
+              f"{percentile(latency, 0.95) * 1000:>8.2f} {percentile(latency, 0.99) * 1000:>8.2f} "
+              f"{(latency[-1] if latency else 0) * 1000:>8.2f}")
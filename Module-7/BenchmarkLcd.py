@@ -0,0 +1,139 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+BenchmarkLcd.py - Times full frame writes to the 16x2 LCD through the bulk write driver and through the
+adafruit_character_lcd driver. A full frame moves the cursor to each row and writes all 16 characters, the worst case
+for the FrameRenderer.
+
+On a Raspberry Pi with the LCD wired both drivers are run against the panel. Anywhere else, or with --emulate, the bulk
+driver runs against an emulated panel that decodes the bus writes, which checks the frames arrive intact and measures
+the driver's own overhead.
+
+Usage: python BenchmarkLcd.py [--emulate] [frames]
+"""
+
+import sys
+
+from time import perf_counter
+
+import Hardware
+from Hd44780 import BulkHD44780, SET_DDRAM, ROW_OFFSETS
+
+FRAMES = [f"{'Temp':<9}{number % 100:>6}F\n{'Set':<9}{72 + number % 5:>6}F" for number in range(10)]
+
+
+class EmulatedRequest:
+    """
+    EmulatedRequest - A line request that decodes the HD44780 4 bit bus like the panel does, latching data on the
+    falling edge of enable, so the text written can be checked. The panel powers up in 8 bit mode, so the first four
+    strobes of the initialization sequence are single nibble commands and only switch it to 4 bit mode.
+    """
+
+    def __init__(self, pins):
+        """
+        Set up an emulated panel on the (rs, en, d4, d5, d6, d7) lines.
+        """
+        self.rs, self.en, *self.data = pins
+        self.lines = {line: False for line in pins}
+        self.ddram = bytearray(b' ' * 0x80)
+        self.address = 0
+        self.pending = None
+        self.writes = 0
+        self.strobes = 0
+
+    def set_values(self, values):
+        """set_values - Apply one bulk write."""
+        self.writes += 1
+        falling = self.lines[self.en] and not values.get(self.en, True)
+        self.lines.update(values)
+        if not falling:
+            return
+        self.strobes += 1
+        if self.strobes <= 4:
+            return
+
+        nibble = sum(1 << bit for bit, line in enumerate(self.data) if self.lines[line])
+        if self.pending is None:
+            self.pending = nibble
+            return
+        value = self.pending << 4 | nibble
+        self.pending = None
+
+        if self.lines[self.rs]:
+            self.ddram[self.address] = value
+            self.address += 1
+        elif value & SET_DDRAM:
+            self.address = value & 0x7F
+        elif value == 0x01:
+            self.ddram[:] = b' ' * 0x80
+            self.address = 0
+
+    def text(self, columns=16, rows=2):
+        """text - The emulated panel's text, one line per row."""
+        return '\n'.join(self.ddram[offset:offset + columns].decode() for offset in ROW_OFFSETS[:rows])
+
+    def release(self):
+        """release - Nothing to release."""
+
+    # End class EmulatedRequest definition
+
+
+def time_frames(lcd, frames):
+    """
+    time_frames - Write full frames and time them.
+
+    @param lcd is the LCD driver.
+    @param frames is the number of frames to write.
+    @return the mean seconds per frame.
+    """
+    started = perf_counter()
+    for number in range(frames):
+        lcd.column = 0
+        lcd.row = 0
+        lcd.message = FRAMES[number % len(FRAMES)]
+    return (perf_counter() - started) / frames
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    emulate = '--emulate' in arguments
+    if emulate:
+        arguments.remove('--emulate')
+    frames = int(arguments[0]) if arguments else 200
+
+    backend = Hardware.use_backend('pi')
+    results = {}
+
+    if not emulate:
+        try:
+            lcd, pins = backend.bulk_lcd()
+            results['bulk (gpiod)'] = time_frames(lcd, frames)
+            lcd.deinit()
+        except (ImportError, OSError) as error:
+            print(f"Bulk driver unavailable ({error}), emulating the panel instead")
+            emulate = True
+
+    if emulate:
+        request = EmulatedRequest(Hardware.LCD_PINS)
+        lcd = BulkHD44780(request, Hardware.LCD_PINS)
+        results['bulk (emulated panel)'] = time_frames(lcd, frames)
+        expected = FRAMES[(frames - 1) % len(FRAMES)].split('\n')
+        print(f"Emulated panel shows the last frame intact: {request.text().split(chr(10)) == expected}")
+        print(f"Bus writes per frame: {request.writes / frames:0.0f}")
+    else:
+        try:
+            lcd, pins = backend.adafruit_lcd()
+            results['adafruit_character_lcd'] = time_frames(lcd, frames)
+            for pin in pins:
+                pin.deinit()
+        except (ImportError, OSError) as error:
+            print(f"adafruit driver unavailable ({error})")
+
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds * 1000:8.3f} ms per full frame ({1 / seconds:0.0f} frames/s)")
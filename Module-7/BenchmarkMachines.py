@@ -0,0 +1,324 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+BenchmarkMachines.py - Throughput of every state machine in Modules 5 to 7 on the simulated hardware backend:
+    - TemperatureMachine   send('cycle')
+    - LightMachine         processButton()
+    - CWMachine            the do_* events, each entering and then leaving its state
+    - TempMachine          process_button()
+
+Each machine is benchmarked with its DEBUG output on and off. The prints go to /dev/null, and TemperatureMachine traces
+into a ring buffer instead of printing. For every run the suite measures the events per second, the distribution of the
+time per event, the memory each event allocates at its peak and the memory it leaves allocated, and the time spent in
+each before_*, on_enter_* and on_exit_* hook. The hooks are timed in a subclass whose hooks wrap the machine's own, so
+they run exactly as they would in the machine.
+
+Each run is done in a fresh interpreter so the machines don't share GPIO pins, imports or allocator state. The results
+are written as JSON, with the commit they were measured at, so runs can be compared across commits.
+
+Usage: python BenchmarkMachines.py [--events N] [--output FILE] [--compare FILE] [machine ...]
+"""
+
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tracemalloc
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from time import perf_counter, perf_counter_ns
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_5 = os.path.join(os.path.dirname(HERE), 'Module-5')
+MODULE_6 = os.path.join(os.path.dirname(HERE), 'Module-6')
+
+# Version of the results file layout
+RESULTS_VERSION = 1
+
+# Default results file
+RESULTS_FILE = 'machines-benchmark.json'
+
+# Events timed per run, and the share of them also run under tracemalloc
+EVENTS = 5000
+ALLOCATION_EVENTS = 500
+
+# Hook name prefixes that are timed
+HOOK_PREFIXES = ('before_', 'on_enter_', 'on_exit_', 'after_')
+
+# The do_* events of CWMachine, each sent twice to enter its state and leave it again
+CW_EVENTS = ('do_dot', 'do_dot', 'do_dash', 'do_dash', 'do_ddp', 'do_ddp', 'do_lp', 'do_lp', 'do_wp', 'do_wp')
+
+
+def _percentile(ordered, fraction):
+    """_percentile - Value at a fraction of a sorted list."""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def timed_subclass(machine_class, timings):
+    """
+    timed_subclass - A subclass of a machine whose hooks time themselves. The wrappers keep the hooks' signatures, so
+    python-statemachine passes them the same arguments.
+
+    @param machine_class is the StateMachine class.
+    @param timings is a dictionary the hook times in nanoseconds are appended to, by hook name.
+    @return the subclass.
+    """
+    def wrap(name, function):
+        times = timings.setdefault(name, [])
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            started = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times.append(perf_counter_ns() - started)
+        return timed
+
+    namespace = {}
+    for cls in reversed(machine_class.__mro__):
+        for name, attribute in vars(cls).items():
+            if not name.startswith(HOOK_PREFIXES):
+                continue
+            if isinstance(attribute, staticmethod):
+                namespace[name] = staticmethod(wrap(name, attribute.__func__))
+            elif callable(attribute):
+                namespace[name] = wrap(name, attribute)
+    return type(f'Timed{machine_class.__name__}', (machine_class,), namespace)
+
+
+def temperature_machine(debug, timings):
+    """temperature_machine - TemperatureMachine on the simulated backend, cycled through its three states."""
+    import Hardware
+    from Thermostat import TemperatureMachine
+
+    backend = Hardware.use_backend('sim')
+    machine = timed_subclass(TemperatureMachine, timings)(72, debug, backend=backend)
+    machine.start()
+    return machine, [lambda: machine.send('cycle')]
+
+
+def light_machine(debug, timings):
+    """light_machine - LightMachine on mock pins, pressed from off to red and then between red and blue."""
+    import Hardware
+    Hardware.use_backend('sim')
+    sys.path.insert(0, MODULE_5)
+    import LightStateMachine
+
+    LightStateMachine.DEBUG = debug
+    machine = timed_subclass(LightStateMachine.LightMachine, timings)()
+    return machine, [machine.processButton]
+
+
+def cw_machine(debug, timings):
+    """cw_machine - CWMachine on mock pins, sent each do_* event to enter and leave its state."""
+    import Hardware
+    Hardware.use_backend('sim')
+    sys.path.insert(0, MODULE_5)
+    import Milestone3
+
+    Milestone3.DEBUG = debug
+    machine = timed_subclass(Milestone3.CWMachine, timings)()
+    return machine, [functools.partial(machine.send, event) for event in CW_EVENTS]
+
+
+def temp_machine(debug, timings):
+    """temp_machine - TempMachine, toggled between Celsius and Fahrenheit. Its button handler always prints."""
+    sys.path.insert(0, MODULE_6)
+    import TemperatureSensorIntegration
+
+    TemperatureSensorIntegration.DEBUG = debug
+    machine = timed_subclass(TemperatureSensorIntegration.TempMachine, timings)()
+    return machine, [machine.process_button]
+
+
+# Benchmarks by name
+MACHINES = {
+    'TemperatureMachine': temperature_machine,
+    'LightMachine': light_machine,
+    'CWMachine': cw_machine,
+    'TempMachine': temp_machine,
+}
+
+
+def run(name, debug, events=EVENTS, allocation_events=ALLOCATION_EVENTS):
+    """
+    run - Benchmark one machine in this interpreter.
+
+    @param name is the machine's name in MACHINES.
+    @param debug is True to leave the DEBUG prints on.
+    @param events is the number of events to time.
+    @param allocation_events is the number of events to trace allocations for.
+    @return a dictionary of results.
+    """
+    timings = {}
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        machine, steps = MACHINES[name](debug, timings)
+        count = len(steps)
+
+        # Warm up, then throw the warm up hook times away
+        for index in range(max(count, events // 10)):
+            steps[index % count]()
+        for times in timings.values():
+            times.clear()
+
+        latencies = []
+        started = perf_counter()
+        for index in range(events):
+            step = steps[index % count]
+            before = perf_counter_ns()
+            step()
+            latencies.append(perf_counter_ns() - before)
+        elapsed = perf_counter() - started
+
+        # Allocations, separately, as tracing slows every event down
+        peaks = []
+        tracemalloc.start()
+        retained_before = tracemalloc.get_traced_memory()[0]
+        for index in range(allocation_events):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            steps[index % count]()
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+        retained = tracemalloc.get_traced_memory()[0] - retained_before
+        tracemalloc.stop()
+
+    latencies.sort()
+    peaks.sort()
+    total_ns = sum(latencies)
+    hooks = {}
+    for hook, times in sorted(timings.items()):
+        if not times:
+            continue
+        times.sort()
+        hooks[hook] = {
+            'calls_per_event': len(times) / events,
+            'mean_us': sum(times) / len(times) / 1000,
+            'p99_us': _percentile(times, 0.99) / 1000,
+            'share': sum(times) / total_ns if total_ns else 0.0,
+        }
+
+    return {
+        'machine': name,
+        'debug': debug,
+        'events': events,
+        'events_per_second': events / elapsed,
+        'latency_us': {
+            'mean': total_ns / events / 1000,
+            'p50': _percentile(latencies, 0.5) / 1000,
+            'p90': _percentile(latencies, 0.9) / 1000,
+            'p99': _percentile(latencies, 0.99) / 1000,
+            'max': latencies[-1] / 1000,
+        },
+        'allocation_bytes': {
+            'peak_mean': sum(peaks) / len(peaks) if peaks else 0.0,
+            'peak_max': peaks[-1] if peaks else 0,
+            'retained_per_event': retained / allocation_events if allocation_events else 0.0,
+        },
+        'hooks': hooks,
+    }
+
+
+def run_isolated(name, debug, events):
+    """run_isolated - Benchmark one machine in a fresh interpreter and return its results."""
+    command = [sys.executable, os.path.abspath(__file__), '--child', name, '--events', str(events)]
+    if debug:
+        command.append('--debug')
+    result = subprocess.run(command, cwd=HERE, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def commit():
+    """commit - The commit the tree is at, with a + if it has changes, or None outside a git checkout."""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HERE,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('+' if dirty else '')
+
+
+def compare(results, baseline):
+    """
+    compare - Print the change in throughput and median latency from a baseline results file.
+
+    @param results is the new results dictionary.
+    @param baseline is the baseline results dictionary.
+    """
+    old = {(run_result['machine'], run_result['debug']): run_result for run_result in baseline['runs']}
+    print(f"\nCompared with {baseline.get('commit')} ({baseline.get('date')}):")
+    for run_result in results['runs']:
+        before = old.get((run_result['machine'], run_result['debug']))
+        if before is None:
+            continue
+        speed = run_result['events_per_second'] / before['events_per_second']
+        latency = run_result['latency_us']['p50'] / before['latency_us']['p50']
+        label = f"{run_result['machine']}{' (debug)' if run_result['debug'] else ''}"
+        print(f"{label:<28} throughput x{speed:0.2f}, p50 latency x{latency:0.2f}")
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+
+    def option(flag, default):
+        if flag not in arguments:
+            return default
+        index = arguments.index(flag)
+        value = arguments[index + 1]
+        del arguments[index:index + 2]
+        return value
+
+    event_count = int(option('--events', EVENTS))
+
+    child = option('--child', None)
+    if child is not None:
+        print(json.dumps(run(child, '--debug' in arguments, event_count, min(event_count, ALLOCATION_EVENTS))))
+        sys.exit(0)
+
+    output = option('--output', RESULTS_FILE)
+    baseline_path = option('--compare', None)
+    names = arguments or list(MACHINES)
+    unknown = [name for name in names if name not in MACHINES]
+    if unknown:
+        sys.exit(f"Unknown machine {', '.join(unknown)}, expected {', '.join(MACHINES)}")
+
+    results = {
+        'version': RESULTS_VERSION,
+        'commit': commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': [],
+    }
+
+    print(f"{'machine':<28} {'events/s':>10} {'p50 us':>8} {'p99 us':>8} {'max us':>9} {'peak B':>8} {'kept B':>7}")
+    for name in names:
+        for debug in (False, True):
+            run_result = run_isolated(name, debug, event_count)
+            results['runs'].append(run_result)
+            latency = run_result['latency_us']
+            allocation = run_result['allocation_bytes']
+            label = f"{name}{' (debug)' if debug else ''}"
+            print(f"{label:<28} {run_result['events_per_second']:>10.0f} {latency['p50']:>8.1f} {latency['p99']:>8.1f} "
+                  f"{latency['max']:>9.1f} {allocation['peak_mean']:>8.0f} {allocation['retained_per_event']:>7.1f}")
+            for hook, stats in run_result['hooks'].items():
+                print(f"    {hook:<24} {stats['mean_us']:>8.1f} us mean, {stats['share'] * 100:>5.1f}% of event time")
+
+    with open(output, 'w', encoding='utf-8') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"\nResults written to {output}")
+
+    if baseline_path is not None:
+        with open(baseline_path, encoding='utf-8') as baseline_file:
+            compare(results, json.load(baseline_file))
@@ -0,0 +1,107 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Times a warm restart from a saved state.           #
+#------------------------------------------------------------------#
+
+"""
+BenchmarkStartup.py - Times the startup paths that must not touch the hardware: importing Thermostat, walking the
+TemperatureMachine state graph the way GenerateDocs.py does, creating a TemperatureMachine, and creating one that
+restores the state saved in a StateStore, as a restarted thermostat does. Each path runs in a fresh interpreter so
+nothing is already imported, and the bare interpreter startup is subtracted.
+
+The real Raspberry Pi backend is selected, so on any other machine a path that reaches for the serial port, the GPIO
+pins or the I2C bus fails outright. Each path also has a budget, and the script exits with status 1 if a path fails or
+its median time is over budget.
+
+Usage: python BenchmarkStartup.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from statistics import median
+from time import time
+
+import Hardware
+from StateStore import MachineState, SavedReading, StateStore
+
+# Code timed in each fresh interpreter, and its budget in milliseconds
+PATHS = {
+    'import': ("import Thermostat", 250),
+    'graph': ("import Thermostat\n"
+              "edges = [(t.source.id, t.target.id, t.event) for state in Thermostat.TemperatureMachine.states\n"
+              "         for t in state.transitions]", 250),
+    'create': ("import Thermostat\n"
+               "machine = Thermostat.TemperatureMachine(debugging=False)", 300),
+    'restore': ("import Thermostat, StateStore\n"
+                "store = StateStore.StateStore({state_path!r})\n"
+                "machine = Thermostat.TemperatureMachine(debugging=False, state_store=store)", 300),
+}
+
+# Wraps a path so it reports its own time, leaving out the interpreter startup
+TIMER = """
+from time import perf_counter
+started = perf_counter()
+{code}
+import json
+print(json.dumps(perf_counter() - started))
+"""
+
+
+def save_state(path):
+    """
+    save_state - Save the state of a heating thermostat with a full set of recent readings, as it would be just before
+    a restart.
+
+    @param path is the path the store's files are named from.
+    """
+    now = time()
+    readings = [SavedReading(now - 2 * age, 215, 400) for age in range(32, 0, -1)]
+    store = StateStore(path)
+    store.attach(Hardware.sensor_name(), lambda: MachineState(70, 'heat', True, now - 300, readings, now))
+    store.close()
+
+
+def time_path(code):
+    """
+    time_path - Run code in a fresh interpreter with the Raspberry Pi backend selected.
+
+    @param code is the Python source to run.
+    @return the number of seconds the code took.
+    @raises subprocess.CalledProcessError if the code failed.
+    """
+    environment = dict(os.environ, **{Hardware.BACKEND_VARIABLE: 'pi'})
+    result = subprocess.run([sys.executable, '-c', TIMER.format(code=code)], cwd=os.path.dirname(__file__) or '.',
+                            env=environment, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    passed = True
+
+    state_path = os.path.join(tempfile.mkdtemp(), 'thermostat-state')
+    save_state(state_path)
+
+    print(f"{'path':<8} {'median ms':>10} {'max ms':>8} {'budget ms':>10}")
+    for name, (code, budget) in PATHS.items():
+        try:
+            times = [time_path(code.format(state_path=state_path)) * 1000 for _ in range(runs)]
+        except subprocess.CalledProcessError as error:
+            print(f"{name:<8} failed:\n{error.stderr}")
+            passed = False
+            continue
+
+        within = median(times) <= budget
+        passed = passed and within
+        print(f"{name:<8} {median(times):>10.1f} {max(times):>8.1f} {budget:>10}{'' if within else '  OVER BUDGET'}")
+
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,234 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#    2          Re-read the button level at the end of a debounce  #
+#               window instead of dropping the edges inside it     #
+#------------------------------------------------------------------#
+
+"""
+ButtonInput.py - Interrupt driven button input pipeline. Button edges are timestamped and debounced in the gpiozero
+callback, which then just drops an event on a queue and returns. A single worker thread takes events off the queue and
+runs the handlers, so the state machine only ever sees one event at a time and the callbacks never block. Buttons can
+auto-repeat while held for fast set point changes. The time from each edge to its handler returning (e.g. the LEDs
+being updated) is recorded so the response time can be checked.
+
+Edges inside the debounce window after an accepted edge are not acted on, but they are not forgotten either: when the
+window ends the worker reads the button's level, and if it differs from the last accepted edge the missing press or
+release is recorded then. A quick tap whose release bounces into the window still ends its press, and its repeats.
+"""
+
+from collections import deque, namedtuple
+
+# SimpleQueue is implemented in C and put() never blocks, so it is safe to call from the gpiozero callback thread
+from queue import SimpleQueue, Empty
+from threading import Lock, Thread
+
+from time import monotonic
+
+# ButtonEvent - One input event. kind is 'press', 'repeat' or 'release', timestamp is the clock time of the edge (or of
+# the repeat deadline). The worker is also sent 'settle' events, timestamped with the end of a debounce window.
+ButtonEvent = namedtuple('ButtonEvent', ['name', 'kind', 'timestamp'])
+
+# Event put on the queue to stop the worker
+_STOP = ButtonEvent(None, 'stop', 0.0)
+
+
+class _ButtonConfig:
+    """_ButtonConfig - Settings and debounce state of one button."""
+
+    def __init__(self, name, level, handler, debounce, repeat, hold_delay, repeat_interval):
+        self.name = name
+        self.level = level
+        self.handler = handler
+        self.debounce = debounce
+        self.repeat = repeat
+        self.hold_delay = hold_delay
+        self.repeat_interval = repeat_interval
+
+        # Debounce state. The edge callbacks and the worker's level checks both update it, under the lock.
+        self.lock = Lock()
+        self.pressed = False
+        self.last_edge = float('-inf')
+
+        # Whether an edge was ignored in the current debounce window, so the level is to be read when it ends
+        self.settling = False
+
+    # End class _ButtonConfig definition
+
+
+class InputPipeline:
+    """
+    InputPipeline - Collects debounced button events from any number of buttons and runs their handlers on one worker
+    thread. Call add_button() for each button and then start().
+    """
+
+    def __init__(self, clock=monotonic, history=1024):
+        """
+        Set up the pipeline.
+
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param history is the number of recent latencies kept for the percentiles.
+        """
+        self.clock = clock
+        self._buttons = {}
+        self._queue = SimpleQueue()
+        self._thread = None
+
+        # Repeat deadlines of held buttons, by name
+        self._repeating = {}
+
+        # Ends of the debounce windows the level is to be read at, by name
+        self._settling = {}
+
+        # Recent edge to handler-done latencies in seconds
+        self.latencies = deque(maxlen=history)
+
+        # Statistics
+        self.events = 0
+        self.bounces = 0
+
+    def add_button(self, name, button, handler, debounce=0.02, repeat=False, hold_delay=0.5, repeat_interval=0.15):
+        """
+        add_button - Attach the pipeline to a button.
+
+        @param name identifies the button in events.
+        @param button is a gpiozero Button (or anything with when_pressed, when_released and is_pressed).
+        @param handler is called on the worker thread with no arguments for every press and repeat.
+        @param debounce is the number of seconds after an accepted edge during which further edges are ignored. The
+        level is read again when it ends.
+        @param repeat is True to call the handler again while the button is held.
+        @param hold_delay is the number of seconds the button must be held before it starts repeating.
+        @param repeat_interval is the number of seconds between repeats.
+        """
+        config = _ButtonConfig(name, lambda: bool(button.is_pressed), handler, debounce, repeat, hold_delay,
+                               repeat_interval)
+        self._buttons[name] = config
+        button.when_pressed = lambda: self.edge(name, True)
+        button.when_released = lambda: self.edge(name, False)
+
+    def edge(self, name, pressed, timestamp=None):
+        """
+        edge - Record a button edge. Called from the gpiozero callback thread, so it only timestamps, debounces and
+        queues the event. An edge inside the debounce window has the level read again when the window ends.
+
+        @param name is the button name.
+        @param pressed is True for a press and False for a release.
+        @param timestamp is the time of the edge. Defaults to now.
+        """
+        now = self.clock() if timestamp is None else timestamp
+        config = self._buttons[name]
+
+        with config.lock:
+            if now < config.last_edge + config.debounce:
+                self.bounces += 1
+                if not config.settling:
+                    config.settling = True
+                    self._queue.put(ButtonEvent(name, 'settle', config.last_edge + config.debounce))
+                return
+
+            if pressed == config.pressed:
+                self.bounces += 1
+                return
+
+            config.pressed = pressed
+            config.last_edge = now
+            self._queue.put(ButtonEvent(name, 'press' if pressed else 'release', now))
+
+    def _settle(self, name):
+        """
+        _settle - Read a button's level at the end of a debounce window in which edges were ignored, and record the
+        press or release that was missed if it differs from the last accepted edge. Runs on the worker thread.
+
+        @param name is the button name.
+        """
+        config = self._buttons[name]
+        with config.lock:
+            config.settling = False
+            pressed = config.level()
+            if pressed == config.pressed:
+                return
+        self.edge(name, pressed, max(self.clock(), config.last_edge + config.debounce))
+
+    def start(self):
+        """start - Kick off the worker thread."""
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name='InputPipeline', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """stop - Stop the worker thread after it has handled the events already queued."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _dispatch(self, event):
+        """_dispatch - Run the handler for a press or repeat and record the latency."""
+        config = self._buttons[event.name]
+        config.handler()
+        self.latencies.append(self.clock() - event.timestamp)
+        self.events += 1
+
+    def _run(self):
+        """_run - Worker thread body. Handles queued events and fires repeats for held buttons."""
+        while True:
+            timeout = None
+            if self._repeating or self._settling:
+                deadline = min(list(self._repeating.values()) + list(self._settling.values()))
+                timeout = max(0.0, deadline - self.clock())
+
+            try:
+                event = self._queue.get(timeout=timeout)
+            except Empty:
+                event = None
+
+            if event is _STOP:
+                return
+
+            if event is not None:
+                config = self._buttons[event.name]
+                if event.kind == 'press':
+                    self._dispatch(event)
+                    if config.repeat:
+                        self._repeating[event.name] = event.timestamp + config.hold_delay
+                elif event.kind == 'settle':
+                    self._settling[event.name] = event.timestamp
+                else:
+                    self._repeating.pop(event.name, None)
+
+            # Read the level of every button whose debounce window has ended. A missed release is queued and cancels
+            # the button's repeats when it is taken off the queue.
+            now = self.clock()
+            for name, deadline in list(self._settling.items()):
+                if deadline <= now:
+                    del self._settling[name]
+                    self._settle(name)
+
+            # Fire every repeat that is due
+            for name, deadline in list(self._repeating.items()):
+                if deadline <= now:
+                    self._dispatch(ButtonEvent(name, 'repeat', deadline))
+
+                    # Repeats that were missed because a handler ran long are dropped rather than fired in a burst
+                    interval = self._buttons[name].repeat_interval
+                    self._repeating[name] = max(deadline + interval, self.clock())
+
+    def latency_percentiles(self):
+        """
+        latency_percentiles - Summary of the recent edge to handler-done latencies.
+
+        @return a dictionary with p50, p90, p99 and max in seconds, all zero if there are no events yet.
+        """
+        values = sorted(self.latencies)
+        if not values:
+            return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+
+        def rank(fraction):
+            return values[min(len(values) - 1, int(fraction * len(values)))]
+
+        return {'p50': rank(0.5), 'p90': rank(0.9), 'p99': rank(0.99), 'max': values[-1]}
+
+    # End class InputPipeline definition
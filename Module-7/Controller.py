@@ -0,0 +1,206 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+Controller.py - Heat / cool control engine for the thermostat. A policy decides from the temperature error whether the
+heating or cooling should be running, and the ControlEngine wraps the policy with minimum on and off times so the
+output can never short cycle a real HVAC relay, whatever the policy asks for. Three policies are provided:
+    - ThresholdPolicy  - on whenever the temperature is on the wrong side of the set point. This is how the thermostat
+                         originally decided and it flips on every bit of sensor noise near the set point.
+    - HysteresisPolicy - turns on when the temperature leaves a deadband around the set point and stays on until it
+                         has crossed to the other edge of the band.
+    - DutyCyclePolicy  - PID control whose output is a duty cycle, delivered as one on period per fixed length window
+                         (time proportioning) so an on / off relay can hold a temperature without overshooting.
+"""
+
+# A monotonic clock is used for the minimum on and off times so wall clock changes can't shorten them
+from time import monotonic
+
+
+class ThresholdPolicy:
+    """
+    ThresholdPolicy - On whenever the error is above zero. No memory between decisions.
+    """
+
+    def reset(self):
+        """reset - Nothing to forget."""
+
+    def decide(self, error, output, now):
+        """
+        decide - Pick the output for this sample.
+
+        @param error is how far in degrees the temperature is on the side that needs running, e.g. set point minus
+        temperature when heating.
+        @param output is the current output.
+        @param now is the current clock time.
+        @return True to run the heating or cooling.
+        """
+        return error > 0
+
+    # End class ThresholdPolicy definition
+
+
+class HysteresisPolicy:
+    """
+    HysteresisPolicy - Bang bang control with a deadband. The output turns on once the error exceeds half the deadband
+    and off once it drops below minus half the deadband. Inside the band the output is left alone.
+    """
+
+    def __init__(self, deadband=1.0):
+        """
+        Set up the policy.
+
+        @param deadband is the width of the band around the set point in degrees Fahrenheit.
+        """
+        self.deadband = deadband
+
+    def reset(self):
+        """reset - Nothing to forget, the current output is the only state."""
+
+    def decide(self, error, output, now):
+        """decide - Pick the output for this sample. See ThresholdPolicy.decide()."""
+        if error > self.deadband / 2:
+            return True
+        if error < -self.deadband / 2:
+            return False
+        return output
+
+    # End class HysteresisPolicy definition
+
+
+class DutyCyclePolicy:
+    """
+    DutyCyclePolicy - PID control delivered as a duty cycle. Time is split into windows of cycle seconds, the PID
+    output is clamped to 0..1 and the output is on for that fraction at the start of each window. The integral is only
+    accumulated while the duty cycle isn't saturated so it can't wind up while the room is far from the set point.
+    """
+
+    def __init__(self, kp=0.5, ki=0.0005, kd=0.0, cycle=600.0):
+        """
+        Set up the policy.
+
+        @param kp is the proportional gain in duty per degree.
+        @param ki is the integral gain in duty per degree second.
+        @param kd is the derivative gain in duty per degree per second.
+        @param cycle is the window length in seconds. Each window has at most one on period.
+        """
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.cycle = cycle
+        self.reset()
+
+    def reset(self):
+        """reset - Forget the integral, the derivative history and the current window."""
+        self.integral = 0.0
+        self.duty = 0.0
+        self._last_error = None
+        self._last_time = None
+        self._window_start = None
+
+    def decide(self, error, output, now):
+        """decide - Pick the output for this sample. See ThresholdPolicy.decide()."""
+        dt = 0.0 if self._last_time is None else now - self._last_time
+        derivative = 0.0 if self._last_error is None or dt <= 0 else (error - self._last_error) / dt
+        self._last_error = error
+        self._last_time = now
+
+        duty = self.kp * error + self.ki * (self.integral + error * dt) + self.kd * derivative
+        if 0.0 < duty < 1.0:
+            self.integral += error * dt
+
+        # The duty cycle is only taken up at the start of a window, so each window has a single on period
+        if self._window_start is None:
+            self._window_start = now
+            self.duty = min(1.0, max(0.0, duty))
+        elif now - self._window_start >= self.cycle:
+            self._window_start += self.cycle * ((now - self._window_start) // self.cycle)
+            self.duty = min(1.0, max(0.0, duty))
+
+        return now - self._window_start < self.duty * self.cycle
+
+    # End class DutyCyclePolicy definition
+
+
+class ControlEngine:
+    """
+    ControlEngine - Runs a policy for the thermostat's current mode and enforces minimum on and off times on its
+    output. Call update() with every new temperature sample. The engine works in whatever unit it is given:
+    TemperatureMachine passes integer tenths of a degree, so its policy's deadband or gains are per tenth.
+    """
+
+    def __init__(self, policy=None, min_on=0.0, min_off=0.0, clock=monotonic):
+        """
+        Set up the engine with its output off.
+
+        @param policy is the policy deciding the output. Defaults to a HysteresisPolicy with a 1 degree deadband.
+        @param min_on is the minimum number of seconds the output stays on once turned on.
+        @param min_off is the minimum number of seconds the output stays off once turned off.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        """
+        self.policy = policy if policy is not None else HysteresisPolicy()
+        self.min_on = min_on
+        self.min_off = min_off
+        self.clock = clock
+
+        self.mode = 'off'
+        self.output = False
+        self.fahrenheit = None
+        self.set_point = None
+
+        # Time of the last output change. Starting far in the past lets the first decision take effect immediately.
+        self.changed_at = float('-inf')
+
+        # Statistics
+        self.switches = 0
+        self.held = 0
+
+    def _switch(self, output, now):
+        """_switch - Change the output and record the switching event."""
+        self.output = output
+        self.changed_at = now
+        self.switches += 1
+
+    def update(self, mode, fahrenheit, set_point, now=None):
+        """
+        update - Decide the output for a new sample.
+
+        @param mode is the thermostat state, 'off', 'heat' or 'cool'.
+        @param fahrenheit is the temperature.
+        @param set_point is the set point.
+        @param now is the time of the sample. Defaults to the engine clock.
+        @return True if the heating or cooling should be running.
+        """
+        now = self.clock() if now is None else now
+        self.fahrenheit = fahrenheit
+        self.set_point = set_point
+
+        # A mode change starts the policy afresh. Turning off for it is still a switch and still starts the off time.
+        if mode != self.mode:
+            self.mode = mode
+            self.policy.reset()
+            if self.output:
+                self._switch(False, now)
+
+        if mode == 'heat':
+            error = set_point - fahrenheit
+        elif mode == 'cool':
+            error = fahrenheit - set_point
+        else:
+            return self.output
+
+        wanted = self.policy.decide(error, self.output, now)
+        if wanted != self.output:
+            minimum = self.min_on if self.output else self.min_off
+            if now - self.changed_at < minimum:
+                self.held += 1
+            else:
+                self._switch(wanted, now)
+        return self.output
+
+    # End class ControlEngine definition
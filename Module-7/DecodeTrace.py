@@ -0,0 +1,137 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Decodes tenths arguments.                          #
+#------------------------------------------------------------------#
+
+"""
+DecodeTrace.py - Turns a trace dump written by Tracing.Tracer.dump() into readable text, one line per event, or into
+Chrome trace JSON, which can be opened in chrome://tracing or https://ui.perfetto.dev to see the threads and the spans
+of the scheduler jobs on a timeline. The dump describes its own event types, so decoding needs nothing but this file.
+
+Usage: python DecodeTrace.py TRACE [--chrome OUT.json]   - prints the text unless --chrome is given
+"""
+
+import json
+import struct
+import sys
+
+from collections import namedtuple
+from datetime import datetime
+
+# Must match Tracing.py
+MAGIC = b'THTRACE1'
+HEADER_LENGTH = struct.Struct('<I')
+MISSING = -(1 << 63)
+SCALES = {'tenths': 10, 'centi': 100}
+PHASES = {0: 'i', 1: 'B', 2: 'E'}
+
+# TraceEvent - One decoded record. time is in nanoseconds since tracing started, args a dictionary by field name.
+TraceEvent = namedtuple('TraceEvent', ['time', 'thread', 'name', 'phase', 'args'])
+
+# Trace - A decoded dump. dropped is the number of events overwritten in the ring buffer before the dump.
+Trace = namedtuple('Trace', ['events', 'threads', 'wall_started', 'dropped'])
+
+
+def read_trace(path):
+    """
+    read_trace - Read and decode a trace dump.
+
+    @param path is the dump file.
+    @return a Trace whose events are in time order.
+    @raises ValueError if the file isn't a trace dump.
+    """
+    with open(path, 'rb') as trace_file:
+        if trace_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace dump")
+        (length,) = HEADER_LENGTH.unpack(trace_file.read(HEADER_LENGTH.size))
+        header = json.loads(trace_file.read(length).decode('utf-8'))
+        records = trace_file.read()
+
+    event_types = header['events']
+    strings = header['strings']
+    threads = {int(ident): name for ident, name in header['threads'].items()}
+    started = header['started_ns']
+
+    events = []
+    for timestamp, thread, event_id, phase, *values in struct.iter_unpack(header['record_format'], records):
+        if event_id <= 0 or event_id >= len(event_types):
+            continue
+        name, fields = event_types[event_id]
+        args = {}
+        for (field, kind), value in zip(fields, values):
+            if kind == 'str':
+                args[field] = strings[value] if 0 <= value < len(strings) else f'#{value}'
+            elif kind in SCALES:
+                args[field] = None if value == MISSING else value / SCALES[kind]
+            else:
+                args[field] = value
+        events.append(TraceEvent(timestamp - started, thread, name, PHASES.get(phase, 'i'), args))
+
+    # Threads claim their slots in order but may store them out of order
+    events.sort(key=lambda event: event.time)
+    return Trace(events, threads, header['wall_started'], max(0, header['emitted'] - header['capacity']))
+
+
+def to_text(trace):
+    """
+    to_text - One line per event: seconds since tracing started, thread, event name and arguments.
+
+    @param trace is the decoded Trace.
+    @return an iterator of lines.
+    """
+    started = datetime.fromtimestamp(trace.wall_started)
+    yield f"Trace started {started.isoformat(sep=' ', timespec='milliseconds')}, {len(trace.events)} events" + \
+          (f", {trace.dropped} older events overwritten" if trace.dropped else '')
+
+    markers = {'i': ' ', 'B': '>', 'E': '<'}
+    for event in trace.events:
+        thread = trace.threads.get(event.thread, str(event.thread))
+        args = ' '.join(f'{field}={value}' for field, value in event.args.items())
+        yield f"{event.time / 1e9:14.6f}  {thread:<16} {markers[event.phase]} {event.name} {args}".rstrip()
+
+
+def to_chrome(trace):
+    """
+    to_chrome - Chrome trace event JSON for the trace. Spans become slices and instants become marks on their thread.
+
+    @param trace is the decoded Trace.
+    @return a dictionary ready for json.dump().
+    """
+    trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': ident, 'args': {'name': name}}
+                    for ident, name in trace.threads.items()]
+    for event in trace.events:
+        record = {'name': event.name, 'ph': event.phase, 'ts': event.time / 1000, 'pid': 1, 'tid': event.thread,
+                  'args': event.args}
+        if event.phase == 'i':
+            record['s'] = 't'
+        trace_events.append(record)
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    chrome_path = None
+    if '--chrome' in arguments:
+        index = arguments.index('--chrome')
+        chrome_path = arguments[index + 1]
+        del arguments[index:index + 2]
+    if len(arguments) != 1:
+        sys.exit(__doc__.strip().splitlines()[-1])
+
+    try:
+        decoded = read_trace(arguments[0])
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+
+    if chrome_path is None:
+        for line in to_text(decoded):
+            print(line)
+    else:
+        with open(chrome_path, 'w', encoding='utf-8') as chrome_file:
+            json.dump(to_chrome(decoded), chrome_file)
+        print(f"Wrote {len(decoded.events)} events to {chrome_path}")
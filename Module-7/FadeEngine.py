@@ -0,0 +1,295 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#    2          Write frames under the lock, so a frame taken      #
+#               before on() or off() can't overwrite it            #
+#    3          Keep only recent frame lateness, and its maximum   #
+#------------------------------------------------------------------#
+
+"""
+FadeEngine.py - One thread that fades any number of indicator LEDs. gpiozero's pulse() starts a Python thread per LED
+that recomputes the brightness on every step. Here each fade shape is computed once as a gamma corrected table of duty
+cycles, one entry per frame, and a single thread steps every running fade through its table on absolute frame
+deadlines. A channel is only written when its duty cycle changes, and the thread sleeps while nothing is fading.
+
+Channels come from the hardware backend's pwm_channel(): the hardware PWM block where the pin has one, software PWM
+otherwise. The engine keeps its own CPU time and frame lateness so the cost of running dozens of fades can be checked.
+
+Usage: python FadeEngine.py [seconds] [fade counts ...]   - benchmark against one thread per LED
+"""
+
+from collections import deque
+from functools import lru_cache
+from threading import Thread, Event, Lock
+from time import monotonic, thread_time
+
+# Default frames per second of the fade tables
+FRAME_RATE = 100
+
+# Perceived brightness is roughly the duty cycle to the power of 1 / 2.2, so the table is raised to 2.2 to fade evenly
+GAMMA = 2.2
+
+
+@lru_cache(maxsize=64)
+def fade_curve(fade_in=1.0, fade_out=1.0, frame_rate=FRAME_RATE, gamma=GAMMA):
+    """
+    fade_curve - The gamma corrected duty cycles of one fade in and out, one per frame.
+
+    @param fade_in is the number of seconds to fade from off to full.
+    @param fade_out is the number of seconds to fade from full to off.
+    @param frame_rate is the number of table entries per second.
+    @param gamma is the gamma correction exponent.
+    @return a tuple of duty cycles between 0 and 1.
+    """
+    rising = max(1, round(fade_in * frame_rate))
+    falling = max(1, round(fade_out * frame_rate))
+    levels = [frame / rising for frame in range(rising)] + [1 - frame / falling for frame in range(falling)]
+    return tuple(round(level ** gamma, 4) for level in levels)
+
+
+class FadedLight:
+    """
+    FadedLight - An LED on a FadeEngine channel with the on(), off() and pulse() calls of a gpiozero PWMLED.
+    """
+
+    def __init__(self, engine, channel):
+        """
+        Set up the light, off.
+
+        @param engine is the FadeEngine running the fades.
+        @param channel is the PWM channel, anything with set(duty) and close().
+        """
+        self.engine = engine
+        self.channel = channel
+        self.value = 0.0
+
+    def on(self):
+        """on - Stop any fade and turn the light fully on."""
+        self.engine.hold(self, 1.0)
+
+    def off(self):
+        """off - Stop any fade and turn the light off."""
+        self.engine.hold(self, 0.0)
+
+    def pulse(self, fade_in_time=1, fade_out_time=1):
+        """
+        pulse - Fade the light in and out until on() or off() is called.
+
+        @param fade_in_time is the number of seconds to fade in.
+        @param fade_out_time is the number of seconds to fade out.
+        """
+        self.engine.fade(self, fade_curve(fade_in_time, fade_out_time, self.engine.frame_rate))
+
+    def set(self, duty):
+        """set - Write a duty cycle to the channel if it changed. Only called by the engine."""
+        if duty != self.value:
+            self.value = duty
+            self.channel.set(duty)
+            self.engine.writes += 1
+
+    def close(self):
+        """close - Stop the light and release its channel."""
+        self.off()
+        self.channel.close()
+
+    # End class FadedLight definition
+
+
+class FadeEngine:
+    """
+    FadeEngine - Steps every running fade once per frame on one thread. Frames are released on absolute deadlines, so
+    the time spent writing channels doesn't stretch the fades.
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE, clock=monotonic, wait=None, history=6000):
+        """
+        Set up the engine. The thread is not started until start() is called; until then fades are only recorded.
+
+        @param frame_rate is the number of frames per second.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param wait is a callable wait(event, timeout) used between frames. Defaults to event.wait(timeout).
+        @param history is the number of recent frame latenesses kept for the percentiles, a minute at 100 frames per
+        second.
+        """
+        self.frame_rate = frame_rate
+        self.clock = clock
+        self.wait = wait if wait is not None else (lambda event, timeout: event.wait(timeout))
+
+        # Running fades as light: (table, start time)
+        self._fades = {}
+        self._lock = Lock()
+        self._wake_event = Event()
+        self._stop_event = Event()
+        self._thread = None
+
+        # Statistics
+        self.frames = 0
+        self.writes = 0
+        self.lateness = deque(maxlen=history)
+        self.max_lateness = 0.0
+        self.cpu_time = 0.0
+        self.run_time = 0.0
+
+    def light(self, channel):
+        """
+        light - Create a light on a channel.
+
+        @param channel is the PWM channel, e.g. from the hardware backend's pwm_channel().
+        @return the FadedLight.
+        """
+        return FadedLight(self, channel)
+
+    def hold(self, light, duty):
+        """hold - Stop the light's fade and set a fixed duty cycle."""
+        with self._lock:
+            self._fades.pop(light, None)
+            light.set(duty)
+
+    def fade(self, light, table):
+        """fade - Start stepping the light through a table of duty cycles, repeating it until the light is held."""
+        with self._lock:
+            self._fades[light] = (table, self.clock())
+        self._wake_event.set()
+
+    def start(self):
+        """start - Kick off the engine thread."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = Thread(target=self._run, name='FadeEngine', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """stop - Stop the engine thread. Lights keep their last duty cycle."""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def step(self, now):
+        """
+        step - Write the current frame of every running fade. The lock is held while writing, so a light held by on()
+        or off() meanwhile is never written with a frame of the fade it replaced.
+
+        @param now is the clock time of the frame.
+        """
+        with self._lock:
+            for light, (table, start) in self._fades.items():
+                light.set(table[int((now - start) * self.frame_rate) % len(table)])
+        self.frames += 1
+
+    def _run(self):
+        """_run - Engine thread body."""
+        started = self.clock()
+        cpu_started = thread_time()
+        period = 1 / self.frame_rate
+        deadline = self.clock()
+
+        while not self._stop_event.is_set():
+            if not self._fades:
+                # Nothing to fade, sleep until a fade is started
+                self._wake_event.wait()
+                self._wake_event.clear()
+                deadline = self.clock()
+                continue
+
+            now = self.clock()
+            lateness = now - deadline
+            self.lateness.append(lateness)
+            self.max_lateness = max(self.max_lateness, lateness)
+            self.step(now)
+
+            # Skip any frames that have already passed rather than running them back to back
+            deadline += period
+            if deadline < now:
+                deadline += period * ((now - deadline) // period + 1)
+            self.wait(self._stop_event, deadline - self.clock())
+
+        self.cpu_time += thread_time() - cpu_started
+        self.run_time += self.clock() - started
+
+    def stats(self):
+        """
+        stats - CPU use and frame timing of the engine thread. Only complete once the thread has stopped.
+
+        @return a dictionary with the frames, channel writes, CPU fraction, the recent frames' lateness percentiles and
+        the maximum lateness of all frames in seconds.
+        """
+        lateness = sorted(self.lateness)
+
+        def rank(fraction):
+            return lateness[min(len(lateness) - 1, int(fraction * len(lateness)))] if lateness else 0.0
+
+        return {
+            'frames': self.frames,
+            'writes': self.writes,
+            'cpu': self.cpu_time / self.run_time if self.run_time else 0.0,
+            'p50_lateness': rank(0.5),
+            'p99_lateness': rank(0.99),
+            'max_lateness': self.max_lateness,
+        }
+
+    # End class FadeEngine definition
+
+
+if __name__ == '__main__':
+    import sys
+
+    from time import perf_counter, process_time, sleep
+
+    class NullChannel:
+        """NullChannel - A channel that only counts writes, so the benchmark measures the engine itself."""
+
+        def __init__(self):
+            self.writes = 0
+
+        def set(self, duty):
+            self.writes += 1
+
+        def close(self):
+            pass
+
+    def thread_per_light(count, seconds, frame_rate=FRAME_RATE):
+        """thread_per_light - The gpiozero pulse() approach: a thread per light computing its brightness each step."""
+        stop = Event()
+        lateness = []
+
+        def pulse(channel):
+            deadline = perf_counter()
+            while not stop.is_set():
+                lateness.append(perf_counter() - deadline)
+                phase = (perf_counter() * frame_rate) % (2 * frame_rate) / frame_rate
+                channel.set((phase if phase < 1 else 2 - phase) ** GAMMA)
+                deadline += 1 / frame_rate
+                sleep(max(0.0, deadline - perf_counter()))
+
+        threads = [Thread(target=pulse, args=(NullChannel(),), daemon=True) for _ in range(count)]
+        cpu_started = process_time()
+        for thread in threads:
+            thread.start()
+        sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        lateness.sort()
+        return (process_time() - cpu_started) / seconds, lateness[int(0.99 * len(lateness))], lateness[-1]
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    counts = [int(argument) for argument in sys.argv[2:]] or [1, 8, 32, 64]
+
+    print(f"{'fades':>6} {'engine cpu':>11} {'p99 ms':>7} {'max ms':>7} {'threads cpu':>12} {'p99 ms':>7} {'max ms':>7}")
+    for count in counts:
+        engine = FadeEngine()
+        for number in range(count):
+            engine.light(NullChannel()).pulse(1 + number % 3 * 0.5, 1)
+        engine.start()
+        sleep(duration)
+        engine.stop()
+        stats = engine.stats()
+
+        cpu, p99, worst = thread_per_light(count, duration)
+        print(f"{count:>6} {stats['cpu'] * 100:>10.1f}% {stats['p99_lateness'] * 1000:>7.2f} "
+              f"{stats['max_lateness'] * 1000:>7.2f} {cpu * 100:>11.1f}% {p99 * 1000:>7.2f} {worst * 1000:>7.2f}")
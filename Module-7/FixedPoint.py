@@ -0,0 +1,112 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Fahrenheit tenths are converted straight from the  #
+#               raw value, with one rounding.                      #
+#------------------------------------------------------------------#
+
+"""
+FixedPoint.py - Integer tenths of a degree for the sensor pipeline. The AHTx0 reports 20 bit raw values, which are
+converted straight to tenths of a degree Celsius, tenths of a degree Fahrenheit and tenths of a percent humidity with
+integer arithmetic. From there the text shown on the LCD and sent to the Thermostat Server is looked up in a table built
+once at import, so a reading is never turned into a float and every comparison with the set point is exact.
+
+The AHTx0 datasheet conversions are:
+    relative humidity % = raw * 100 / 2^20
+    temperature C       = raw * 200 / 2^20 - 50
+    temperature F       = raw * 360 / 2^20 - 58
+
+so a raw temperature covers -50C to 150C. Each value is rounded half up once, from the raw value. Converting Celsius
+tenths that were already rounded would round twice and can be a tenth out.
+"""
+
+# Tenths in a degree or a percent
+TENTHS = 10
+
+# Full scale of a 20 bit AHTx0 reading
+RAW_BITS = 20
+RAW_SCALE = 1 << RAW_BITS
+
+# Range of Celsius tenths a raw temperature can give, and the Fahrenheit tenths of each, for Celsius values that don't
+# come with their raw value, e.g. readings saved by an older version
+CELSIUS_MIN = -500
+CELSIUS_MAX = 1500
+FAHRENHEIT_TENTHS = [(celsius * 18 + 5) // 10 + 320 for celsius in range(CELSIUS_MIN, CELSIUS_MAX + 1)]
+
+# Range of tenths with precomputed text, which covers indoor temperatures in either scale and every humidity. Anything
+# outside it is formatted when asked for.
+TEXT_MIN = -400
+TEXT_MAX = 1500
+TENTHS_TEXT = [f'{value // TENTHS}.{value % TENTHS}' if value >= 0 else f'-{-value // TENTHS}.{-value % TENTHS}'
+               for value in range(TEXT_MIN, TEXT_MAX + 1)]
+
+
+def raw_values(data):
+    """
+    raw_values - Unpack the raw humidity and temperature from the six bytes an AHTx0 returns after a measurement: a
+    status byte, then 20 bits of humidity followed by 20 bits of temperature.
+
+    @param data is the bytes read from the sensor.
+    @return a tuple of (humidity raw, temperature raw).
+    """
+    humidity = (data[1] << 12) | (data[2] << 4) | (data[3] >> 4)
+    temperature = ((data[3] & 0x0F) << 16) | (data[4] << 8) | data[5]
+    return humidity, temperature
+
+
+def celsius_tenths(raw):
+    """celsius_tenths - Tenths of a degree Celsius from a raw 20 bit AHTx0 temperature."""
+    return ((raw * 2000 + (RAW_SCALE >> 1)) >> RAW_BITS) - 500
+
+
+def fahrenheit_tenths_raw(raw):
+    """fahrenheit_tenths_raw - Tenths of a degree Fahrenheit from a raw 20 bit AHTx0 temperature."""
+    return ((raw * 3600 + (RAW_SCALE >> 1)) >> RAW_BITS) - 580
+
+
+def humidity_tenths(raw):
+    """humidity_tenths - Tenths of a percent relative humidity from a raw 20 bit AHTx0 humidity."""
+    return (raw * 1000 + (RAW_SCALE >> 1)) >> RAW_BITS
+
+
+def raw_temperature(celsius):
+    """raw_temperature - The raw 20 bit AHTx0 temperature closest to a Celsius value, as the sensor would report it."""
+    return min(RAW_SCALE - 1, max(0, round((celsius + 50) * RAW_SCALE / 200)))
+
+
+def raw_humidity(humidity):
+    """raw_humidity - The raw 20 bit AHTx0 humidity closest to a relative humidity in percent."""
+    return min(RAW_SCALE - 1, max(0, round(humidity * RAW_SCALE / 100)))
+
+
+def to_tenths(value):
+    """to_tenths - Tenths from a float, for values that don't come from the sensor."""
+    return round(value * TENTHS)
+
+
+def fahrenheit_tenths(celsius):
+    """
+    fahrenheit_tenths - Tenths of a degree Fahrenheit from tenths of a degree Celsius, looked up for any value a raw
+    reading can give. Use fahrenheit_tenths_raw() when the raw value is at hand.
+    """
+    index = celsius - CELSIUS_MIN
+    if 0 <= index < len(FAHRENHEIT_TENTHS):
+        return FAHRENHEIT_TENTHS[index]
+    return (celsius * 18 + 5) // 10 + 320
+
+
+def format_tenths(value):
+    """
+    format_tenths - Text of a tenths value with one decimal place, e.g. '70.5' for 705. The same text as
+    f'{value / 10:0.1f}' without the float.
+    """
+    index = value - TEXT_MIN
+    if 0 <= index < len(TENTHS_TEXT):
+        return TENTHS_TEXT[index]
+    if value < 0:
+        return f'-{-value // TENTHS}.{-value % TENTHS}'
+    return f'{value // TENTHS}.{value % TENTHS}'
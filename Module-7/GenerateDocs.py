@@ -1,20 +1,335 @@
 """
-This python file is a script that will execute the diagrams portion of the python-statemachine per their documentation.
-Ensure that you've pip installed python-statemachine[diagrams] to execute this file.
+This python file is a script that generates the state diagrams of every state machine in the repository for
+documentation.
+
+The machines are found by parsing the source files rather than importing them, so no module runs, no hardware is
+claimed and python-statemachine doesn't even need to be installed: every class deriving from StateMachine is read for
+its State attributes and the .to() transitions of its events. Each diagram is only regenerated when the structure of
+its machine (states, initial state and transitions) hashes differently from when it was last written, and the
+Graphviz renders run in a process pool.
+
+Formats:
+    - dot     - Graphviz source
+    - mermaid - a Mermaid stateDiagram-v2, which renders in Markdown on GitHub
+    - svg     - rendered by Graphviz's dot command
+    - png     - rendered by Graphviz's dot command
+
+Diagrams are written to Module-7/diagrams as MACHINE.EXTENSION, e.g. diagrams/TemperatureMachine.png. The svg and png
+formats need Graphviz installed (e.g. apt install graphviz) for its dot command; python-statemachine[diagrams] is no
+longer used. Without any formats given the script writes dot, mermaid and png, and skips png with a note if dot isn't
+installed. Asking for svg or png explicitly without it is an error. Whenever TemperatureMachine's png is written it is
+also copied to Module-7/StateMachine.png, the file this script wrote before.
+
+Usage: python GenerateDocs.py [--force] [--output DIR] [--root DIR] [format ...]   - formats default to dot, mermaid
+and png
 """
 
-from statemachine.contrib.digram import DotGraphMachine
-import Thermostat as Thermo
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# MachineSpec - The structure of one state machine. states is a tuple of state ids in definition order, initial is the
+# initial state's id and transitions is a tuple of (event, source, target).
+MachineSpec = namedtuple('MachineSpec', ['name', 'path', 'states', 'initial', 'transitions'])
+
+# File extension of each format
+FORMATS = {'dot': 'dot', 'mermaid': 'mmd', 'svg': 'svg', 'png': 'png'}
+
+# Formats rendered by Graphviz in the process pool, the rest are written directly
+GRAPHVIZ_FORMATS = ('svg', 'png')
+
+# Part of every hash, so changing the renderers below regenerates every diagram
+RENDER_VERSION = 1
+
+# File in the output directory recording the hash each diagram was written from
+CACHE_FILE = '.diagrams.json'
+
+# Formats written when none are given. png is dropped when Graphviz isn't installed.
+DEFAULT_FORMATS = ('dot', 'mermaid', 'png')
+
+# Machine whose png is also copied next to this script under the name the original script gave it
+LEGACY_MACHINE = 'TemperatureMachine'
+LEGACY_PNG = 'StateMachine.png'
+
+# Directories never searched for machines
+SKIP_DIRECTORIES = {'__pycache__', '.git', '.idea', '.venv', 'venv', '.tox', '.nox'}
+
+
+def _name(node):
+    """_name - The name a Name or Attribute node refers to, e.g. 'StateMachine' for statemachine.StateMachine."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _transitions(node):
+    """
+    _transitions - The (source, targets) pairs of a transition list expression such as a.to(b) | b.to(c, d) or
+    a.to.itself().
+    """
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return _transitions(node.left) + _transitions(node.right)
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+        return []
+
+    function = node.func
+    if function.attr == 'to' and isinstance(function.value, ast.Name):
+        return [(function.value.id, [_name(target) for target in node.args])]
+    if function.attr == 'itself' and isinstance(function.value, ast.Attribute) and function.value.attr == 'to':
+        source = _name(function.value.value)
+        return [(source, [source])]
+    if function.attr == 'from_' and isinstance(function.value, ast.Name):
+        return [(_name(source), [function.value.id]) for source in node.args]
+    return []
+
+
+def parse_machine(node, path):
+    """
+    parse_machine - Read the structure of a machine from its class definition.
+
+    @param node is the ast.ClassDef.
+    @param path is the source file, for reference.
+    @return a MachineSpec.
+    """
+    states = []
+    initial = None
+    transitions = []
+
+    for statement in node.body:
+        if not isinstance(statement, ast.Assign) or len(statement.targets) != 1:
+            continue
+        target = _name(statement.targets[0])
+        value = statement.value
+
+        if isinstance(value, ast.Call) and _name(value.func) == 'State':
+            states.append(target)
+            for keyword in value.keywords:
+                if keyword.arg == 'initial' and isinstance(keyword.value, ast.Constant) and keyword.value.value:
+                    initial = target
+            continue
+
+        for source, targets in _transitions(value):
+            transitions.extend((target, source, destination) for destination in targets)
+
+    return MachineSpec(node.name, path, tuple(states), initial, tuple(transitions))
+
+
+def find_machines(root):
+    """
+    find_machines - Parse every Python file under root and read each StateMachine subclass in it. Subclasses of those
+    subclasses are found as well.
+
+    @param root is the directory to search.
+    @return a list of MachineSpecs sorted by name.
+    """
+    classes = []
+    for directory, directories, files in os.walk(root):
+        directories[:] = sorted(name for name in directories if name not in SKIP_DIRECTORIES)
+        for file in sorted(files):
+            if not file.endswith('.py'):
+                continue
+            path = os.path.join(directory, file)
+            with open(path, encoding='utf-8') as source:
+                try:
+                    tree = ast.parse(source.read(), path)
+                except SyntaxError:
+                    continue
+            classes.extend((node, path) for node in ast.walk(tree) if isinstance(node, ast.ClassDef))
+
+    # Grow the set of machine class names until no new subclass is found
+    machine_names = {'StateMachine'}
+    found = True
+    while found:
+        found = False
+        for node, path in classes:
+            if node.name not in machine_names and any(_name(base) in machine_names for base in node.bases):
+                machine_names.add(node.name)
+                found = True
+
+    machines = [parse_machine(node, os.path.relpath(path, root)) for node, path in classes
+                if node.name in machine_names and node.name != 'StateMachine']
+    return sorted(machines, key=lambda machine: machine.name)
+
+
+def structure_hash(machine):
+    """
+    structure_hash - Hash of everything a diagram is drawn from. The source path isn't included, so moving a machine
+    doesn't regenerate its diagrams.
+
+    @param machine is the MachineSpec.
+    @return a hex digest.
+    """
+    structure = [RENDER_VERSION, machine.name, machine.states, machine.initial, machine.transitions]
+    return hashlib.sha256(json.dumps(structure).encode('utf-8')).hexdigest()
+
+
+def to_dot(machine):
+    """
+    to_dot - Graphviz source for a machine, laid out like python-statemachine's DotGraphMachine: left to right with a
+    black dot pointing at the initial state.
+
+    @param machine is the MachineSpec.
+    @return the DOT source.
+    """
+    lines = [f'digraph "{machine.name}" {{',
+             f'    label="{machine.name}"; fontname="Arial"; fontsize=10; rankdir=LR;',
+             '    node [shape=rectangle, style="rounded", fontname="Arial", fontsize=10];',
+             '    edge [fontname="Arial", fontsize=9];']
+    if machine.initial is not None:
+        lines.append('    __initial [shape=circle, style=filled, fillcolor=black, label="", fixedsize=true, width=0.2];')
+        lines.append(f'    __initial -> "{machine.initial}" [color=blue];')
+    lines.extend(f'    "{state}";' for state in machine.states)
+    lines.extend(f'    "{source}" -> "{target}" [label="{event}"];' for event, source, target in machine.transitions)
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def to_mermaid(machine):
+    """
+    to_mermaid - Mermaid state diagram for a machine.
+
+    @param machine is the MachineSpec.
+    @return the Mermaid source.
+    """
+    lines = ['stateDiagram-v2', f'    %% {machine.name}']
+    if machine.initial is not None:
+        lines.append(f'    [*] --> {machine.initial}')
+    lines.extend(f'    {source} --> {target} : {event}' for event, source, target in machine.transitions)
+    return '\n'.join(lines) + '\n'
+
+
+def render(machine, output_format, path):
+    """
+    render - Write one diagram. Runs in a pool worker for the Graphviz formats.
+
+    @param machine is the MachineSpec.
+    @param output_format is one of FORMATS.
+    @param path is the file to write.
+    @return the path written.
+    @raises OSError if Graphviz's dot command isn't installed or fails.
+    """
+    if output_format == 'mermaid':
+        data = to_mermaid(machine).encode('utf-8')
+    elif output_format == 'dot':
+        data = to_dot(machine).encode('utf-8')
+    else:
+        try:
+            result = subprocess.run(['dot', f'-T{output_format}'], input=to_dot(machine).encode('utf-8'),
+                                    capture_output=True, check=True)
+        except FileNotFoundError:
+            raise OSError(f"Graphviz's dot command is needed for {output_format} output") from None
+        except subprocess.CalledProcessError as error:
+            raise OSError(f"dot failed for {machine.name}: {error.stderr.decode(errors='replace')}") from None
+        data = result.stdout
+
+    with open(path, 'wb') as output:
+        output.write(data)
+    return path
+
+
+def generate(machines, formats, output, force=False):
+    """
+    generate - Write the diagrams of every machine whose structure changed since they were last written.
+
+    @param machines is a list of MachineSpecs.
+    @param formats is a list of formats to write.
+    @param output is the directory to write to. Created if needed.
+    @param force is True to regenerate every diagram.
+    @return a tuple of (paths written, paths unchanged).
+    """
+    os.makedirs(output, exist_ok=True)
+    cache_path = os.path.join(output, CACHE_FILE)
+    try:
+        with open(cache_path, encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        cache = {}
+
+    direct = []
+    pooled = []
+    unchanged = []
+    for machine in machines:
+        digest = structure_hash(machine)
+        for output_format in formats:
+            path = os.path.join(output, f'{machine.name}.{FORMATS[output_format]}')
+            key = os.path.basename(path)
+            if not force and cache.get(key) == digest and os.path.exists(path):
+                unchanged.append(path)
+                continue
+            job = (machine, output_format, path, key, digest)
+            (pooled if output_format in GRAPHVIZ_FORMATS else direct).append(job)
+
+    written = []
+    try:
+        for machine, output_format, path, key, digest in direct:
+            written.append(render(machine, output_format, path))
+            cache[key] = digest
+
+        # Graphviz is a separate process per diagram, so the pool mostly overlaps their start up
+        if pooled:
+            with ProcessPoolExecutor(max_workers=min(len(pooled), os.cpu_count() or 1)) as pool:
+                futures = [(pool.submit(render, machine, output_format, path), key, digest)
+                           for machine, output_format, path, key, digest in pooled]
+                for future, key, digest in futures:
+                    written.append(future.result())
+                    cache[key] = digest
+    finally:
+        # Whatever was written before a failure doesn't need writing again
+        with open(cache_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(cache, cache_file, indent=2, sort_keys=True)
+    return written, unchanged
+
 
 if __name__ == '__main__':
-    # Taking the state machine we made
-    tsm = Thermo.TemperatureMachine()
+    here = os.path.dirname(os.path.abspath(__file__))
+    arguments = sys.argv[1:]
+    force = '--force' in arguments
+    if force:
+        arguments.remove('--force')
+
+    options = {'--output': os.path.join(here, 'diagrams'), '--root': os.path.dirname(here)}
+    for option in options:
+        if option in arguments:
+            index = arguments.index(option)
+            options[option] = arguments[index + 1]
+            del arguments[index:index + 2]
 
-    graph = DotGraphMachine(tsm)
+    formats = arguments or list(DEFAULT_FORMATS)
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        sys.exit(f"Unknown format {', '.join(unknown)}, expected {', '.join(FORMATS)}")
 
-    dot = graph()
+    rendered = [name for name in formats if name in GRAPHVIZ_FORMATS]
+    if rendered and shutil.which('dot') is None:
+        if arguments:
+            sys.exit(f"{', '.join(rendered)} output needs Graphviz's dot command, install Graphviz (e.g. apt install "
+                     f"graphviz) or ask for dot or mermaid only")
+        print("Graphviz's dot command isn't installed, skipping png. Install Graphviz (e.g. apt install graphviz) to "
+              "render the diagrams.")
+        formats = [name for name in formats if name not in GRAPHVIZ_FORMATS]
 
-    print(dot.to_string)
+    machines = find_machines(options['--root'])
+    for machine in machines:
+        print(f"{machine.name} ({machine.path}): {len(machine.states)} states, {len(machine.transitions)} transitions")
 
-    dot.write_png('StateMachine.png')
+    try:
+        written, unchanged = generate(machines, formats, options['--output'], force)
+    except OSError as error:
+        sys.exit(str(error))
+    for path in written:
+        print(f"Wrote {os.path.relpath(path)}")
+    print(f"{len(written)} diagrams written, {len(unchanged)} unchanged")
 
+    legacy = os.path.join(options['--output'], f"{LEGACY_MACHINE}.{FORMATS['png']}")
+    if 'png' in formats and os.path.exists(legacy):
+        shutil.copyfile(legacy, os.path.join(here, LEGACY_PNG))
+        print(f"Copied {os.path.relpath(legacy)} to {os.path.relpath(os.path.join(here, LEGACY_PNG))}")
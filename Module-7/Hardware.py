@@ -0,0 +1,779 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          PWM channels for the fade engine, on the hardware  #
+#               PWM block where the pin has one.                   #
+#                                                                  #
+#    3          The Pi LCD is driven with bulk line writes through #
+#               the GPIO character device when gpiod is installed. #
+#                                                                  #
+#    4          Sensors can sit behind a TCA9548A I2C multiplexer. #
+#                                                                  #
+#    5          Sensors are named for bus statistics and the fake  #
+#               AHTx0 can measure both values in one cycle.        #
+#                                                                  #
+#    6          The fake AHTx0 reports raw 20 bit values, rounded  #
+#               the way the real part rounds them.                 #
+#                                                                  #
+#    7          An AHTx0 that is already calibrated can be         #
+#               attached without the reset and calibration, for a  #
+#               warm restart.                                      #
+#                                                                  #
+#    8          Up to eight TCA9548A multiplexers can be chained,  #
+#               and mux channels are checked in both backends.     #
+#------------------------------------------------------------------#
+
+"""
+Hardware.py - Hardware abstraction layer for the thermostat. Every GPIO pin, I2C sensor, LCD and serial port is created
+through a backend instead of importing board, digitalio, gpiozero and adafruit_ahtx0 directly. Two backends are
+provided:
+    - pi  - the real Raspberry Pi drivers. This is the default.
+    - sim - in-process simulators: a gpiozero mock pin factory, a fake AHTx0 that follows a scriptable temperature
+            curve, a virtual 16x2 LCD and a pty pair standing in for the serial port. The simulated clock can run
+            faster than real time, or be stepped, so hours of thermostat behavior can be run in seconds.
+
+The backend is chosen with the THERMOSTAT_BACKEND environment variable, or in code with use_backend().
+"""
+
+import os
+import tty
+
+from datetime import datetime, timedelta
+from math import sin, pi as PI
+from threading import Lock
+from time import monotonic, sleep
+
+import FixedPoint
+
+# Name of the environment variable used to pick the backend
+BACKEND_VARIABLE = 'THERMOSTAT_BACKEND'
+
+# Serial settings shared by every script in the project
+BAUD_RATE = 115200
+
+# AHT20 default I2C address
+AHTX0_ADDRESS = 0x38
+
+# TCA9548A I2C multiplexer addresses, used when sensors are given a mux channel. Up to eight multiplexers can share
+# the bus at 0x70 to 0x77, set by their address pins, and each has eight channels. Mux channel n is channel n % 8 of
+# the multiplexer at TCA9548A_ADDRESS + n // 8, so channels 0 to 7 are on the first one, 8 to 15 on the second, etc.
+TCA9548A_ADDRESS = 0x70
+TCA9548A_COUNT = 8
+TCA9548A_CHANNELS = 8
+
+# Number of mux channels across every chained multiplexer
+MUX_CHANNELS = TCA9548A_COUNT * TCA9548A_CHANNELS
+
+# Wiring of the 16x2 LCD as (rs, en, d4, d5, d6, d7) Broadcom pin numbers
+LCD_PINS = (17, 27, 5, 6, 13, 26)
+
+# Pins that can be driven by the BCM2835 PWM block, as (chip, channel) in /sys/class/pwm. The channels only appear
+# once the pwm-2chan overlay is enabled in /boot/config.txt.
+HARDWARE_PWM_PINS = {12: (0, 0), 18: (0, 0), 13: (0, 1), 19: (0, 1)}
+PWM_CHIP_PATH = '/sys/class/pwm/pwmchip{}'
+
+# GPIO character device the LCD lines are requested from
+GPIO_CHIP = '/dev/gpiochip0'
+
+
+class RealClock:
+    """
+    RealClock - The system clocks. now() is monotonic and is used for all timing. wall_time() is used for anything
+    shown to the user.
+    """
+
+    @staticmethod
+    def now():
+        """now - Current monotonic time in seconds."""
+        return monotonic()
+
+    @staticmethod
+    def wall_time():
+        """wall_time - Current date and time."""
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds):
+        """sleep - Block for the given number of seconds."""
+        sleep(seconds)
+
+    @staticmethod
+    def wait(event, timeout):
+        """
+        wait - Block until the event is set or the timeout passes.
+
+        @return True if the event was set.
+        """
+        return event.wait(timeout)
+
+    # End class RealClock definition
+
+
+class SimClock:
+    """
+    SimClock - Simulated clock. With a speedup the simulated time runs that many times faster than real time and every
+    wait is shortened to match, so threaded code keeps working unchanged. Without a speedup the clock is stepped: it
+    only moves when something waits or sleeps on it, and waits return immediately. Stepped mode is deterministic and
+    as fast as the code can run, but it is only meaningful when a single thread drives the simulation.
+    """
+
+    def __init__(self, speedup=None, start=datetime(2024, 1, 1)):
+        """
+        Set up the clock at simulated time zero.
+
+        @param speedup is how many times faster than real time the clock runs. None steps the clock instead.
+        @param start is the date and time reported by wall_time() at simulated time zero.
+        """
+        self.speedup = speedup
+        self.start = start
+        self._lock = Lock()
+        self._offset = 0.0
+        self._origin = monotonic()
+
+    def now(self):
+        """now - Simulated time in seconds since the clock was created."""
+        if self.speedup is None:
+            return self._offset
+        return (monotonic() - self._origin) * self.speedup
+
+    def wall_time(self):
+        """wall_time - Simulated date and time."""
+        return self.start + timedelta(seconds=self.now())
+
+    def advance(self, seconds):
+        """
+        advance - Move a stepped clock forward.
+
+        @param seconds is the number of simulated seconds to move forward.
+        """
+        with self._lock:
+            self._offset += seconds
+
+    def sleep(self, seconds):
+        """sleep - Block for the given number of simulated seconds."""
+        if self.speedup is None:
+            self.advance(seconds)
+        else:
+            sleep(seconds / self.speedup)
+
+    def wait(self, event, timeout):
+        """
+        wait - Block until the event is set or the given number of simulated seconds pass.
+
+        @return True if the event was set.
+        """
+        if self.speedup is None:
+            if not event.is_set():
+                self.advance(timeout)
+            return event.is_set()
+        return event.wait(timeout / self.speedup)
+
+    # End class SimClock definition
+
+
+def daily_curve(mean=21.0, swing=3.0, period=86400.0, phase=0.0):
+    """
+    daily_curve - Build a temperature curve that swings around a mean once per period, like a room over a day.
+
+    @param mean is the average temperature in Celsius.
+    @param swing is how far above and below the mean the temperature goes.
+    @param period is the length of one cycle in seconds.
+    @param phase is the offset in seconds into the cycle at time zero.
+    @return a callable that maps simulated seconds to Celsius.
+    """
+    return lambda t: mean + swing * sin(2 * PI * (t + phase) / period)
+
+
+def piecewise_curve(points):
+    """
+    piecewise_curve - Build a temperature curve by linear interpolation between scripted points. Before the first point
+    and after the last the curve holds the end value.
+
+    @param points is a list of (seconds, celsius) tuples in time order.
+    @return a callable that maps simulated seconds to Celsius.
+    """
+    points = list(points)
+
+    def curve(t):
+        if t <= points[0][0]:
+            return points[0][1]
+        for (t0, c0), (t1, c1) in zip(points, points[1:]):
+            if t <= t1:
+                return c0 + (c1 - c0) * (t - t0) / (t1 - t0)
+        return points[-1][1]
+
+    return curve
+
+
+def mux_location(mux_channel):
+    """
+    mux_location - The multiplexer and its channel a mux channel stands for.
+
+    @param mux_channel is the mux channel, 0 to MUX_CHANNELS - 1.
+    @return a tuple of (multiplexer I2C address, channel on that multiplexer).
+    @raises ValueError if there is no such channel.
+    """
+    if not 0 <= mux_channel < MUX_CHANNELS:
+        raise ValueError(f"Mux channel {mux_channel} is out of range, {TCA9548A_COUNT} chained TCA9548As have channels "
+                         f"0 to {MUX_CHANNELS - 1}")
+    return TCA9548A_ADDRESS + mux_channel // TCA9548A_CHANNELS, mux_channel % TCA9548A_CHANNELS
+
+
+def sensor_name(address=AHTX0_ADDRESS, mux_channel=None):
+    """
+    sensor_name - Name of a sensor for statistics, e.g. 'ahtx0@0x38' or 'ahtx0@0x38/3' behind multiplexer channel 3.
+    """
+    name = f'ahtx0@0x{address:02x}'
+    return name if mux_channel is None else f'{name}/{mux_channel}'
+
+
+class FakeAHTx0:
+    """
+    FakeAHTx0 - Simulated AHT20 temperature and humidity sensor. It has the same temperature and relative_humidity
+    properties as adafruit_ahtx0.AHTx0. The values come from curves of the simulated clock, and each access takes the
+    same simulated measurement time as the real part.
+    """
+
+    def __init__(self, clock, curve=None, humidity_curve=None, measurement_time=0.08):
+        """
+        Set up the sensor.
+
+        @param clock is the SimClock the curves are evaluated against.
+        @param curve maps simulated seconds to Celsius. Defaults to daily_curve().
+        @param humidity_curve maps simulated seconds to relative humidity. Defaults to a constant 40%.
+        @param measurement_time is the number of simulated seconds each access takes.
+        """
+        self.clock = clock
+        self.curve = curve if curve is not None else daily_curve()
+        self.humidity_curve = humidity_curve if humidity_curve is not None else (lambda t: 40.0)
+        self.measurement_time = measurement_time
+
+        # Number of measurements taken, so the bus traffic can be counted
+        self.measurements = 0
+
+    def _measure(self):
+        """_measure - Account for one measurement cycle."""
+        self.measurements += 1
+        if self.measurement_time:
+            self.clock.sleep(self.measurement_time)
+
+    def measure(self):
+        """
+        measure - Take one measurement cycle and return both values from it.
+
+        @return a tuple of (celsius, humidity).
+        """
+        self._measure()
+        now = self.clock.now()
+        return self.curve(now), self.humidity_curve(now)
+
+    def measure_raw(self):
+        """
+        measure_raw - Take one measurement cycle and return the raw 20 bit values the real part would have read.
+
+        @return a tuple of (humidity raw, temperature raw).
+        """
+        celsius, humidity = self.measure()
+        return FixedPoint.raw_humidity(humidity), FixedPoint.raw_temperature(celsius)
+
+    @property
+    def temperature(self):
+        """The simulated temperature in Celsius"""
+        self._measure()
+        return self.curve(self.clock.now())
+
+    @property
+    def relative_humidity(self):
+        """The simulated relative humidity in %"""
+        self._measure()
+        return self.humidity_curve(self.clock.now())
+
+    # End class FakeAHTx0 definition
+
+
+class VirtualLCD:
+    """
+    VirtualLCD - In memory 16x2 character LCD. It accepts the same clear(), cursor_position() and message calls as
+    adafruit_character_lcd's Character_LCD_Mono and counts the nibble writes the real panel would have needed.
+    """
+
+    def __init__(self, columns=16, rows=2):
+        """
+        Set up a blank display.
+
+        @param columns is the number of characters per row.
+        @param rows is the number of rows.
+        """
+        self.columns = columns
+        self.rows = rows
+        self.row = 0
+        self.column = 0
+        self._message = None
+        self.nibble_writes = 0
+        self.clears = 0
+        self._cells = [[' '] * columns for _ in range(rows)]
+
+    def clear(self):
+        """clear - Blank the display and home the cursor."""
+        self._cells = [[' '] * self.columns for _ in range(self.rows)]
+        self.row = 0
+        self.column = 0
+        self.nibble_writes += 2
+        self.clears += 1
+
+    def cursor_position(self, column, row):
+        """
+        cursor_position - Move the cursor.
+
+        @param column is the column to move to.
+        @param row is the row to move to.
+        """
+        self.row = min(row, self.rows - 1)
+        self.column = column
+        self.nibble_writes += 2
+
+    @property
+    def message(self):
+        """The last message written"""
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        """Write the message starting at the current row and column, the same way the adafruit driver does."""
+        self._message = message
+        line = self.row
+        column = self.column
+        self.cursor_position(column, line)
+        for character in message:
+            if character == '\n':
+                line += 1
+                column = 0
+                self.cursor_position(column, line)
+                continue
+            if line < self.rows and column < self.columns:
+                self._cells[line][column] = character
+            column += 1
+            self.nibble_writes += 2
+        self.row = 0
+        self.column = 0
+
+    def text(self):
+        """
+        text - What the display is currently showing.
+
+        @return the rows of the display joined by a newline.
+        """
+        return '\n'.join(''.join(row) for row in self._cells)
+
+    # End class VirtualLCD definition
+
+
+class SysfsPwmChannel:
+    """
+    SysfsPwmChannel - A hardware PWM channel driven through the kernel's sysfs interface. The PWM block generates the
+    waveform, so nothing runs on the CPU between duty cycle changes. The duty_cycle file is kept open so each change
+    is a single write.
+    """
+
+    def __init__(self, chip, channel, frequency=1000):
+        """
+        Export and enable the channel with a 0% duty cycle.
+
+        @param chip is the pwmchip number.
+        @param channel is the channel on the chip.
+        @param frequency is the PWM frequency in Hz.
+        """
+        self.path = os.path.join(PWM_CHIP_PATH.format(chip), f'pwm{channel}')
+        if not os.path.exists(self.path):
+            with open(os.path.join(PWM_CHIP_PATH.format(chip), 'export'), 'w') as export:
+                export.write(str(channel))
+
+        self.period = round(1e9 / frequency)
+        self._write('duty_cycle', 0)
+        self._write('period', self.period)
+        self._write('enable', 1)
+        self._duty_fd = os.open(os.path.join(self.path, 'duty_cycle'), os.O_WRONLY)
+
+    def _write(self, name, value):
+        """_write - Write one attribute of the channel."""
+        with open(os.path.join(self.path, name), 'w') as attribute:
+            attribute.write(str(value))
+
+    def set(self, duty):
+        """
+        set - Change the duty cycle.
+
+        @param duty is the fraction of each period the output is high, 0 to 1.
+        """
+        os.pwrite(self._duty_fd, str(round(duty * self.period)).encode(), 0)
+
+    def close(self):
+        """close - Turn the output off and disable the channel."""
+        self.set(0)
+        os.close(self._duty_fd)
+        self._write('enable', 0)
+
+    # End class SysfsPwmChannel definition
+
+
+class DeviceChannel:
+    """
+    DeviceChannel - A PWM channel on a gpiozero PWMLED. This is software PWM unless the pin factory times it in
+    hardware, e.g. pigpio, which uses DMA.
+    """
+
+    def __init__(self, device):
+        """
+        Wrap the device.
+
+        @param device is a gpiozero PWMLED, or anything with a 0 to 1 'value' and close().
+        """
+        self.device = device
+
+    def set(self, duty):
+        """set - Change the duty cycle, 0 to 1."""
+        self.device.value = duty
+
+    def close(self):
+        """close - Release the device."""
+        self.device.close()
+
+    # End class DeviceChannel definition
+
+
+class NullChannel:
+    """
+    NullChannel - A PWM channel with no LED behind it, for a zone that has no indicator LEDs.
+    """
+
+    def set(self, duty):
+        """set - Nothing to drive."""
+
+    def close(self):
+        """close - Nothing to release."""
+
+    # End class NullChannel definition
+
+
+def _attach_ahtx0(adafruit_ahtx0, bus, address):
+    """
+    _attach_ahtx0 - Attach to an AHTx0 without the driver's constructor, which sleeps through a soft reset and a
+    calibration every time. The sensor keeps its calibration for as long as it is powered.
+
+    @param adafruit_ahtx0 is the driver module.
+    @param bus is the I2C bus or multiplexer channel.
+    @param address is the sensor's I2C address.
+    @return the sensor, or None if its status says it isn't calibrated.
+    """
+    from adafruit_bus_device.i2c_device import I2CDevice
+
+    # The attributes the driver's constructor sets up
+    sensor = adafruit_ahtx0.AHTx0.__new__(adafruit_ahtx0.AHTx0)
+    sensor.i2c_device = I2CDevice(bus, address)
+    sensor._buf = bytearray(6)
+    sensor._temp = None
+    sensor._humidity = None
+    return sensor if sensor.status & adafruit_ahtx0.AHTX0_STATUS_CALIBRATED else None
+
+
+class PiBackend:
+    """
+    PiBackend - The real Raspberry Pi drivers. Driver packages are only imported when a device is created, so importing
+    this module doesn't need them.
+    """
+
+    name = 'pi'
+
+    def __init__(self):
+        """Set up the backend with the system clocks."""
+        self.clock = RealClock()
+        self._i2c = None
+
+        # TCA9548A drivers by address, each created on first use
+        self._muxes = {}
+
+    def pwm_led(self, pin):
+        """pwm_led - Create a gpiozero PWMLED on the given pin."""
+        from gpiozero import PWMLED
+        return PWMLED(pin)
+
+    def pwm_channel(self, pin, frequency=1000):
+        """
+        pwm_channel - Create a PWM channel for the fade engine. Pins with a hardware PWM channel exported through
+        sysfs use it, every other pin falls back to a gpiozero PWMLED.
+        """
+        if pin in HARDWARE_PWM_PINS:
+            chip, channel = HARDWARE_PWM_PINS[pin]
+            if os.path.isdir(PWM_CHIP_PATH.format(chip)):
+                try:
+                    return SysfsPwmChannel(chip, channel, frequency)
+                except OSError:
+                    # The channel is busy or we don't have permission, software PWM still works
+                    pass
+
+        from gpiozero import PWMLED
+        return DeviceChannel(PWMLED(pin, frequency=frequency))
+
+    def led(self, pin):
+        """led - Create a gpiozero LED on the given pin."""
+        from gpiozero import LED
+        return LED(pin)
+
+    def button(self, pin):
+        """button - Create a gpiozero Button on the given pin."""
+        from gpiozero import Button
+        return Button(pin)
+
+    def i2c(self):
+        """i2c - The shared I2C bus. Created on first use."""
+        if self._i2c is None:
+            import board
+            self._i2c = board.I2C()
+        return self._i2c
+
+    def temperature_sensor(self, address=AHTX0_ADDRESS, mux_channel=None, calibrate=True):
+        """
+        temperature_sensor - Create an AHTx0 on the shared I2C bus.
+
+        @param address is the sensor's I2C address.
+        @param mux_channel is the TCA9548A channel the sensor is on, counted across the chained multiplexers as
+        mux_location() describes, or None if it is on the bus directly. Several sensors with the same fixed address
+        can share the bus this way.
+        @param calibrate defaulted to True. False attaches to a sensor that reports it is still calibrated, e.g. when
+        the thermostat restarts while the sensor stays powered, skipping the driver's soft reset and calibration. A
+        sensor that isn't calibrated is calibrated either way.
+        @raises ValueError if there is no such mux channel.
+        """
+        import adafruit_ahtx0
+        if mux_channel is None:
+            bus = self.i2c()
+        else:
+            mux_address, channel = mux_location(mux_channel)
+            if mux_address not in self._muxes:
+                import adafruit_tca9548a
+                self._muxes[mux_address] = adafruit_tca9548a.TCA9548A(self.i2c(), mux_address)
+            bus = self._muxes[mux_address][channel]
+
+        sensor = None if calibrate else _attach_ahtx0(adafruit_ahtx0, bus, address)
+        if sensor is None:
+            sensor = adafruit_ahtx0.AHTx0(bus, address)
+        sensor.name = sensor_name(address, mux_channel)
+        return sensor
+
+    def character_lcd(self, columns=16, rows=2):
+        """
+        character_lcd - Set up the display. The bulk write driver is used when gpiod is installed, otherwise the
+        adafruit driver.
+
+        @return a tuple of the LCD and the list of pins, which must be deinitialised when the display is cleaned up.
+        """
+        try:
+            return self.bulk_lcd(columns, rows)
+        except ImportError:
+            return self.adafruit_lcd(columns, rows)
+
+    def bulk_lcd(self, columns=16, rows=2):
+        """
+        bulk_lcd - Request the six display lines together from the GPIO character device and create the bulk write
+        HD44780 driver on them.
+
+        @return a tuple of the LCD and a list holding the LCD, which releases the lines when deinitialised.
+        """
+        import gpiod
+        from gpiod.line import Direction, Value
+        from Hd44780 import BulkHD44780
+
+        request = gpiod.request_lines(
+            GPIO_CHIP,
+            consumer='thermostat-lcd',
+            config={LCD_PINS: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=Value.INACTIVE)}
+        )
+        lcd = BulkHD44780(request, LCD_PINS, columns, rows, Value.ACTIVE, Value.INACTIVE)
+        return lcd, [lcd]
+
+    def adafruit_lcd(self, columns=16, rows=2):
+        """
+        adafruit_lcd - Set up the six GPIO lines to the display with digitalio and create the adafruit LCD driver on
+        them.
+
+        @return a tuple of the LCD and the list of pins, which must be deinitialised when the display is cleaned up.
+        """
+        import board
+        import digitalio
+        import adafruit_character_lcd.character_lcd as characterlcd
+
+        pins = [digitalio.DigitalInOut(getattr(board, f'D{number}')) for number in LCD_PINS]
+        lcd = characterlcd.Character_LCD_Mono(*pins, columns, rows)
+        return lcd, pins
+
+    def serial_port(self, port):
+        """serial_port - Open the named serial port with the project's settings."""
+        import serial
+        return serial.Serial(
+            port=port,
+            baudrate=BAUD_RATE,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+
+    # End class PiBackend definition
+
+
+class SimBackend:
+    """
+    SimBackend - In-process simulators for every device. LEDs and buttons are gpiozero devices on a mock pin factory,
+    so they can be inspected and pressed from code. Serial ports are pty pairs: the device side is a real
+    serial.Serial on the pty, and the other end is kept in 'serial_peers' for a simulated server to read.
+    """
+
+    name = 'sim'
+
+    def __init__(self, speedup=None, curve=None, humidity_curve=None, measurement_time=0.08):
+        """
+        Set up the simulators.
+
+        @param speedup is how many times faster than real time the simulated clock runs. None steps the clock.
+        @param curve maps simulated seconds to Celsius for every fake sensor. Defaults to daily_curve().
+        @param humidity_curve maps simulated seconds to relative humidity.
+        @param measurement_time is the simulated duration of each sensor access.
+        """
+        from gpiozero import Device
+        from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+        self.clock = SimClock(speedup)
+        self.curve = curve
+        self.humidity_curve = humidity_curve
+        self.measurement_time = measurement_time
+
+        Device.pin_factory = MockFactory(pin_class=MockPWMPin)
+        self.pin_factory = Device.pin_factory
+
+        self.sensors = []
+        self.displays = []
+        self.serial_peers = {}
+        self._pty_fds = []
+
+    def pwm_led(self, pin):
+        """pwm_led - Create a PWMLED on a mock pin."""
+        from gpiozero import PWMLED
+        return PWMLED(pin)
+
+    def pwm_channel(self, pin, frequency=1000):
+        """pwm_channel - Create a PWM channel on a mock pin. Its duty cycle can be read from channel.device.value."""
+        from gpiozero import PWMLED
+        return DeviceChannel(PWMLED(pin, frequency=frequency))
+
+    def led(self, pin):
+        """led - Create an LED on a mock pin."""
+        from gpiozero import LED
+        return LED(pin)
+
+    def button(self, pin):
+        """button - Create a Button on a mock pin. Press it with button.pin.drive_low()."""
+        from gpiozero import Button
+        return Button(pin)
+
+    def i2c(self):
+        """i2c - There is no bus to share in the simulator."""
+        return None
+
+    def temperature_sensor(self, address=AHTX0_ADDRESS, mux_channel=None, calibrate=True):
+        """
+        temperature_sensor - Create a FakeAHTx0 on the simulated clock. It never needs calibrating.
+
+        @raises ValueError if there is no such mux channel, as on the Pi.
+        """
+        if mux_channel is not None:
+            mux_location(mux_channel)
+        sensor = FakeAHTx0(self.clock, self.curve, self.humidity_curve, self.measurement_time)
+        sensor.address = address
+        sensor.mux_channel = mux_channel
+        sensor.name = sensor_name(address, mux_channel)
+        self.sensors.append(sensor)
+        return sensor
+
+    def character_lcd(self, columns=16, rows=2):
+        """
+        character_lcd - Create a VirtualLCD.
+
+        @return a tuple of the LCD and an empty pin list.
+        """
+        lcd = VirtualLCD(columns, rows)
+        self.displays.append(lcd)
+        return lcd, []
+
+    def serial_port(self, port):
+        """
+        serial_port - Open a pty pair in place of the named port. The device gets a serial.Serial on the pty and the
+        other end is stored as a binary file in serial_peers[port].
+        """
+        import serial
+
+        controller, device = os.openpty()
+        tty.setraw(device)
+        self._pty_fds.append(device)
+        self.serial_peers[port] = os.fdopen(controller, 'rb+', buffering=0)
+
+        return serial.Serial(
+            port=os.ttyname(device),
+            baudrate=BAUD_RATE,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=1
+        )
+
+    def close(self):
+        """close - Close the pty pairs and release the mock pins."""
+        for peer in self.serial_peers.values():
+            peer.close()
+        for fd in self._pty_fds:
+            os.close(fd)
+        self.serial_peers = {}
+        self._pty_fds = []
+        self.pin_factory.reset()
+
+    # End class SimBackend definition
+
+
+# Registry of the available backends by name
+BACKENDS = {
+    'pi': PiBackend,
+    'sim': SimBackend,
+}
+
+# The backend in use. Created on the first call to get_backend().
+_backend = None
+
+
+def use_backend(name, **options):
+    """
+    use_backend - Select the backend for every device created from now on.
+
+    @param name is 'pi' or 'sim'.
+    @param options are passed to the backend's initializer.
+    @return the new backend.
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown hardware backend '{name}', expected one of {', '.join(BACKENDS)}")
+    _backend = BACKENDS[name](**options)
+    return _backend
+
+
+def get_backend():
+    """
+    get_backend - The backend in use. If none has been selected, the THERMOSTAT_BACKEND environment variable picks
+    one, defaulting to the real Raspberry Pi drivers.
+
+    @return the backend.
+    """
+    if _backend is None:
+        use_backend(os.environ.get(BACKEND_VARIABLE, 'pi'))
+    return _backend
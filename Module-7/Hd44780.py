@@ -0,0 +1,169 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+Hd44780.py - Driver for the 16x2 HD44780 LCD on its 4 bit bus that sets the data lines and the enable strobe together.
+adafruit_character_lcd sets each of the six lines with its own digitalio call and sleeps at least 100us after every
+nibble. Here every bus state is one bulk write through a GPIO character device line request, so a nibble is two writes:
+data with enable high, then enable low. The register select line is only written when it changes.
+
+The panel's RW line is tied to ground in our wiring, so the busy flag can't be read. Instead the driver remembers when
+the last command will have finished executing and only waits if the next write comes sooner. The execution times
+default to the datasheet figures, which already include the margin for the slowest 190kHz oscillator.
+"""
+
+from time import perf_counter, sleep
+
+# Commands
+CLEAR = 0x01
+HOME = 0x02
+ENTRY_MODE = 0x06        # Increment the address, no display shift
+DISPLAY_ON = 0x0C        # Display on, cursor and blink off
+FUNCTION_SET = 0x28      # 4 bit bus, 2 lines, 5x8 font
+SET_DDRAM = 0x80
+
+# DDRAM address of the first column of each row
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+# Datasheet execution times in seconds
+EXECUTION_TIME = 37e-6
+CLEAR_TIME = 1.52e-3
+
+
+class BulkHD44780:
+    """
+    BulkHD44780 - HD44780 driver on a bulk line request. Accepts the same clear(), cursor_position() and message calls
+    as adafruit_character_lcd's Character_LCD_Mono, so the FrameRenderer can drive it unchanged.
+    """
+
+    def __init__(self, request, pins, columns=16, rows=2, active=True, inactive=False,
+                 execution_time=EXECUTION_TIME, clear_time=CLEAR_TIME):
+        """
+        Set up the display and run the 4 bit initialization sequence.
+
+        @param request is the line request, anything with set_values(mapping of line to value) and release(), e.g.
+        from gpiod.request_lines().
+        @param pins is the (rs, en, d4, d5, d6, d7) line offsets.
+        @param columns is the number of characters per row.
+        @param rows is the number of rows.
+        @param active is the value that drives a line high, e.g. gpiod.line.Value.ACTIVE.
+        @param inactive is the value that drives a line low.
+        @param execution_time is the number of seconds a normal command or character takes to execute.
+        @param clear_time is the number of seconds clear and home take to execute.
+        """
+        self.request = request
+        self.columns = columns
+        self.rows = rows
+        self.execution_time = execution_time
+        self.clear_time = clear_time
+
+        self.rs, self.en, *data = pins
+        self._enable_high = {self.en: active}
+        self._enable_low = {self.en: inactive}
+        self._select = {False: {self.rs: inactive}, True: {self.rs: active}}
+
+        # The bus state for every nibble, data lines plus enable high, built once
+        self._nibbles = [{**{line: active if nibble >> bit & 1 else inactive for bit, line in enumerate(data)},
+                          self.en: active} for nibble in range(16)]
+
+        self.row = 0
+        self.column = 0
+        self._message = None
+        self._register = None
+        self._ready_at = 0.0
+
+        # Statistics
+        self.nibble_writes = 0
+        self.bus_writes = 0
+
+        self._initialize()
+
+    def _initialize(self):
+        """_initialize - Put the controller in 4 bit mode whatever state it powered up in, then configure it."""
+        sleep(0.05)
+        self._set_register(False)
+        for delay in (4.1e-3, 100e-6, 100e-6):
+            self._nibble(0x3)
+            sleep(delay)
+        self._nibble(0x2)
+        self._ready_at = perf_counter() + self.execution_time
+
+        self.command(FUNCTION_SET)
+        self.command(DISPLAY_ON)
+        self.clear()
+        self.command(ENTRY_MODE)
+
+    def _set_register(self, data):
+        """_set_register - Select the data (True) or instruction (False) register if it isn't already."""
+        if data != self._register:
+            self.request.set_values(self._select[data])
+            self.bus_writes += 1
+            self._register = data
+
+    def _nibble(self, nibble):
+        """_nibble - Strobe four bits into the controller. It latches them when enable falls."""
+        self.request.set_values(self._nibbles[nibble])
+        self.request.set_values(self._enable_low)
+        self.bus_writes += 2
+        self.nibble_writes += 1
+
+    def _write(self, value, data, execution_time):
+        """_write - Send one byte once the previous one has executed."""
+        self._set_register(data)
+        while perf_counter() < self._ready_at:
+            pass
+        self._nibble(value >> 4)
+        self._nibble(value & 0x0F)
+        self._ready_at = perf_counter() + execution_time
+
+    def command(self, value):
+        """command - Send an instruction byte."""
+        self._write(value, False, self.clear_time if value in (CLEAR, HOME) else self.execution_time)
+
+    def clear(self):
+        """clear - Blank the display and home the cursor."""
+        self.command(CLEAR)
+        self.row = 0
+        self.column = 0
+
+    def cursor_position(self, column, row):
+        """
+        cursor_position - Move the cursor.
+
+        @param column is the column to move to.
+        @param row is the row to move to.
+        """
+        self.row = min(row, self.rows - 1)
+        self.column = column
+        self.command(SET_DDRAM | (column + ROW_OFFSETS[self.row]))
+
+    @property
+    def message(self):
+        """The last message written"""
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        """Write the message starting at the current row and column, the same way the adafruit driver does."""
+        self._message = message
+        line = self.row
+        self.cursor_position(self.column, line)
+        for character in message:
+            if character == '\n':
+                line += 1
+                self.cursor_position(0, line)
+                continue
+            self._write(ord(character), True, self.execution_time)
+        self.row = 0
+        self.column = 0
+
+    def deinit(self):
+        """deinit - Release the lines. Named like digitalio's so ManagedDisplay can clean it up with the pins."""
+        self.request.release()
+
+    # End class BulkHD44780 definition
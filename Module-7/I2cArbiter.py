@@ -0,0 +1,196 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Measurements are integer tenths, converted from    #
+#               the sensor's raw 20 bit values.                    #
+#                                                                  #
+#    3          Measurements carry Fahrenheit tenths converted     #
+#               from the raw value.                                #
+#------------------------------------------------------------------#
+
+"""
+I2cArbiter.py - Serializes access to the shared I2C bus and takes one measurement per sample from each AHTx0. Reading
+adafruit_ahtx0's temperature and then its relative_humidity property triggers two 80ms measurement cycles, one per
+property. The arbiter triggers one cycle and returns both values from it.
+
+Requests for the same sensor are coalesced: a request made while a measurement of that sensor is in flight waits for
+it instead of queueing another, and a request made within the freshness window of the last measurement gets that
+measurement back without touching the bus. The bus time of every sensor is recorded so the load on a shared bus can be
+checked.
+
+Measurements are integer tenths of a degree Celsius, of a degree Fahrenheit and of a percent humidity, see
+FixedPoint.py.
+"""
+
+from collections import namedtuple
+from threading import Event, Lock
+from time import monotonic
+
+from FixedPoint import celsius_tenths, fahrenheit_tenths, fahrenheit_tenths_raw, humidity_tenths, raw_values, to_tenths
+
+# Measurement - One triggered read of a sensor, in tenths of a degree Celsius, tenths of a percent and tenths of a
+# degree Fahrenheit. timestamp is taken from the arbiter clock when the read completed.
+Measurement = namedtuple('Measurement', ['celsius_tenths', 'humidity_tenths', 'fahrenheit_tenths', 'timestamp'])
+
+
+def read_sensor(sensor):
+    """
+    read_sensor - Trigger one measurement cycle and read both values from it.
+
+    @param sensor is the sensor, tried in this order:
+        - measure_tenths() returning the Celsius, humidity and Fahrenheit tenths, e.g. a recording or replay sensor
+        - measure_raw() returning the raw 20 bit (humidity, temperature), e.g. Hardware.FakeAHTx0
+        - an adafruit_ahtx0.AHTx0, whose measurement is triggered once with _readdata() and whose raw values are
+          unpacked from the bytes it read into _buf
+        - measure() returning (celsius, humidity) as floats
+        - the temperature and relative_humidity properties
+    @return a tuple of (celsius tenths, humidity tenths, fahrenheit tenths). Fahrenheit is converted from the raw value
+    where there is one.
+    """
+    if hasattr(sensor, 'measure_tenths'):
+        return sensor.measure_tenths()
+    if hasattr(sensor, 'measure_raw'):
+        humidity, temperature = sensor.measure_raw()
+        return celsius_tenths(temperature), humidity_tenths(humidity), fahrenheit_tenths_raw(temperature)
+    if hasattr(sensor, '_readdata'):
+        sensor._readdata()
+        humidity, temperature = raw_values(sensor._buf)
+        return celsius_tenths(temperature), humidity_tenths(humidity), fahrenheit_tenths_raw(temperature)
+    if hasattr(sensor, 'measure'):
+        celsius, humidity = sensor.measure()
+    else:
+        celsius, humidity = sensor.temperature, sensor.relative_humidity
+    celsius = to_tenths(celsius)
+    return celsius, to_tenths(humidity), fahrenheit_tenths(celsius)
+
+
+class _Device:
+    """_Device - Per sensor bookkeeping: the last measurement, the one in flight and the bus time statistics."""
+
+    def __init__(self, name):
+        self.name = name
+        self.last = None
+        self.pending = None
+        self.error = None
+        self.reads = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.bus_time = 0.0
+        self.max_bus_time = 0.0
+
+    # End class _Device definition
+
+
+class BusArbiter:
+    """
+    BusArbiter - Owns the lock of one I2C bus. Every sensor on the bus is measured through measure(), so only one
+    transaction is on the bus at a time and concurrent requests for a sensor share one measurement.
+    """
+
+    def __init__(self, clock=monotonic, freshness=0.5):
+        """
+        Set up the arbiter.
+
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param freshness is the number of seconds a measurement is handed to further requests for the same sensor
+        without reading it again. 0 only coalesces requests made while a measurement is in flight.
+        """
+        self.clock = clock
+        self.freshness = freshness
+
+        # Held for every bus transaction
+        self.lock = Lock()
+
+        # Guards the device table and the in flight measurements, never held during a bus transaction
+        self._state_lock = Lock()
+        self._devices = {}
+
+    def _device(self, sensor):
+        """_device - The bookkeeping for a sensor, created on first use. Called with the state lock held."""
+        device = self._devices.get(id(sensor))
+        if device is None:
+            name = getattr(sensor, 'name', None) or f'{type(sensor).__name__}@{id(sensor):x}'
+            device = self._devices[id(sensor)] = _Device(name)
+        return device
+
+    def measure(self, sensor):
+        """
+        measure - Get a measurement of the sensor, reading it only if no fresh or in flight measurement can be shared.
+
+        @param sensor is the sensor, see read_sensor().
+        @return a Measurement.
+        @raises whatever the bus transaction raised, e.g. OSError. Requests that were waiting for it get the same error.
+        """
+        with self._state_lock:
+            device = self._device(sensor)
+            last = device.last
+            if last is not None and self.clock() - last.timestamp <= self.freshness:
+                device.coalesced += 1
+                return last
+
+            pending = device.pending
+            if pending is None:
+                pending = device.pending = Event()
+                owner = True
+            else:
+                device.coalesced += 1
+                owner = False
+
+        if not owner:
+            pending.wait()
+            if device.error is not None:
+                raise device.error
+            return device.last
+
+        error = None
+        measurement = None
+        try:
+            with self.lock:
+                started = self.clock()
+                try:
+                    celsius, humidity, fahrenheit = read_sensor(sensor)
+                finally:
+                    finished = self.clock()
+            measurement = Measurement(celsius, humidity, fahrenheit, finished)
+        except Exception as caught:
+            # Handed to the waiting requests as well, so none of them is left waiting on a read that never finishes
+            error = caught
+
+        with self._state_lock:
+            elapsed = finished - started
+            device.bus_time += elapsed
+            device.max_bus_time = max(device.max_bus_time, elapsed)
+            device.error = error
+            if error is None:
+                device.reads += 1
+                device.last = measurement
+            else:
+                device.errors += 1
+            device.pending = None
+        pending.set()
+
+        if error is not None:
+            raise error
+        return measurement
+
+    def stats(self):
+        """
+        stats - Bus use of every sensor measured so far.
+
+        @return a dictionary of sensor name to a dictionary with the reads, coalesced requests, errors, and the total
+        and maximum bus time in seconds.
+        """
+        with self._state_lock:
+            return {device.name: {
+                'reads': device.reads,
+                'coalesced': device.coalesced,
+                'errors': device.errors,
+                'bus_time': device.bus_time,
+                'max_bus_time': device.max_bus_time,
+            } for device in self._devices.values()}
+
+    # End class BusArbiter definition
@@ -0,0 +1,125 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+LcdRenderer.py - Frame buffer backed renderer for the HD44780 16x2 character LCD. Instead of clearing the panel and
+rewriting every character each tick, the renderer remembers the last frame it drew and only sends cursor moves and the
+characters that changed.
+"""
+
+# Every command and character sent to the HD44780 in 4-bit mode is two nibble writes on the GPIO lines.
+NIBBLES_PER_BYTE = 2
+
+
+class FrameRenderer:
+    """
+    FrameRenderer - Keeps a copy of what is on the LCD and turns each new message into the minimum set of writes. A
+    message is laid out the same way the adafruit_character_lcd message property lays it out (one line per row,
+    separated by a newline) and compared cell by cell to the previous frame. Changed cells are grouped into runs and each
+    run costs one cursor move plus one write per character.
+    """
+
+    def __init__(self, lcd, columns=16, rows=2):
+        """
+        Set up the renderer. The LCD is assumed to be blank, which is how ManagedDisplay leaves it after start up.
+
+        @param lcd is the character LCD object. It must provide a writable 'message' property and 'row' / 'column'
+        attributes for the start position like adafruit_character_lcd.character_lcd.Character_LCD_Mono.
+        @param columns is the number of characters per row.
+        @param rows is the number of rows.
+        """
+        self.lcd = lcd
+        self.columns = columns
+        self.rows = rows
+
+        # The frame currently on the panel, one string per row
+        self._frame = None
+        self.reset()
+
+        # Statistics so the saving on the display thread can be measured
+        self.last_nibble_writes = 0
+        self.total_nibble_writes = 0
+        self.frames = 0
+
+    def reset(self):
+        """
+        reset - Forget the previous frame and assume a blank panel. Call this after the LCD has been cleared.
+        """
+        self._frame = [' ' * self.columns] * self.rows
+
+    def layout(self, message):
+        """
+        layout - Convert a message into one fixed width string per row.
+
+        @param message is the text to lay out, with rows separated by a newline.
+        @return a list with one string of exactly 'columns' characters for each row.
+        """
+        lines = message.split('\n')[:self.rows]
+        lines += [''] * (self.rows - len(lines))
+        return [line[:self.columns].ljust(self.columns) for line in lines]
+
+    def diff(self, frame):
+        """
+        diff - Find the runs of cells that differ between the current frame and a new one. Runs separated by a single
+        unchanged cell are merged because rewriting that cell costs the same as a cursor move.
+
+        @param frame is the new frame as returned by layout().
+        @return a list of (column, row, text) tuples to write.
+        """
+        runs = []
+        for row, (old, new) in enumerate(zip(self._frame, frame)):
+            start = None
+            end = None
+            for column in range(self.columns):
+                if old[column] == new[column]:
+                    continue
+                if start is None:
+                    start = column
+                elif column - end > 2:
+                    runs.append((start, row, new[start:end + 1]))
+                    start = column
+                end = column
+            if start is not None:
+                runs.append((start, row, new[start:end + 1]))
+        return runs
+
+    @staticmethod
+    def cost(runs):
+        """
+        cost - Work out how many nibble writes a list of runs takes.
+
+        @param runs is a list of (column, row, text) tuples as returned by diff().
+        @return the number of nibble writes, one cursor move per run and one write per character.
+        """
+        return sum(NIBBLES_PER_BYTE * (1 + len(text)) for _, _, text in runs)
+
+    def render(self, message):
+        """
+        render - Update the LCD so that it shows the message, sending only the cells that changed.
+
+        @param message is the text to display, with rows separated by a newline.
+        @return the number of nibble writes this frame took.
+        """
+        frame = self.layout(message)
+        runs = self.diff(frame)
+
+        for column, row, text in runs:
+            # The message setter issues a single cursor move to (column, row) before writing the text, so setting the
+            # start position directly avoids a second cursor command from cursor_position().
+            self.lcd.column = column
+            self.lcd.row = row
+            self.lcd.message = text
+
+        self._frame = frame
+
+        self.last_nibble_writes = self.cost(runs)
+        self.total_nibble_writes += self.last_nibble_writes
+        self.frames += 1
+        return self.last_nibble_writes
+
+    # End class FrameRenderer definition
@@ -0,0 +1,330 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+Metrics.py - In process metrics registry served in the Prometheus text exposition format, so a fleet of thermostats
+can be charted instead of run blind.
+
+A Registry holds three kinds of metric, each identified by its name and labels:
+    - Counter   - a total that only goes up, e.g. bytes written to the serial port
+    - Gauge     - a value that goes up and down, e.g. the set point
+    - Histogram - observations counted into fixed buckets, with their sum, e.g. sensor read times
+
+Updating a metric takes its lock for a few additions and nothing is formatted until the registry is scraped.
+MetricsServer serves the registry at /metrics over HTTP on a local TCP port or on a Unix domain socket.
+"""
+
+import os
+import socketserver
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# Bucket upper bounds in seconds for latencies from 100us to 10s, e.g. an 80ms I2C measurement or a scheduler job
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.08, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    """_escape - A label value escaped for the exposition format."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    """_labels - The {name="value",...} part of a sample line, empty if there are no labels."""
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    """_number - A sample value in the exposition format."""
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Counter - A total that only increases.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        """inc - Add a non-negative amount."""
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can't decrease")
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        """samples - The sample lines of this counter."""
+        return [f'{self.name}{_labels(self.labels)} {_number(self.value)}']
+
+    # End class Counter definition
+
+
+class Gauge:
+    """
+    Gauge - A value that can be set, increased or decreased.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = Lock()
+
+    def set(self, value):
+        """set - Set the value. None is shown as NaN, e.g. a temperature before the first reading."""
+        self.value = float('nan') if value is None else value
+
+    def inc(self, amount=1):
+        """inc - Add an amount."""
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """dec - Subtract an amount."""
+        with self._lock:
+            self.value -= amount
+
+    def samples(self):
+        """samples - The sample lines of this gauge."""
+        value = 'NaN' if self.value != self.value else _number(self.value)
+        return [f'{self.name}{_labels(self.labels)} {value}']
+
+    # End class Gauge definition
+
+
+class Histogram:
+    """
+    Histogram - Observations counted into fixed buckets. Each bucket only counts its own observations, and the running
+    totals Prometheus expects are added up when scraped.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        """observe - Count an observation in the first bucket whose upper bound is at least the value."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        """samples - The cumulative bucket, sum and count lines of this histogram."""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_labels(self.labels, ("le", _number(bound)))} {cumulative}')
+        lines.append(f'{self.name}_sum{_labels(self.labels)} {_number(total)}')
+        lines.append(f'{self.name}_count{_labels(self.labels)} {cumulative}')
+        return lines
+
+    # End class Histogram definition
+
+
+class Registry:
+    """
+    Registry - Every metric of the process. Asking for a metric that already exists with the same name and labels
+    returns the existing one, so several machines can each ask for theirs by device label.
+    """
+
+    def __init__(self):
+        self._families = {}
+        self._lock = Lock()
+
+    def _get(self, metric_class, name, help_text, labels, *arguments):
+        """_get - Find or create a metric. A name is always the same kind of metric."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (metric_class, help_text, {})
+            elif family[0] is not metric_class:
+                raise ValueError(f"Metric {name} is a {family[0].kind}, not a {metric_class.kind}")
+
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = metric_class(name, key, *arguments)
+        return metric
+
+    def counter(self, name, help_text, **labels):
+        """
+        counter - Get or create a counter.
+
+        @param name is the metric name, ending in _total by convention.
+        @param help_text is the HELP line shown with the metric.
+        @param labels are the label names and values of this counter.
+        @return the Counter.
+        """
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, **labels):
+        """gauge - Get or create a gauge. See counter()."""
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, **labels):
+        """
+        histogram - Get or create a histogram. See counter().
+
+        @param buckets is the tuple of bucket upper bounds. Defaults to LATENCY_BUCKETS, in seconds.
+        """
+        return self._get(Histogram, name, help_text, labels, buckets)
+
+    def render(self):
+        """
+        render - Every metric in the Prometheus text exposition format.
+
+        @return the exposition text.
+        """
+        with self._lock:
+            families = sorted((name, metric_class.kind, help_text, list(metrics.values()))
+                              for name, (metric_class, help_text, metrics) in self._families.items())
+
+        lines = []
+        for name, kind, help_text, metrics in families:
+            help_text = help_text.replace('\\', '\\\\').replace('\n', '\\n')
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for metric in sorted(metrics, key=lambda metric: metric.labels):
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    # End class Registry definition
+
+
+class MeteredPort:
+    """
+    MeteredPort - Wraps a serial port and counts the writes and the bytes written and read. Everything else is passed
+    through.
+    """
+
+    def __init__(self, port, registry, **labels):
+        self.port = port
+        self.writes = registry.counter('thermostat_serial_writes_total', 'Writes to the serial port', **labels)
+        self.bytesWritten = registry.counter('thermostat_serial_written_bytes_total',
+                                             'Bytes written to the serial port', **labels)
+        self.bytesRead = registry.counter('thermostat_serial_read_bytes_total', 'Bytes read from the serial port',
+                                          **labels)
+
+    def write(self, data):
+        """write - Write and count the bytes."""
+        written = self.port.write(data)
+        self.writes.inc()
+        self.bytesWritten.inc(written if written is not None else len(data))
+        return written
+
+    def read(self, size=1):
+        """read - Read and count the bytes."""
+        data = self.port.read(size)
+        self.bytesRead.inc(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    # End class MeteredPort definition
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """_Handler - Serves GET /metrics from the server's registry."""
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # A Unix socket client has no address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        # Scrapes come every few seconds, so they aren't logged
+        pass
+
+    # End class _Handler definition
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """_UnixHTTPServer - HTTP over a Unix domain socket, for scrapers on the same machine."""
+    daemon_threads = True
+
+    # End class _UnixHTTPServer definition
+
+
+class MetricsServer:
+    """
+    MetricsServer - Serves a registry at /metrics on its own thread.
+    """
+
+    def __init__(self, registry, address=('127.0.0.1', 9108)):
+        """
+        Bind the server. Nothing is served until start() is called.
+
+        @param registry is the Registry to serve.
+        @param address is a (host, port) tuple for TCP, defaulting to port 9108 on the loopback interface only, or the
+        path of a Unix domain socket. A stale socket file at the path is removed.
+        """
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self.server = _UnixHTTPServer(address, _Handler)
+        else:
+            self.server = ThreadingHTTPServer(address, _Handler)
+            self.server.daemon_threads = True
+        self.server.registry = registry
+        self.address = address
+        self._thread = None
+
+    def start(self):
+        """start - Serve on a daemon thread."""
+        self._thread = Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop - Stop serving and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+        self._thread = None
+
+    # End class MetricsServer definition
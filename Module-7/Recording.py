@@ -0,0 +1,530 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Measurements are logged in integer tenths (log     #
+#               version 2).                                        #
+#                                                                  #
+#    3          Measurements log their Fahrenheit tenths too (log  #
+#               version 3).                                        #
+#                                                                  #
+#    4          The replay reaches the recorded start state with   #
+#               one direct event.                                  #
+#------------------------------------------------------------------#
+
+"""
+Recording.py - Records a TemperatureMachine's inputs and outputs in the field and replays them against the current
+code on the simulated backend.
+
+The recorder logs, with the time since recording started:
+    - every sensor measurement that reached the bus, its duration and the values read
+    - every button press, by handler
+    - every state transition
+    - every write to and read from the serial port
+    - when the periodic jobs were registered, so the replay schedules them at the same times
+
+The log is one tab separated line per record after a header line, gzip compressed when the file name ends in .gz.
+
+The replay builds a TemperatureMachine with the recorded settings on a stepped simulated clock, so it runs as fast as
+the code allows. The recorded measurements are served in order by a replay sensor, the button presses are made and the
+recorded serial input is fed back at their recorded times, and the machine's own jobs run in between. The transitions
+and serial output it produces are compared with the recorded ones.
+
+Usage: python Recording.py [days] [log]   - record a simulated run, replay it and compare
+"""
+
+import gzip
+import json
+
+from collections import namedtuple
+from datetime import datetime
+from threading import Lock
+from time import perf_counter
+
+import Hardware
+from I2cArbiter import read_sensor
+
+# Version of the log format, checked when a log is read
+LOG_VERSION = 3
+
+# First word of the header line
+LOG_MAGIC = 'thermostat-log'
+
+# Kinds of record
+MEASUREMENT = 'M'     # duration, celsius tenths, humidity tenths, fahrenheit tenths
+BUTTON = 'B'          # button
+TRANSITION = 'T'      # event, source, target
+OUTPUT = 'O'          # bytes written to the serial port, as hex
+INPUT = 'I'           # bytes read from the serial port, as hex
+JOBS = 'J'            # the periodic jobs were registered
+END = 'E'             # recording stopped
+
+# Button names and the TemperatureMachine handlers they press
+BUTTONS = {
+    'state': 'process_temp_state_button',
+    'inc': 'process_temp_inc_button',
+    'dec': 'process_temp_dec_button',
+}
+
+# Record - One line of a log. fields is a tuple of strings.
+Record = namedtuple('Record', ['time', 'kind', 'fields'])
+
+# ReplayResult - What a replay produced and how it compared with the recording.
+ReplayResult = namedtuple('ReplayResult', ['matched', 'mismatches', 'transitions', 'outputs', 'measurements',
+                                           'simulated_seconds', 'real_seconds'])
+
+
+def _open(path, mode):
+    """_open - Open a log as text, through gzip if the name ends in .gz."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class RecordingSensor:
+    """
+    RecordingSensor - Wraps the machine's sensor below the bus arbiter, so only measurements that reached the bus are
+    logged.
+    """
+
+    def __init__(self, sensor, recorder):
+        self.sensor = sensor
+        self.recorder = recorder
+        self.name = getattr(sensor, 'name', None)
+
+    def measure_tenths(self):
+        """measure_tenths - Take one measurement through the wrapped sensor and log it."""
+        started = self.recorder.clock()
+        celsius, humidity, fahrenheit = read_sensor(self.sensor)
+        self.recorder.log(MEASUREMENT, repr(self.recorder.clock() - started), str(celsius), str(humidity),
+                          str(fahrenheit), time=started)
+        return celsius, humidity, fahrenheit
+
+    # End class RecordingSensor definition
+
+
+class RecordingPort:
+    """
+    RecordingPort - Wraps the machine's serial port and logs the bytes written and read. Everything else is passed
+    through.
+    """
+
+    def __init__(self, port, recorder):
+        self.port = port
+        self.recorder = recorder
+
+    def write(self, data):
+        """write - Log and write the bytes."""
+        self.recorder.log(OUTPUT, bytes(data).hex())
+        return self.port.write(data)
+
+    def read(self, size=1):
+        """read - Read and log the bytes."""
+        data = self.port.read(size)
+        if data:
+            self.recorder.log(INPUT, data.hex())
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    # End class RecordingPort definition
+
+
+class EventRecorder:
+    """
+    EventRecorder - Logs a TemperatureMachine's inputs and outputs. Attach it before the machine is run and before its
+    buttons are wired up, so that the sensor, serial port and button handlers it wraps are the ones used.
+    """
+
+    def __init__(self, path, clock=None):
+        """
+        Open the log. Times are measured from now.
+
+        @param path is the log file. Compressed if the name ends in .gz.
+        @param clock is the clock to time the records with. Defaults to the machine's backend clock when attached.
+        """
+        self.path = path
+        self.clock = clock
+        self._file = None
+        self._lock = Lock()
+        self._origin = None
+        self.records = 0
+
+    def attach(self, machine):
+        """
+        attach - Start recording a machine. Writes the header with the settings needed to rebuild the machine.
+
+        @param machine is the TemperatureMachine.
+        """
+        if self.clock is None:
+            self.clock = machine.clock.now
+        self._origin = self.clock()
+
+        header = {
+            'version': LOG_VERSION,
+            'start': machine.clock.wall_time().isoformat(),
+            'set_point': machine.setPoint,
+            'state': machine.current_state.id,
+            'telemetry_format': machine.telemetryFormat,
+            'report_period': machine.reportPeriod,
+            'sample_period': machine.samplePeriod,
+            'max_staleness': machine.maxStaleness,
+        }
+        self._file = _open(self.path, 'w')
+        self._file.write(f'{LOG_MAGIC} {json.dumps(header)}\n')
+
+        # The sensor and port are wrapped where the machine looks them up, the sampler and uplink are pointed at the
+        # wrappers in case they already exist
+        machine.thSensor = RecordingSensor(machine.thSensor, self)
+        machine.sampler.sensor = machine.thSensor
+        machine.ser = RecordingPort(machine.ser, self)
+        if machine.uplink is not None:
+            machine.uplink.ser = machine.ser
+
+        for button, handler in BUTTONS.items():
+            setattr(machine, handler, self._button(button, getattr(machine, handler)))
+
+        add_jobs = machine.add_jobs
+
+        def recorded_add_jobs(screen=None):
+            self.log(JOBS)
+            add_jobs(screen)
+
+        machine.add_jobs = recorded_add_jobs
+        machine.add_listener(self)
+
+    def _button(self, button, handler):
+        """_button - Wrap a button handler so each press is logged before it is handled."""
+        def pressed():
+            self.log(BUTTON, button)
+            handler()
+        return pressed
+
+    def after_transition(self, event, source, target):
+        """after_transition - Called by the state machine after every transition."""
+        self.log(TRANSITION, str(event), source.id, target.id)
+
+    def log(self, kind, *fields, time=None):
+        """
+        log - Write one record.
+
+        @param kind is the record kind.
+        @param fields are the record's string fields.
+        @param time is the clock time of the record. Defaults to now.
+        """
+        time = (self.clock() if time is None else time) - self._origin
+        with self._lock:
+            if self._file is not None:
+                self._file.write('\t'.join((f'{time:.6f}', kind) + fields) + '\n')
+                self.records += 1
+
+    def close(self):
+        """close - Write the end record and close the log."""
+        self.log(END)
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+    # End class EventRecorder definition
+
+
+def read_log(path):
+    """
+    read_log - Read a log.
+
+    @param path is the log file.
+    @return a tuple of (header dictionary, list of Records in time order).
+    @raises ValueError if the file isn't a log this version can read.
+    """
+    with _open(path, 'r') as log:
+        magic, _, header = log.readline().partition(' ')
+        if magic != LOG_MAGIC:
+            raise ValueError(f"{path} is not a thermostat log")
+        header = json.loads(header)
+        if header['version'] != LOG_VERSION:
+            raise ValueError(f"{path} is log version {header['version']}, expected {LOG_VERSION}")
+
+        records = []
+        for line in log:
+            time, kind, *fields = line.rstrip('\n').split('\t')
+            records.append(Record(float(time), kind, tuple(fields)))
+
+    # Measurements are logged when they finish but timed from when they started
+    records.sort(key=lambda record: record.time)
+    return header, records
+
+
+class ReplaySensor:
+    """
+    ReplaySensor - Serves the recorded measurements in order. Each takes its recorded duration on the simulated clock.
+    """
+
+    def __init__(self, clock, measurements):
+        """
+        @param clock is the stepped SimClock.
+        @param measurements is a list of (duration, celsius tenths, humidity tenths, fahrenheit tenths) in recorded
+        order.
+        """
+        self.clock = clock
+        self.measurements = measurements
+        self.name = 'replay'
+        self.taken = 0
+        self.extra = 0
+
+    def measure_tenths(self):
+        """
+        measure_tenths - The next recorded measurement, or the last one again if the replay reads more than was
+        recorded.
+        """
+        if self.taken < len(self.measurements):
+            duration, celsius, humidity, fahrenheit = self.measurements[self.taken]
+            self.taken += 1
+        else:
+            duration, celsius, humidity, fahrenheit = self.measurements[-1] if self.measurements else (0.0, 0, 0, 320)
+            self.extra += 1
+        self.clock.advance(duration)
+        return celsius, humidity, fahrenheit
+
+    # End class ReplaySensor definition
+
+
+class ReplayPort:
+    """
+    ReplayPort - Collects what the machine writes and feeds back the recorded input once its time has come.
+    """
+
+    def __init__(self, clock, inputs):
+        """
+        @param clock is the stepped SimClock.
+        @param inputs is a list of (time, bytes) in time order.
+        """
+        self.clock = clock
+        self.inputs = inputs
+        self.writes = []
+        self._next = 0
+        self._buffer = b''
+
+    def _receive(self):
+        """_receive - Move the input whose time has come into the receive buffer."""
+        now = self.clock.now()
+        while self._next < len(self.inputs) and self.inputs[self._next][0] <= now:
+            self._buffer += self.inputs[self._next][1]
+            self._next += 1
+
+    @property
+    def in_waiting(self):
+        """Number of bytes that can be read"""
+        self._receive()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        """read - Read up to size bytes that have arrived."""
+        self._receive()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def write(self, data):
+        """write - Collect the bytes with the time they were written."""
+        self.writes.append((self.clock.now(), bytes(data)))
+        return len(data)
+
+    def flush(self):
+        """flush - Nothing is buffered."""
+
+    def close(self):
+        """close - Nothing to close."""
+
+    # End class ReplayPort definition
+
+
+class ReplayEngine:
+    """
+    ReplayEngine - Replays a log through a TemperatureMachine on the simulated backend and compares the results. The
+    whole replay runs on the calling thread: the engine steps the clock from one recorded input to the next and runs the
+    machine's jobs that come due in between.
+    """
+
+    def __init__(self, path, machine_factory=None):
+        """
+        Load the log.
+
+        @param path is the log file.
+        @param machine_factory is an optional callable machine_factory(header, backend) that builds the machine to
+        replay through. Defaults to a TemperatureMachine with the recorded settings.
+        """
+        self.header, self.records = read_log(path)
+        self.machine_factory = machine_factory
+
+    def build(self, backend):
+        """build - Create the machine with the recorded settings."""
+        if self.machine_factory is not None:
+            return self.machine_factory(self.header, backend)
+
+        from Thermostat import TemperatureMachine
+        return TemperatureMachine(self.header['set_point'], False, self.header['sample_period'],
+                                  self.header['max_staleness'], backend=backend,
+                                  telemetry_format=self.header['telemetry_format'],
+                                  report_period=self.header['report_period'], led_pins=None)
+
+    def replay(self):
+        """
+        replay - Run the log through a new machine.
+
+        @return a ReplayResult.
+        """
+        backend = Hardware.use_backend('sim', measurement_time=0)
+        clock = backend.clock
+        clock.start = datetime.fromisoformat(self.header['start'])
+
+        records = self.records
+        measurements = [(float(record.fields[0]), int(record.fields[1]), int(record.fields[2]), int(record.fields[3]))
+                        for record in records if record.kind == MEASUREMENT]
+        inputs = [(record.time, bytes.fromhex(record.fields[0])) for record in records if record.kind == INPUT]
+
+        machine = self.build(backend)
+        machine.thSensor = ReplaySensor(clock, measurements)
+        machine.ser = ReplayPort(clock, inputs)
+
+        transitions = []
+        machine.add_listener(_TransitionCollector(transitions, clock))
+
+        # The recorded state at the start, reached through the machine's own events
+        if machine.current_state.id != self.header['state']:
+            machine.send(f"to_{self.header['state']}")
+        transitions.clear()
+
+        machine.start()
+        sensor = machine.thSensor
+        measured = 0
+
+        started = perf_counter()
+        for record in records:
+            self._advance(machine, clock, record.time)
+
+            if record.kind == MEASUREMENT:
+                # Skip measurements the machine already took itself, e.g. a stale cache refresh inside a job
+                measured += 1
+                if sensor.taken < measured:
+                    machine.sampler.sample()
+            elif record.kind == BUTTON:
+                getattr(machine, BUTTONS[record.fields[0]])()
+            elif record.kind == JOBS:
+                machine.add_jobs()
+        real_seconds = perf_counter() - started
+
+        recorded_transitions = [record.fields for record in records if record.kind == TRANSITION]
+        recorded_outputs = [bytes.fromhex(record.fields[0]) for record in records if record.kind == OUTPUT]
+        outputs = [data for _, data in machine.ser.writes]
+
+        mismatches = self._compare('transition', recorded_transitions, [fields for _, fields in transitions])
+        mismatches += self._compare('output', recorded_outputs, outputs)
+        if sensor.taken != len(measurements) or sensor.extra:
+            mismatches.append(f"measurements: {len(measurements)} recorded, {sensor.taken + sensor.extra} taken")
+
+        return ReplayResult(not mismatches, mismatches, len(transitions), len(outputs), sensor.taken,
+                            clock.now(), real_seconds)
+
+    @staticmethod
+    def _advance(machine, clock, until):
+        """
+        _advance - Run the jobs that come due before the given time and move the clock to it. Jobs due at exactly that
+        time run after the record there, the order a single thread driving the recording would have logged.
+        """
+        while True:
+            next_release = machine.scheduler.run_pending()
+            if next_release is None or next_release >= until:
+                break
+            clock.advance(max(0.0, next_release - clock.now()))
+        clock.advance(max(0.0, until - clock.now()))
+
+    @staticmethod
+    def _compare(name, recorded, replayed, limit=10):
+        """_compare - Describe the differences between two sequences, up to limit of them."""
+        mismatches = []
+        for index, (expected, actual) in enumerate(zip(recorded, replayed)):
+            if expected != actual:
+                mismatches.append(f"{name} {index}: recorded {expected}, replayed {actual}")
+                if len(mismatches) >= limit:
+                    break
+        if len(recorded) != len(replayed):
+            mismatches.append(f"{name}s: {len(recorded)} recorded, {len(replayed)} replayed")
+        return mismatches
+
+    # End class ReplayEngine definition
+
+
+class _TransitionCollector:
+    """_TransitionCollector - State machine listener that collects the transitions made during a replay."""
+
+    def __init__(self, transitions, clock):
+        self.transitions = transitions
+        self.clock = clock
+
+    def after_transition(self, event, source, target):
+        self.transitions.append((self.clock.now(), (str(event), source.id, target.id)))
+
+    # End class _TransitionCollector definition
+
+
+def record_simulation(path, days=1.0, press_period=3 * 3600):
+    """
+    record_simulation - Record a simulated run, standing in for a field recording. The sensor follows a daily curve,
+    the sampler reads it every sample period and the buttons are pressed regularly.
+
+    @param path is the log file to write.
+    @param days is the number of simulated days to record.
+    @param press_period is the number of seconds between button presses.
+    @return the number of records written.
+    """
+    from threading import Thread
+
+    from SimulateThermostat import drain_serial
+    from Thermostat import TemperatureMachine
+
+    backend = Hardware.use_backend('sim', measurement_time=0.08)
+    machine = TemperatureMachine(70, False, backend=backend, led_pins=None)
+    recorder = EventRecorder(path)
+    recorder.attach(machine)
+    machine.start()
+
+    # Read the reports back from the other end of the pty so the writes never block
+    Thread(target=drain_serial, args=(backend.serial_peers[machine.SERIAL_PORT], []), daemon=True).start()
+
+    # One thread drives the stepped clock, so the sampler and the buttons run as jobs alongside the machine's own
+    presses = iter(['inc', 'state', 'dec', 'inc', 'state', 'inc', 'state', 'dec'] * int(days * 86400 / press_period + 1))
+    machine.add_jobs()
+    machine.scheduler.add_job('sample', machine.samplePeriod, machine.sampler.sample)
+    machine.scheduler.add_job('press', press_period, lambda: getattr(machine, BUTTONS[next(presses)])(),
+                              delay=press_period / 3)
+    machine.scheduler.add_job('end', days * 86400, machine.scheduler.stop, delay=days * 86400)
+    machine.scheduler.run()
+
+    recorder.close()
+    machine.ser.close()
+    backend.close()
+    return recorder.records
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import tempfile
+
+    days = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    log_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.gettempdir(), 'thermostat-recording.log.gz')
+
+    started = perf_counter()
+    count = record_simulation(log_path, days)
+    print(f"Recorded {days:0.1f} simulated days, {count} records, {os.path.getsize(log_path)} bytes "
+          f"in {perf_counter() - started:0.1f}s")
+
+    result = ReplayEngine(log_path).replay()
+    print(f"Replayed {result.simulated_seconds / 86400:0.1f} days in {result.real_seconds:0.1f}s: "
+          f"{result.transitions} transitions, {result.outputs} serial writes, {result.measurements} measurements")
+    print("Replay matches the recording" if result.matched else "Replay differs from the recording:")
+    for mismatch in result.mismatches:
+        print(f"    {mismatch}")
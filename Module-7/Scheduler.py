@@ -0,0 +1,297 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          run_pending() only runs the releases that were due #
+#               when it was called, so an overloaded scheduler     #
+#               still returns to check for stop.                   #
+#                                                                  #
+#    3          Each job run can be traced as a span.              #
+#                                                                  #
+#    4          Job start delays, run times and missed deadlines   #
+#               can be exported as metrics.                        #
+#                                                                  #
+#    5          Timers: jobs without a period that are re-armed by #
+#               their callback for whenever they are next needed.  #
+#------------------------------------------------------------------#
+
+"""
+Scheduler.py - Small monotonic clock scheduler for periodic jobs. Jobs are kept in a heap ordered by their next release
+time. Each release is computed from the previous release rather than from when the job finished, so the time a job
+takes does not push back its own period or any other job's period.
+
+A timer is a job without a period, for work that is due at irregular times such as the set point program's next
+transition. Its callback returns the number of seconds until it is next due, so it sleeps in the heap until then
+instead of polling.
+"""
+
+# heapq keeps the job with the earliest release at the front of the queue
+import heapq
+
+from threading import Event
+
+# A monotonic clock can't jump when the wall clock is adjusted
+from time import monotonic
+
+# Job runs are traced as spans when a tracer is given
+import Tracing
+
+# Trace event of one job run
+JOB = Tracing.define('job', name=Tracing.STRING)
+
+
+class PeriodicJob:
+    """
+    PeriodicJob - A callback that is released once every period. Each release has a deadline, by default the next
+    release, and the job keeps count of how many deadlines it missed and by how much.
+    """
+
+    def __init__(self, name, period, callback, first_release, deadline=None):
+        """
+        Set up the job.
+
+        @param name is used to identify the job in the statistics.
+        @param period is the number of seconds between releases, or None for a timer.
+        @param callback is called with no arguments on every release.
+        @param first_release is the clock time of the first release.
+        @param deadline is the number of seconds after a release by which the callback must have finished. Defaults to
+        the period, and must be given for a timer.
+        """
+        self.name = name
+        self.period = period
+        self.callback = callback
+        self.deadline = period if deadline is None else deadline
+        self.next_release = first_release
+
+        # Statistics
+        self.runs = 0
+        self.missed = 0
+        self.skipped = 0
+        self.total_lateness = 0.0
+        self.max_lateness = 0.0
+        self.max_start_delay = 0.0
+
+        # Optional (start delay histogram, run time histogram, missed deadline counter) from a Metrics.Registry
+        self.metrics = None
+
+    def record(self, release, started, finished):
+        """
+        record - Update the statistics for one release.
+
+        @param release is the clock time the job was due.
+        @param started is the clock time the callback was called.
+        @param finished is the clock time the callback returned.
+        """
+        self.runs += 1
+        self.max_start_delay = max(self.max_start_delay, started - release)
+
+        lateness = finished - (release + self.deadline)
+        if lateness > 0:
+            self.missed += 1
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+
+        if self.metrics is not None:
+            start_delay, run_time, missed = self.metrics
+            start_delay.observe(started - release)
+            run_time.observe(finished - started)
+            if lateness > 0:
+                missed.inc()
+
+    def skip(self, releases):
+        """
+        skip - Count releases that were over before the job could be run again. Each is a missed deadline.
+
+        @param releases is the number of releases skipped.
+        """
+        self.skipped += releases
+        self.missed += releases
+        if self.metrics is not None:
+            self.metrics[2].inc(releases)
+
+    def stats(self):
+        """
+        stats - Summary of this job's timing.
+
+        @return a dictionary of the job statistics.
+        """
+        return {
+            'runs': self.runs,
+            'missed': self.missed,
+            'skipped': self.skipped,
+            'mean_lateness': self.total_lateness / self.missed if self.missed else 0.0,
+            'max_lateness': self.max_lateness,
+            'max_start_delay': self.max_start_delay,
+        }
+
+    # End class PeriodicJob definition
+
+
+class Scheduler:
+    """
+    Scheduler - Runs periodic jobs on the calling thread. Between jobs the thread waits for the next release instead of
+    sleeping a fixed amount, so the periods stay fixed no matter how long each job takes. If a job falls more than a
+    whole period behind, the releases it can no longer make are skipped and counted as missed rather than being run
+    back to back.
+    """
+
+    def __init__(self, clock=monotonic, wait=None, tracer=None, metrics=None, labels=None):
+        """
+        Set up the scheduler.
+
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param wait is a callable wait(event, timeout) that blocks until the event is set or the timeout passes. It is
+        given the stop event so that stop() wakes the scheduler straight away. Defaults to event.wait(timeout). A
+        simulated clock passes its own wait that advances the simulated time.
+        @param tracer is a Tracing.Tracer to trace every job run to, or None.
+        @param metrics is a Metrics.Registry to export each job's start delays, run times and missed deadlines to, or
+        None.
+        @param labels is a dictionary of labels added to the job label of those metrics, e.g. the device.
+        """
+        self.clock = clock
+        self.tracer = tracer
+        self.metrics = metrics
+        self.labels = labels or {}
+        self._stop_event = Event()
+        self.wait = wait if wait is not None else (lambda event, timeout: event.wait(timeout))
+
+        # Heap of (next_release, sequence, job). The sequence keeps jobs due at the same time in registration order.
+        self._queue = []
+        self._sequence = 0
+        self.jobs = {}
+
+    def add_job(self, name, period, callback, delay=0.0, deadline=None):
+        """
+        add_job - Register a periodic job.
+
+        @param name is a unique name for the job.
+        @param period is the number of seconds between releases.
+        @param callback is called with no arguments on every release.
+        @param delay is the number of seconds from now until the first release.
+        @param deadline is the number of seconds after a release by which the callback must have finished. Defaults to
+        the period.
+        @return the PeriodicJob that was registered.
+        """
+        job = PeriodicJob(name, period, callback, self.clock() + delay, deadline)
+        self._register(job)
+        return job
+
+    def add_timer(self, name, callback, delay=0.0, deadline=1.0):
+        """
+        add_timer - Register a timer, a job that is released once and then whenever its callback asks.
+
+        @param name is a unique name for the timer.
+        @param callback is called with no arguments on every release. It returns the number of seconds from when it
+        returns until its next release, or None if it is done.
+        @param delay is the number of seconds from now until the first release.
+        @param deadline is the number of seconds after a release by which the callback must have finished. Defaults to
+        1 second.
+        @return the PeriodicJob that was registered.
+        """
+        job = PeriodicJob(name, None, callback, self.clock() + delay, deadline)
+        self._register(job)
+        return job
+
+    def _register(self, job):
+        """
+        _register - Set up a new job's metrics and put it on the heap.
+        """
+        name = job.name
+        if self.metrics is not None:
+            job.metrics = (
+                self.metrics.histogram('scheduler_job_start_delay_seconds', 'Time from a release to the job starting',
+                                       job=name, **self.labels),
+                self.metrics.histogram('scheduler_job_run_seconds', 'Time the job took to run', job=name,
+                                       **self.labels),
+                self.metrics.counter('scheduler_job_missed_total', 'Deadlines the job missed or releases it skipped',
+                                     job=name, **self.labels),
+            )
+        self.jobs[name] = job
+        self._push(job)
+
+    def _push(self, job):
+        """
+        _push - Put a job back on the heap at its next release.
+        """
+        heapq.heappush(self._queue, (job.next_release, self._sequence, job))
+        self._sequence += 1
+
+    def run_pending(self):
+        """
+        run_pending - Run every job whose release time had passed when it was called. Releases that come due while
+        the jobs run are left for the next call, so the work done per call is bounded even when the jobs take longer
+        than their periods.
+
+        @return the clock time of the next release, or None if there are no jobs.
+        """
+        called = self.clock()
+        while self._queue:
+            release, _, job = self._queue[0]
+            if release > called:
+                return release
+            now = self.clock()
+
+            heapq.heappop(self._queue)
+            if self.tracer is None:
+                result = job.callback()
+            else:
+                name = self.tracer.intern(job.name)
+                self.tracer.begin(JOB, name)
+                try:
+                    result = job.callback()
+                finally:
+                    self.tracer.end(JOB, name)
+            finished = self.clock()
+            job.record(release, now, finished)
+
+            # A timer goes back on the heap for when it asked to be released next, if it did
+            if job.period is None:
+                if result is not None:
+                    job.next_release = finished + result
+                    self._push(job)
+                continue
+
+            # Next release is anchored to the previous one. Releases that are already over are skipped and counted.
+            job.next_release = release + job.period
+            if job.next_release <= finished:
+                behind = int((finished - job.next_release) // job.period) + 1
+                job.skip(behind)
+                job.next_release += behind * job.period
+            self._push(job)
+
+        return None
+
+    def run(self, should_stop=None):
+        """
+        run - Run jobs until stop() is called or should_stop returns True.
+
+        @param should_stop is an optional callable checked before every wait.
+        """
+        self._stop_event.clear()
+        while not self._stop_event.is_set():
+            if should_stop is not None and should_stop():
+                break
+
+            next_release = self.run_pending()
+            if next_release is None:
+                break
+            self.wait(self._stop_event, max(0.0, next_release - self.clock()))
+
+    def stop(self):
+        """
+        stop - Ask run() to return. Safe to call from any thread.
+        """
+        self._stop_event.set()
+
+    def stats(self):
+        """
+        stats - Timing statistics for every job.
+
+        @return a dictionary of job name to the job's statistics dictionary.
+        """
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    # End class Scheduler definition
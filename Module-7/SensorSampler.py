@@ -0,0 +1,217 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Optional on_sample callback so a consumer can act  #
+#               on every new reading as it is taken.               #
+#                                                                  #
+#    3          Reads go through a BusArbiter, one measurement     #
+#               cycle per sample instead of one per value.         #
+#                                                                  #
+#    4          Optional read time histogram and error counter.    #
+#                                                                  #
+#    5          Readings are integer tenths. The Fahrenheit value  #
+#               is looked up instead of computed in floating point.#
+#                                                                  #
+#    6          The cache can be primed with a reading saved      #
+#               before a restart, which start() uses in place of   #
+#               its first read while it is within one period.      #
+#                                                                  #
+#    7          The Fahrenheit value comes with the measurement,   #
+#               converted from the sensor's raw value.             #
+#                                                                  #
+#    8          The sampler thread survives any error from the     #
+#               sensor or the on_sample callback and counts it.    #
+#------------------------------------------------------------------#
+
+"""
+SensorSampler.py - Periodic sampler for the AHTx0 temperature and humidity sensor. A single background thread reads the
+sensor once per period and stores the reading in a timestamped cache. Every consumer of the temperature (the lights,
+the display and the serial report) reads from that cache instead of starting its own I2C transaction.
+"""
+
+from collections import namedtuple
+
+# Threads are required so that the sensor can be read without blocking the display or the button callbacks
+from threading import Thread, Event
+
+# A monotonic clock is used for the cache age so that wall clock changes can't make a reading look fresh or stale
+from time import monotonic
+
+from I2cArbiter import BusArbiter
+
+# Integer tenths conversions and formatting
+from FixedPoint import TENTHS
+
+# Reading - A single cached sample in tenths of a degree Celsius, as that is what the sensor reports, and tenths of a
+# percent humidity. fahrenheit_tenths is converted from the same raw value when the reading is taken. timestamp is
+# taken from the sampler clock at the moment the reading completed.
+Reading = namedtuple('Reading', ['celsius_tenths', 'humidity_tenths', 'fahrenheit_tenths', 'timestamp'])
+
+
+class SensorSampler:
+    """
+    SensorSampler - Reads the temperature and humidity sensor on its own thread once every period and keeps the most
+    recent reading in a cache. Readers are served from the cache as long as it is younger than max_staleness. If the
+    cache has gone stale (e.g. the sampler thread was stalled or never started) the reader performs a read itself so
+    that nobody acts on old data.
+    """
+
+    def __init__(self, sensor, bus=None, period=2.0, max_staleness=10.0, clock=monotonic, wait=None,
+                 on_sample=None, read_time=None, read_errors=None):
+        """
+        Set up the sampler. The sampler thread is not started until start() is called.
+
+        @param sensor is the sensor object, an adafruit_ahtx0.AHTx0 or anything I2cArbiter.read_sensor() can read.
+        @param bus is the BusArbiter the sensor is read through. Pass the arbiter of the I2C bus if it is shared,
+        otherwise a private one is created. It must run on the same clock as the sampler, as its measurement times are
+        the reading timestamps.
+        @param period is the number of seconds between samples.
+        @param max_staleness is the maximum age in seconds of a cached reading before readers refresh it themselves.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        @param wait is a callable wait(event, timeout) used between samples. Defaults to event.wait(timeout).
+        @param on_sample is an optional callable on_sample(reading) called with every new Reading after it is cached,
+        after the bus is released. It runs on whichever thread took the sample.
+        @param read_time is an optional Metrics.Histogram observing the seconds each sample took, including the wait
+        for the bus.
+        @param read_errors is an optional Metrics.Counter of the samples that failed, in the read or in on_sample.
+        """
+        self.sensor = sensor
+        self.period = period
+        self.max_staleness = max_staleness
+        self.clock = clock
+        self.bus = bus if bus is not None else BusArbiter(clock)
+        self.wait = wait if wait is not None else (lambda event, timeout: event.wait(timeout))
+        self.on_sample = on_sample
+        self.read_time = read_time
+        self.read_errors = read_errors
+
+        # Most recent reading. Replacing a tuple is atomic so readers don't need a lock to fetch it.
+        self._reading = None
+
+        # Number of samples taken, useful for confirming the reduction in bus traffic. The arbiter's stats() count the
+        # measurements that actually reached the bus.
+        self.bus_reads = 0
+
+        # Number of samples the sampler thread took that raised, in the read or in on_sample
+        self.sample_errors = 0
+
+        self._stop_event = Event()
+        self._thread = None
+
+    def start(self):
+        """
+        start - Take the first reading and kick off the sampler thread. A primed reading younger than the period takes
+        the place of the first reading.
+        """
+        if self._thread is not None:
+            return
+
+        self._stop_event.clear()
+        reading = self._reading
+        if reading is None or self.clock() - reading.timestamp >= self.period:
+            self.sample()
+        self._thread = Thread(target=self._run, name='SensorSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop - Signal the sampler thread to finish and wait for it.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        """
+        sample - Read the sensor now and update the cache. A measurement another thread is taking, or took within the
+        arbiter's freshness window, is shared instead of reading the sensor again.
+
+        @return the new Reading.
+        """
+        if self.read_time is None and self.read_errors is None:
+            measurement = self.bus.measure(self.sensor)
+        else:
+            started = self.clock()
+            try:
+                measurement = self.bus.measure(self.sensor)
+            except Exception:
+                if self.read_errors is not None:
+                    self.read_errors.inc()
+                raise
+            if self.read_time is not None:
+                self.read_time.observe(self.clock() - started)
+        self.bus_reads += 1
+
+        reading = self._reading = Reading(*measurement)
+        if self.on_sample is not None:
+            try:
+                self.on_sample(reading)
+            except Exception:
+                if self.read_errors is not None:
+                    self.read_errors.inc()
+                raise
+        return reading
+
+    def prime(self, reading):
+        """
+        prime - Put a reading taken earlier in the cache, e.g. the last one saved before a restart. It is served like
+        any other reading until it is older than max_staleness. on_sample is not called.
+
+        @param reading is the Reading, timestamped on the sampler clock.
+        """
+        self._reading = reading
+
+    def latest(self):
+        """
+        latest - Get the cached reading, refreshing it first if it is missing or older than max_staleness.
+
+        @return the most recent Reading.
+        """
+        reading = self._reading
+        if reading is None or (self.clock() - reading.timestamp) > self.max_staleness:
+            reading = self.sample()
+        return reading
+
+    def get_fahrenheit_tenths(self):
+        """
+        Get the cached temperature in tenths of a degree Fahrenheit
+        """
+        return self.latest().fahrenheit_tenths
+
+    def get_celsius(self):
+        """
+        Get the cached temperature in Celsius
+        """
+        return self.latest().celsius_tenths / TENTHS
+
+    def get_fahrenheit(self):
+        """
+        Get the cached temperature in Fahrenheit
+        """
+        return self.latest().fahrenheit_tenths / TENTHS
+
+    def get_rh(self):
+        """
+        Get the cached Relative Humidity
+        """
+        return self.latest().humidity_tenths / TENTHS
+
+    def _run(self):
+        """
+        _run - Sampler thread body. Reads the sensor once per period until stop() is called.
+        """
+        while not self.wait(self._stop_event, self.period):
+            try:
+                self.sample()
+            except Exception:
+                # A failed bus transaction leaves the previous reading in place. Once it passes max_staleness the
+                # readers will retry the sensor themselves. Any other error, from the driver or from on_sample, is
+                # counted the same way so the thread keeps sampling.
+                self.sample_errors += 1
+
+    # End class SensorSampler definition
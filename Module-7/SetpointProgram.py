@@ -0,0 +1,256 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+SetpointProgram.py - Programmable set point schedules for the thermostat, e.g. a comfortable temperature while someone
+is home and a setback while they are out or asleep, on a different timetable at the weekend. A program is written as
+blocks, each giving the days it applies to, the time of day it starts and the set point and mode from then on. A block
+lasts until the next one starts, which may be on a later day.
+
+The blocks are compiled into a transition table sorted by the number of seconds into the week (from Monday 00:00), so
+the transition in force at any moment and the next one are each found with one binary search, however many blocks
+there are. TemperatureMachine uses the next one to sleep on a Scheduler timer until it is due.
+
+Programs can be read from a text file, one block per line:
+
+    # days        start  set point  mode (optional, the mode is left alone without it)
+    weekdays      06:30  70         heat
+    weekdays      08:00  62
+    weekdays      17:30  70
+    daily         22:00  62
+    sat,sun       08:00  70
+
+The days are day names (mon to sun), weekdays, weekend or daily, or a comma separated list of them. When two blocks
+start at the same time on the same day, the one written last is used.
+
+Usage: python SetpointProgram.py [blocks]   - benchmark compiling and searching a program with that many blocks
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+# Day names in the order of datetime.weekday()
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# Names for groups of days
+DAY_GROUPS = {'weekdays': (0, 1, 2, 3, 4), 'weekend': (5, 6), 'daily': (0, 1, 2, 3, 4, 5, 6)}
+
+# Modes a block can put the thermostat in, the ids of TemperatureMachine's states
+MODES = ('off', 'heat', 'cool')
+
+DAY = 86400
+WEEK = 7 * DAY
+
+# ProgramBlock - One block as written. days is a day or group name, a comma separated list of them or a tuple of day
+# numbers, start the time of day as 'HH:MM', set_point whole degrees Fahrenheit and mode one of MODES or None to leave
+# the mode alone.
+ProgramBlock = namedtuple('ProgramBlock', ['days', 'start', 'set_point', 'mode'])
+
+# Transition - One change in the compiled table. time is the number of seconds into the week it happens.
+Transition = namedtuple('Transition', ['time', 'set_point', 'mode'])
+
+
+def parse_days(days):
+    """
+    parse_days - The day numbers, Monday being 0, a block's days stand for.
+
+    @param days is a day or group name, a comma separated list of them, or an iterable of day numbers.
+    @return a sorted tuple of day numbers.
+    @raises ValueError for an unknown name or a number out of range.
+    """
+    if isinstance(days, str):
+        numbers = set()
+        for name in days.lower().split(','):
+            name = name.strip()
+            if name in DAY_GROUPS:
+                numbers.update(DAY_GROUPS[name])
+            elif name in DAYS:
+                numbers.add(DAYS.index(name))
+            else:
+                raise ValueError(f"Unknown day '{name}', expected one of {', '.join(DAYS + tuple(DAY_GROUPS))}")
+        return tuple(sorted(numbers))
+
+    numbers = tuple(sorted(set(days)))
+    if any(not 0 <= number < 7 for number in numbers):
+        raise ValueError(f"Day numbers must be 0 (Monday) to 6 (Sunday), not {numbers}")
+    return numbers
+
+
+def parse_time(start):
+    """
+    parse_time - Seconds into the day of a time of day.
+
+    @param start is the time as 'HH:MM' or 'HH:MM:SS'.
+    @return the number of seconds after midnight.
+    @raises ValueError if it isn't a time of day.
+    """
+    fields = [int(field) for field in start.split(':')]
+    if len(fields) not in (2, 3):
+        raise ValueError(f"Time '{start}' is not HH:MM")
+    hours, minutes, seconds = (fields + [0])[:3]
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError(f"Time '{start}' is not a time of day")
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def week_seconds(when):
+    """
+    week_seconds - Seconds into the week of a date and time.
+
+    @param when is a datetime, e.g. from the clock's wall_time().
+    @return the number of seconds since Monday 00:00, with the fraction.
+    """
+    return (when.weekday() * DAY + when.hour * 3600 + when.minute * 60 + when.second) + when.microsecond / 1e6
+
+
+def parse_program(lines):
+    """
+    parse_program - Read program blocks from text in the format described above.
+
+    @param lines is an iterable of lines, e.g. an open file.
+    @return a list of ProgramBlocks.
+    @raises ValueError naming the line number of a line that can't be read.
+    """
+    blocks = []
+    for number, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        try:
+            if len(fields) not in (3, 4):
+                raise ValueError("expected days, start, set point and an optional mode")
+            blocks.append(ProgramBlock(fields[0], fields[1], int(fields[2]), fields[3] if len(fields) == 4 else None))
+        except ValueError as error:
+            raise ValueError(f"Line {number}: {error}") from None
+    return blocks
+
+
+def setback_blocks(comfort=70, setback=62, mode='heat', wake='06:30', leave='08:00', arrive='17:30', sleep='22:00',
+                   weekend_wake='08:00'):
+    """
+    setback_blocks - The usual setback program: comfortable while someone is home and awake, set back while everyone is
+    out on weekdays and at night.
+
+    @param comfort is the set point while someone is home and awake.
+    @param setback is the set point otherwise. For cooling it would be above comfort.
+    @param mode is the mode the program keeps the thermostat in.
+    @param wake, leave, arrive and sleep are the weekday times, weekend_wake the time the weekend starts at comfort.
+    @return a list of ProgramBlocks.
+    """
+    return [
+        ProgramBlock('weekdays', wake, comfort, mode),
+        ProgramBlock('weekdays', leave, setback, mode),
+        ProgramBlock('weekdays', arrive, comfort, mode),
+        ProgramBlock('weekend', weekend_wake, comfort, mode),
+        ProgramBlock('daily', sleep, setback, mode),
+    ]
+
+
+class SetpointProgram:
+    """
+    SetpointProgram - A compiled program: the transitions of one week sorted by time. The last transition of the week
+    stays in force until the first one of the next week.
+    """
+
+    def __init__(self, blocks):
+        """
+        Compile the blocks into the transition table.
+
+        @param blocks is an iterable of ProgramBlocks.
+        @raises ValueError if there are no blocks or one can't be read.
+        """
+        transitions = {}
+        for block in blocks:
+            if block.mode is not None and block.mode not in MODES:
+                raise ValueError(f"Unknown mode '{block.mode}', expected one of {', '.join(MODES)}")
+            start = parse_time(block.start)
+            for day in parse_days(block.days):
+                time = day * DAY + start
+                transitions[time] = Transition(time, int(block.set_point), block.mode)
+        if not transitions:
+            raise ValueError("A program needs at least one block")
+
+        self.transitions = [transitions[time] for time in sorted(transitions)]
+
+        # Searched with bisect, so the times are kept in a list of their own
+        self.times = [transition.time for transition in self.transitions]
+
+    @classmethod
+    def load(cls, path):
+        """
+        load - Compile the program written in a file.
+
+        @param path is the program file.
+        @return the SetpointProgram.
+        """
+        with open(path, encoding='utf-8') as program_file:
+            return cls(parse_program(program_file))
+
+    def index_at(self, when):
+        """
+        index_at - Position in the table of the transition in force at a time. Before the week's first transition that
+        is the last one of the week before.
+
+        @param when is a datetime.
+        @return the index into self.transitions.
+        """
+        return (bisect_right(self.times, week_seconds(when)) - 1) % len(self.times)
+
+    def current(self, when):
+        """
+        current - The transition in force at a time.
+
+        @param when is a datetime.
+        @return the Transition.
+        """
+        return self.transitions[self.index_at(when)]
+
+    def next_change(self, when):
+        """
+        next_change - The first transition after a time, wrapping around to next week after the last.
+
+        @param when is a datetime.
+        @return a tuple of (seconds from when until the transition, Transition).
+        """
+        seconds = week_seconds(when)
+        index = bisect_right(self.times, seconds)
+        if index == len(self.times):
+            return self.times[0] + WEEK - seconds, self.transitions[0]
+        return self.times[index] - seconds, self.transitions[index]
+
+    # End class SetpointProgram definition
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+
+    from datetime import datetime, timedelta
+    from time import perf_counter
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    searches = 100000
+
+    generator = random.Random(1)
+    blocks = [ProgramBlock(DAYS[generator.randrange(7)], f'{generator.randrange(24):02d}:{generator.randrange(60):02d}',
+                           generator.randint(60, 78), generator.choice(MODES + (None,))) for _ in range(count)]
+
+    started = perf_counter()
+    program = SetpointProgram(blocks)
+    compiled = perf_counter() - started
+
+    monday = datetime(2024, 1, 1)
+    times = [monday + timedelta(seconds=generator.uniform(0, WEEK)) for _ in range(searches)]
+    started = perf_counter()
+    for moment in times:
+        program.current(moment)
+        program.next_change(moment)
+    searched = perf_counter() - started
+
+    print(f"{count} blocks compiled into {len(program.transitions)} transitions in {compiled * 1000:0.1f}ms")
+    print(f"Current and next transition: {searched / searches * 1e6:0.2f}us per lookup")
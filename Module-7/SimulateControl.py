@@ -0,0 +1,107 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+SimulateControl.py - Compares the heat / cool control policies over a day long synthetic temperature trace. A simple
+room model loses heat to an outdoor temperature that follows a daily curve and gains heat while the heating runs. The
+sensor adds seeded random noise, so every policy sees exactly the same conditions. For each policy the number of
+switching events, the time the heating ran and the error from the set point are reported.
+
+Usage: python SimulateControl.py [hours] [set point] [noise]
+"""
+
+import random
+import sys
+
+from math import sqrt
+
+from Controller import ControlEngine, ThresholdPolicy, HysteresisPolicy, DutyCyclePolicy
+from Hardware import daily_curve
+
+# Seconds between sensor samples, the same as the thermostat's default sample period
+STEP = 2.0
+
+# Room model: time constant of the heat loss to outdoors in seconds, and the heating rate in degrees per second
+TIME_CONSTANT = 4 * 3600.0
+HEATING_RATE = 10.0 / 3600
+
+
+def policies():
+    """
+    policies - The policies to compare.
+
+    @return a list of (name, ControlEngine factory) tuples.
+    """
+    return [
+        ('threshold', lambda: ControlEngine(ThresholdPolicy())),
+        ('hysteresis 1F', lambda: ControlEngine(HysteresisPolicy(1.0))),
+        ('hysteresis 1F + 60s min', lambda: ControlEngine(HysteresisPolicy(1.0), 60, 60)),
+        ('duty cycle PID', lambda: ControlEngine(DutyCyclePolicy())),
+    ]
+
+
+def simulate(engine, hours=24.0, set_point=70.0, noise=0.3, seed=1):
+    """
+    simulate - Run one engine in heating mode against the room model.
+
+    @param engine is the ControlEngine to drive.
+    @param hours is the length of the trace.
+    @param set_point is the set point in Fahrenheit.
+    @param noise is the standard deviation of the sensor noise in degrees.
+    @param seed seeds the noise so every policy gets the same trace.
+    @return a dictionary of results.
+    """
+    noise_source = random.Random(seed)
+
+    # A cold day: 40F average outdoors, 10F either side
+    outdoor = daily_curve(mean=40.0, swing=10.0)
+
+    room = set_point - 2.0
+    running_time = 0.0
+    total_error = 0.0
+    total_square = 0.0
+    worst = 0.0
+
+    steps = int(hours * 3600 / STEP)
+    for step in range(steps):
+        now = step * STEP
+        running = engine.update('heat', room + noise_source.gauss(0.0, noise), set_point, now)
+
+        room += (outdoor(now) - room) / TIME_CONSTANT * STEP
+        if running:
+            room += HEATING_RATE * STEP
+            running_time += STEP
+
+        error = room - set_point
+        total_error += abs(error)
+        total_square += error * error
+        worst = max(worst, abs(error))
+
+    return {
+        'switches': engine.switches,
+        'held': engine.held,
+        'switches_per_hour': engine.switches / hours,
+        'running_fraction': running_time / (steps * STEP),
+        'mean_abs_error': total_error / steps,
+        'rms_error': sqrt(total_square / steps),
+        'max_error': worst,
+    }
+
+
+if __name__ == '__main__':
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24.0
+    set_point = float(sys.argv[2]) if len(sys.argv) > 2 else 70.0
+    noise = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+
+    print(f"{hours:0.0f} hours heating to {set_point:0.1f}F with {noise:0.2f}F sensor noise")
+    print(f"{'policy':<26} {'switches':>9} {'per hour':>9} {'running':>8} {'mean err':>9} {'rms err':>8} {'max err':>8}")
+    for name, factory in policies():
+        results = simulate(factory(), hours, set_point, noise)
+        print(f"{name:<26} {results['switches']:>9} {results['switches_per_hour']:>9.1f} "
+              f"{results['running_fraction'] * 100:>7.1f}% {results['mean_abs_error']:>9.2f} "
+              f"{results['rms_error']:>8.2f} {results['max_error']:>8.2f}")
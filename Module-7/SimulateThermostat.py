@@ -0,0 +1,120 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Reports the control engine's switching events.     #
+#                                                                  #
+#    3          Acquires the machine's hardware with start().      #
+#                                                                  #
+#    4          Optionally traces the run with --trace.            #
+#------------------------------------------------------------------#
+
+"""
+SimulateThermostat.py - Runs the TemperatureMachine on the simulated hardware backend with a stepped clock, so hours of
+thermostat behavior complete in seconds on any Linux machine. The display thread jobs run on the calling thread, the
+fake sensor follows a daily temperature curve and the serial reports are read back from the pty pair.
+
+Usage: python SimulateThermostat.py [hours] [--trace FILE]   - the trace is decoded with DecodeTrace.py
+"""
+
+import sys
+
+from threading import Thread
+from time import perf_counter
+
+import Hardware
+import Thermostat as Thermo
+import Tracing
+
+
+def drain_serial(peer, lines):
+    """
+    drain_serial - Read the thermostat's serial reports from the other end of the pty until it is closed.
+
+    @param peer is the binary file for the server end of the pty.
+    @param lines is a list the decoded report lines are appended to.
+    """
+    pending = b''
+    while True:
+        try:
+            chunk = peer.read(4096)
+        except OSError:
+            return
+        if not chunk:
+            return
+        pending += chunk
+        *complete, pending = pending.split(b'\n')
+        lines.extend(line.decode('utf-8') for line in complete)
+
+
+def simulate(hours=24.0, tracer=None):
+    """
+    simulate - Run the thermostat for the given number of simulated hours.
+
+    @param hours is the amount of simulated time to run.
+    @param tracer is a Tracing.Tracer to trace the machine to, or None.
+    @return a dictionary of results.
+    """
+    backend = Hardware.use_backend('sim')
+    tsm = Thermo.TemperatureMachine(68, False, backend=backend, tracer=tracer)
+    tsm.start()
+
+    lines = []
+    reader = Thread(target=drain_serial, args=(backend.serial_peers[tsm.SERIAL_PORT], lines), daemon=True)
+    reader.start()
+
+    # Switch to heating for the first half of the run and cooling for the second. manage_my_display() runs until
+    # endDisplay is set, so a final job sets it once the simulated time is up.
+    half = hours * 1800
+    tsm.send('cycle')
+    tsm.scheduler.add_job('cool', 2 * half, lambda: tsm.send('cycle'), delay=half)
+    tsm.scheduler.add_job('end', 2 * half, lambda: setattr(tsm, 'endDisplay', True), delay=2 * half)
+
+    started = perf_counter()
+    tsm.manage_my_display()
+    elapsed = perf_counter() - started
+
+    tsm.ser.flush()
+    results = {
+        'simulated_hours': hours,
+        'real_seconds': elapsed,
+        'speedup': hours * 3600 / elapsed,
+        'final_state': tsm.current_state.id,
+        'sensor_measurements': sum(sensor.measurements for sensor in backend.sensors),
+        'lcd_nibble_writes': sum(lcd.nibble_writes for lcd in backend.displays),
+        'serial_reports': len(lines),
+        'control_switches': tsm.controller.switches,
+        'jobs': tsm.scheduler.stats(),
+    }
+    tsm.ser.close()
+    backend.close()
+    return results
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    trace_path = None
+    if '--trace' in arguments:
+        index = arguments.index('--trace')
+        trace_path = arguments[index + 1]
+        del arguments[index:index + 2]
+
+    run_tracer = Tracing.Tracer() if trace_path is not None else None
+    results = simulate(float(arguments[0]) if arguments else 24.0, run_tracer)
+
+    print(f"Simulated {results['simulated_hours']:0.1f} hours in {results['real_seconds']:0.2f} seconds "
+          f"({results['speedup']:0.0f}x real time)")
+    print(f"Final state: {results['final_state']}")
+    print(f"Sensor measurements: {results['sensor_measurements']}")
+    print(f"LCD nibble writes: {results['lcd_nibble_writes']}")
+    print(f"Serial reports: {results['serial_reports']}")
+    print(f"Control switching events: {results['control_switches']}")
+    for name, stats in results['jobs'].items():
+        print(f"Job {name}: {stats['runs']} runs, {stats['missed']} missed deadlines, "
+              f"max lateness {stats['max_lateness']:0.3f}s")
+
+    if run_tracer is not None:
+        print(f"Wrote {run_tracer.dump(trace_path)} trace events to {trace_path}")
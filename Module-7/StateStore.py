@@ -0,0 +1,222 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Readings keep their Fahrenheit tenths.             #
+#------------------------------------------------------------------#
+
+"""
+StateStore.py - Keeps the thermostat's settings and recent readings on disk, so a restarted or crashed thermostat comes
+back in the state it left: the same set point and mode, the control engine's output and the time of its last switch,
+and the last few readings, for every machine or zone sharing the store.
+
+The state is double buffered across two files, PATH.a and PATH.b. Each save overwrites the older of the two in place
+with a header and the state as JSON, then syncs it with a single fdatasync. The header holds a sequence number and a
+CRC32 of the state, and loading takes the valid file with the higher sequence, so a save torn by a crash or a power
+cut only ever damages the copy that was being replaced. Overwriting in place keeps the file sizes steady, so there is
+no rename or directory sync and the sync seldom has metadata to write.
+
+To spare the SD card, nothing is written unless something changed. A change of set point, mode or control output is
+saved by the next save_if_due(), which a periodic job calls every few seconds, so holding a set point button down
+makes one write and not one per step. New readings on their own are saved at most once every readings_period.
+
+Usage: python StateStore.py PATH   - print the state saved at PATH
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from collections import namedtuple
+from threading import Lock
+from time import monotonic
+
+# Header of each file: magic, sequence number, length of the JSON state that follows and its CRC32
+MAGIC = b'THSTATE1'
+HEADER = struct.Struct('<8sQII')
+
+# The two files the state alternates between
+SUFFIXES = ('.a', '.b')
+
+# fdatasync() skips the file's metadata, e.g. its modification time. Not every platform has it.
+_sync = getattr(os, 'fdatasync', os.fsync)
+
+# MachineState - What a machine saves. state is the state machine's state id, output whether the control engine was
+# running the heating or cooling, changed the Unix time of its last output change or None if it never changed, and
+# readings a list of SavedReadings, oldest first. saved is the Unix time the state was taken.
+MachineState = namedtuple('MachineState', ['set_point', 'state', 'output', 'changed', 'readings', 'saved'])
+
+# SavedReading - A sensor reading as saved, timestamped with the Unix time so it can be aged across a restart.
+# fahrenheit_tenths is None in a reading saved before it was kept.
+SavedReading = namedtuple('SavedReading', ['timestamp', 'celsius_tenths', 'humidity_tenths', 'fahrenheit_tenths'],
+                          defaults=(None,))
+
+
+def _decode(data):
+    """
+    _decode - Check and decode the contents of one of the files.
+
+    @param data is the bytes read from the file.
+    @return a tuple of (sequence, state dictionary), or None if the file is empty, torn or from something else.
+    """
+    if len(data) < HEADER.size:
+        return None
+    magic, sequence, length, crc = HEADER.unpack_from(data)
+    payload = data[HEADER.size:HEADER.size + length]
+    if magic != MAGIC or len(payload) != length or zlib.crc32(payload) != crc:
+        return None
+    return sequence, json.loads(payload.decode('utf-8'))
+
+
+def _machine_state(saved):
+    """_machine_state - A MachineState from its saved dictionary."""
+    return MachineState(saved['set_point'], saved['state'], saved['output'], saved['changed'],
+                        [SavedReading(*reading) for reading in saved['readings']], saved['saved'])
+
+
+def load(path):
+    """
+    load - Read the newest valid state saved at a path.
+
+    @param path is the path the two files are named from.
+    @return a tuple of (sequence number, dictionary of saved state dictionaries by device). The sequence is 0 and the
+    dictionary empty if nothing valid was saved.
+    """
+    sequence, machines = 0, {}
+    for suffix in SUFFIXES:
+        try:
+            with open(path + suffix, 'rb') as state_file:
+                decoded = _decode(state_file.read())
+        except FileNotFoundError:
+            continue
+        if decoded is not None and decoded[0] > sequence:
+            sequence, machines = decoded[0], decoded[1]['machines']
+    return sequence, machines
+
+
+class StateStore:
+    """
+    StateStore - Saved state of one or more machines, by device name. A machine restores its state when it is created
+    and attaches a snapshot callable that is asked for its current state at every save.
+    """
+
+    def __init__(self, path, readings=32, readings_period=600.0, clock=monotonic):
+        """
+        Open the two files, creating them if needed, and load the newest valid state.
+
+        @param path is the path the two files are named from.
+        @param readings is the number of recent readings each machine keeps.
+        @param readings_period is the minimum number of seconds between saves made only for new readings.
+        @param clock is a callable returning the current time in seconds. Defaults to time.monotonic.
+        """
+        self.path = path
+        self.readings = readings
+        self.readings_period = readings_period
+        self.clock = clock
+
+        # The next save goes to the file the newest valid state isn't in
+        self.sequence, self._machines = load(path)
+        self._files = [os.open(path + suffix, os.O_RDWR | os.O_CREAT, 0o644) for suffix in SUFFIXES]
+        self._snapshots = {}
+        self._lock = Lock()
+
+        # A restore reads the saved state once, so a machine created again later starts afresh
+        self._restored = {device: _machine_state(saved) for device, saved in self._machines.items()}
+
+        # Whether settings changed since the last save, and when that save was
+        self._changed = False
+        self._saved_at = clock()
+
+        # Statistics
+        self.saves = 0
+        self.bytes_written = 0
+
+    def restore(self, device):
+        """
+        restore - The state a device saved before the restart.
+
+        @param device is the device name, e.g. the machine's sensor name or zone name.
+        @return its MachineState, or None if it has none.
+        """
+        return self._restored.pop(device, None)
+
+    def attach(self, device, snapshot):
+        """
+        attach - Save a device's state from now on.
+
+        @param device is the device name.
+        @param snapshot is a callable returning the device's current MachineState.
+        """
+        with self._lock:
+            self._snapshots[device] = snapshot
+
+    def changed(self):
+        """changed - Note a change of settings, saved by the next save_if_due()."""
+        self._changed = True
+
+    def save_if_due(self):
+        """
+        save_if_due - Save if settings changed since the last save or readings_period has passed since it. Called by a
+        periodic job.
+
+        @return True if the state was saved.
+        """
+        if self._changed or (self._snapshots and self.clock() - self._saved_at >= self.readings_period):
+            self.save()
+            return True
+        return False
+
+    def save(self):
+        """
+        save - Save the state of every attached device now, over the older of the two files. Devices that were saved
+        before but not attached this time are kept as they were.
+
+        @return the sequence number of the save.
+        """
+        with self._lock:
+            self._changed = False
+            for device, snapshot in self._snapshots.items():
+                self._machines[device] = snapshot()._asdict()
+
+            payload = json.dumps({'machines': self._machines}, separators=(',', ':')).encode('utf-8')
+            sequence = self.sequence + 1
+            data = HEADER.pack(MAGIC, sequence, len(payload), zlib.crc32(payload)) + payload
+
+            # The file is left at its old length if the state shrank. Anything after the state is ignored on loading.
+            descriptor = self._files[sequence % len(self._files)]
+            os.pwrite(descriptor, data, 0)
+            _sync(descriptor)
+
+            self.sequence = sequence
+            self._saved_at = self.clock()
+            self.saves += 1
+            self.bytes_written += len(data)
+        return sequence
+
+    def close(self):
+        """close - Save the attached devices' latest state and close the files."""
+        if self._snapshots:
+            self.save()
+        for descriptor in self._files:
+            os.close(descriptor)
+        self._files = []
+
+    # End class StateStore definition
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.strip().splitlines()[-1])
+
+    saved_sequence, saved_machines = load(sys.argv[1])
+    print(f"Save {saved_sequence} of {sys.argv[1]}")
+    for name, saved in sorted(saved_machines.items()):
+        machine = _machine_state(saved)
+        print(f"{name}: {machine.state}, set point {machine.set_point}F, {'running' if machine.output else 'idle'}, "
+              f"{len(machine.readings)} readings")
@@ -0,0 +1,189 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Frames can be encoded straight from integer tenths.#
+#------------------------------------------------------------------#
+
+"""
+TelemetryProtocol.py - Compact binary frame format for the thermostat's serial reports, and a streaming decoder for the
+Thermostat Server. Each frame is 13 bytes:
+
+    offset  size  field
+    0       1     sync byte 0xA5
+    1       1     payload length (9)
+    2       2     sequence number, wraps at 65536
+    4       1     state (0 off, 1 heat, 2 cool)
+    5       2     temperature in tenths of a degree Fahrenheit, signed
+    7       2     relative humidity in tenths of a percent
+    9       2     set point in tenths of a degree Fahrenheit, signed
+    11      2     CRC16-CCITT of bytes 1-10
+
+All multi-byte fields are little endian. At 115200 baud that is roughly 880 frames per second.
+"""
+
+# crc_hqx is the CRC16-CCITT (polynomial 0x1021) implemented in C
+from binascii import crc_hqx
+from collections import namedtuple
+import struct
+
+SYNC = 0xA5
+
+# Thermostat states in the order of their wire codes
+STATES = ('off', 'heat', 'cool')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# Payload without the sync, length and CRC bytes
+PAYLOAD = struct.Struct('<HBhHh')
+PAYLOAD_LENGTH = PAYLOAD.size
+
+# Header is the sync byte and the payload length
+HEADER_LENGTH = 2
+CRC = struct.Struct('<H')
+FRAME_LENGTH = HEADER_LENGTH + PAYLOAD_LENGTH + CRC.size
+
+CRC_INITIAL = 0xFFFF
+
+# Frame - A decoded report. Temperatures are in Fahrenheit and humidity in percent.
+Frame = namedtuple('Frame', ['sequence', 'state', 'fahrenheit', 'humidity', 'set_point'])
+
+
+def encode_frame(sequence, state, fahrenheit, humidity, set_point):
+    """
+    encode_frame - Build one binary report frame.
+
+    @param sequence is the frame sequence number. Only the low 16 bits are sent.
+    @param state is the state id, 'off', 'heat' or 'cool'.
+    @param fahrenheit is the current temperature in Fahrenheit.
+    @param humidity is the relative humidity in percent.
+    @param set_point is the set point in Fahrenheit.
+    @return the frame as bytes.
+    """
+    return encode_frame_tenths(sequence, state, round(fahrenheit * 10), round(humidity * 10), round(set_point * 10))
+
+
+def encode_frame_tenths(sequence, state, fahrenheit, humidity, set_point):
+    """
+    encode_frame_tenths - Build one binary report frame from values already in tenths, as they are sent.
+
+    @param sequence is the frame sequence number. Only the low 16 bits are sent.
+    @param state is the state id, 'off', 'heat' or 'cool'.
+    @param fahrenheit is the current temperature in tenths of a degree Fahrenheit.
+    @param humidity is the relative humidity in tenths of a percent.
+    @param set_point is the set point in tenths of a degree Fahrenheit.
+    @return the frame as bytes.
+    """
+    body = bytes((PAYLOAD_LENGTH,)) + PAYLOAD.pack(sequence & 0xFFFF, STATE_CODES[state], fahrenheit, humidity,
+                                                    set_point)
+    return bytes((SYNC,)) + body + CRC.pack(crc_hqx(body, CRC_INITIAL))
+
+
+class FrameEncoder:
+    """
+    FrameEncoder - Encodes reports with an increasing sequence number so the receiver can detect lost frames.
+    """
+
+    def __init__(self):
+        """Start the sequence at zero."""
+        self.sequence = 0
+
+    def encode(self, state, fahrenheit, humidity, set_point):
+        """
+        encode - Build the next frame in the sequence.
+
+        @return the frame as bytes.
+        """
+        frame = encode_frame(self.sequence, state, fahrenheit, humidity, set_point)
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return frame
+
+    def encode_tenths(self, state, fahrenheit, humidity, set_point):
+        """
+        encode_tenths - Build the next frame in the sequence from values in tenths. See encode_frame_tenths().
+
+        @return the frame as bytes.
+        """
+        frame = encode_frame_tenths(self.sequence, state, fahrenheit, humidity, set_point)
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return frame
+
+    # End class FrameEncoder definition
+
+
+class StreamDecoder:
+    """
+    StreamDecoder - Incremental decoder for a stream of binary frames. Chunks can be fed in with any boundaries, a
+    frame split across reads is completed on a later feed. Frames are parsed in place from the receive buffer with
+    struct.unpack_from, and consumed bytes are dropped from the buffer once per feed. Bytes that don't form a valid
+    frame (line noise, a corrupted or truncated frame) are skipped until the next sync byte, and counted.
+    """
+
+    def __init__(self):
+        """Set up an empty receive buffer and zero the statistics."""
+        self._buffer = bytearray()
+        self._last_sequence = None
+
+        # Statistics
+        self.frames = 0
+        self.crc_errors = 0
+        self.bytes_discarded = 0
+        self.frames_lost = 0
+
+    def feed(self, chunk):
+        """
+        feed - Add received bytes and decode every complete frame.
+
+        @param chunk is the bytes received.
+        @return a list of decoded Frames, possibly empty.
+        """
+        buffer = self._buffer
+        buffer += chunk
+
+        frames = []
+        position = 0
+        end = len(buffer)
+
+        # The view lets the CRC be computed over a slice of the buffer without copying it. It has to be released before
+        # the buffer is resized.
+        with memoryview(buffer) as view:
+            while end - position >= FRAME_LENGTH:
+                if buffer[position] != SYNC:
+                    # Resynchronise on the next sync byte
+                    next_sync = buffer.find(SYNC, position + 1)
+                    if next_sync < 0:
+                        next_sync = end
+                    self.bytes_discarded += next_sync - position
+                    position = next_sync
+                    continue
+
+                crc_end = position + FRAME_LENGTH - CRC.size
+                if (buffer[position + 1] != PAYLOAD_LENGTH or
+                        crc_hqx(view[position + 1:crc_end], CRC_INITIAL) != CRC.unpack_from(buffer, crc_end)[0]):
+                    # Not a frame, or a corrupted one. Skip this sync byte and look for the next.
+                    self.crc_errors += 1
+                    self.bytes_discarded += 1
+                    position += 1
+                    continue
+
+                sequence, code, temperature, humidity, set_point = PAYLOAD.unpack_from(buffer, position + HEADER_LENGTH)
+                position += FRAME_LENGTH
+
+                if code >= len(STATES):
+                    self.crc_errors += 1
+                    continue
+
+                if self._last_sequence is not None:
+                    self.frames_lost += (sequence - self._last_sequence - 1) & 0xFFFF
+                self._last_sequence = sequence
+
+                self.frames += 1
+                frames.append(Frame(sequence, STATES[code], temperature / 10, humidity / 10, set_point / 10))
+
+        if position:
+            del buffer[:position]
+        return frames
+
+    # End class StreamDecoder definition
@@ -12,39 +12,157 @@
 #                                                                  #
 #    4          CB - Revisited documentation again and cleaned up  #
 #               the file for readability.                          #
+#                                                                  #
+#    5          Sensor reads moved to a cached SensorSampler so    #
+#               the lights, display and serial report share one    #
+#               I2C read per sample period.                        #
+#                                                                  #
+#    6          ManagedDisplay draws through a diff based frame    #
+#               renderer instead of clearing the LCD every second. #
+#                                                                  #
+#    7          Replaced the sleep(1) counter loop with periodic   #
+#               jobs on a monotonic clock Scheduler.               #
+#                                                                  #
+#    8          Devices are created through the Hardware backend   #
+#               so the thermostat can run on simulated hardware.   #
+#                                                                  #
+#    9          Optional binary telemetry frames and a configurable#
+#               report period for the Thermostat Server.           #
+#                                                                  #
+#    10         Optional batched uplink with an offline buffer.    #
+#                                                                  #
+#    11         Buttons go through the debounced InputPipeline     #
+#               with hold to repeat on the set point buttons.      #
+#                                                                  #
+#    12         Heat / cool decisions made by a ControlEngine with #
+#               a deadband and minimum on / off times, driven by   #
+#               every new sensor sample.                           #
+#                                                                  #
+#    13         LEDs are faded by a single FadeEngine thread from  #
+#               precomputed gamma corrected tables, on hardware    #
+#               PWM where the pin supports it.                     #
+#                                                                  #
+#    14         The Pi LCD uses the bulk write HD44780 driver when #
+#               gpiod is installed.                                #
+#                                                                  #
+#    15         LED pins, sensor address, serial port, bus lock    #
+#               and fade engine can be given so several machines   #
+#               can share one process (see ZoneManager.py).        #
+#                                                                  #
+#    16         The bus lock is replaced by a BusArbiter, which    #
+#               takes one measurement per sample and shares it     #
+#               between concurrent readers.                        #
+#                                                                  #
+#    17         The serial port, LEDs and sensor are acquired on   #
+#               first use or in start(), not when the machine is   #
+#               created.                                           #
+#                                                                  #
+#    18         Periodic jobs are registered by add_jobs(), and a  #
+#               session can be recorded with --record for replay.  #
+#                                                                  #
+#    19         The DEBUG prints on the state changes, buttons,    #
+#               light updates and display refreshes are trace      #
+#               events in a ring buffer, dumped with --trace.      #
+#                                                                  #
+#    20         Sensor read times, job timing, serial traffic and  #
+#               state changes can be exported as Prometheus        #
+#               metrics, served with --metrics.                    #
+#                                                                  #
+#    21         Temperatures are integer tenths from the sensor's  #
+#               raw value to the LCD and serial text, converted    #
+#               and formatted through lookup tables.               #
+#                                                                  #
+#    22         The set point, state, control output and recent    #
+#               readings can be kept in a StateStore and restored  #
+#               on a restart, with --state.                        #
+#                                                                  #
+#    23         A weekly set point program can change the set      #
+#               point and mode at its transitions, with --program. #
+#               The LCD pages to the next transition.              #
+#                                                                  #
+#    24         Fahrenheit tenths come from the sensor's raw value #
+#               and are saved with the readings.                   #
+#                                                                  #
+#    25         Program transitions go straight to their mode and  #
+#               are serialized with the button handlers.           #
 #------------------------------------------------------------------#
 
+# The machine's metrics are kept together in a namedtuple, and its recent readings in a deque
+from collections import deque, namedtuple
+
+# The set point program runs on wall clock dates and times
+from datetime import datetime, timedelta
 
-# This is needed to get coherent matching of temperatures.
-from math import floor
+# Hardware is acquired on first use through cached properties, so creating the machine stays cheap
+from functools import cached_property
 
 # This package is necessary so that we can delegate the blinking lights to their own thread so that more work can be
 # done at the same time.
-from threading import Thread, Lock
+from threading import Thread, Lock, RLock
 
 # Import necessary to provide timing in the main loop
 from time import sleep
-from datetime import datetime
 
-# Imports necessary to provide connectivity to the thermostat sensor and the I2C bus
-import board
+# Imports required to allow us to build a fully functional state machine
+from statemachine import StateMachine, State
+
+# Hardware abstraction layer. The serial port, LEDs, buttons, sensor and LCD all come from the configured backend, which
+# is either the real Raspberry Pi drivers or the in-process simulators.
+import Hardware
 
-# import board - already imported for I2C connectivity
-import digitalio
+# Background sampler that caches the sensor readings so that the I2C bus is only touched once per sample period
+from SensorSampler import Reading, SensorSampler
 
-# This imports the Python serial package to handle communications over the Raspberry Pi's serial port.
-import serial
+# I2C bus arbiter that serializes the sensor reads and takes one measurement cycle per sample
+from I2cArbiter import BusArbiter
 
-# Imports required to handle our Button, and our PWMLED devices
-from gpiozero import Button, PWMLED
+# Frame buffer renderer that only sends the LCD cells that changed since the previous frame
+from LcdRenderer import FrameRenderer
 
-# Imports required to allow us to build a fully functional state machine
-from statemachine import StateMachine, State
+# Monotonic clock scheduler that runs the display, light and serial jobs at fixed periods without drift
+from Scheduler import Scheduler
+
+# Optional compact binary report frames for the Thermostat Server
+from TelemetryProtocol import FrameEncoder
+
+# Batched, delta encoded uplink that holds data while the serial link is down
+from Uplink import Uplink
+
+# Debounced, queued button input handled on a single worker thread
+from ButtonInput import InputPipeline
+
+# Heat / cool control engine that decides when the heating or cooling runs
+from Controller import ControlEngine, HysteresisPolicy
+
+# One thread fading every LED from precomputed duty cycle tables
+from FadeEngine import FadeEngine
 
-# These are the packages that we need to pull in so that we can work with the GPIO interface on the Raspberry Pi board
-# and work with the 16x2 LCD
-import adafruit_ahtx0
-import adafruit_character_lcd.character_lcd as characterlcd
+# Temperatures are carried as integer tenths of a degree and formatted from a table
+from FixedPoint import TENTHS, fahrenheit_tenths, format_tenths
+
+# Ring buffer event tracing, decoded afterwards by DecodeTrace.py
+import Tracing
+
+# Trace events of the machine
+STATE = Tracing.define('state', state=Tracing.STRING)
+BUTTON = Tracing.define('button', action=Tracing.STRING, set_point=Tracing.INT)
+SAMPLE = Tracing.define('sample', fahrenheit=Tracing.TENTHS, set_point=Tracing.INT, output=Tracing.INT)
+LIGHTS = Tracing.define('lights', state=Tracing.STRING, running=Tracing.INT, fahrenheit=Tracing.TENTHS)
+DISPLAY = Tracing.define('display', nibble_writes=Tracing.INT)
+PROGRAM = Tracing.define('program', set_point=Tracing.INT, mode=Tracing.STRING)
+
+# Metrics registry and the serial port wrapper that counts the traffic
+from Metrics import MeteredPort
+
+# Settings and recent readings saved across restarts
+from StateStore import MachineState, SavedReading, StateStore
+
+# Weekly set point programs, searched for the transition in force and the next one
+from SetpointProgram import SetpointProgram
+
+# MachineMetrics - The gauges and counters a machine keeps up to date. state is a dictionary of a 0 / 1 gauge per state
+# and entries a dictionary of entry counters per state.
+MachineMetrics = namedtuple('MachineMetrics', ['temperature', 'humidity', 'set_point', 'running', 'state', 'entries'])
 
 class ManagedDisplay:
     """
@@ -52,67 +170,55 @@ class ManagedDisplay:
     4, and converted into a class so that we can more easily consume the operational capabilities.
     """
 
-    def __init__(self):
+    def __init__(self, backend=None):
         """
-        Set up the six GPIO lines to communicate with the display. This leverages the digitalio class to handle digital
-        outputs on the GPIO lines. There is also an analagous class for analog IO.
+        Set up the display through the hardware backend. On the Raspberry Pi the six GPIO lines to the display are
+        requested together from the GPIO character device and driven with bulk writes by Hd44780.BulkHD44780, or with
+        digitalio and the adafruit character LCD driver when gpiod isn't installed. The port mappings are kept in
+        Hardware.LCD_PINS and need to match the physical wiring of the display interface to the GPIO interface.
 
-        You need to make sure that the port mappings match the physical wiring of the display interface to the GPIO
-        interface. Compatible with all versions of RPI as of Jan. 2019
+        @param backend is the hardware backend to use. Defaults to Hardware.get_backend().
         """
-        self.lcd_rs = digitalio.DigitalInOut(board.D17)
-        self.lcd_en = digitalio.DigitalInOut(board.D27)
-        self.lcd_d4 = digitalio.DigitalInOut(board.D5)
-        self.lcd_d5 = digitalio.DigitalInOut(board.D6)
-        self.lcd_d6 = digitalio.DigitalInOut(board.D13)
-        self.lcd_d7 = digitalio.DigitalInOut(board.D26)
+        backend = backend if backend is not None else Hardware.get_backend()
 
         # Modify this if you have a different sized character LCD
         self.lcd_columns = 16
         self.lcd_rows = 2
 
-        # Initialise the lcd class
-        self.lcd = characterlcd.Character_LCD_Mono(
-            self.lcd_rs,
-            self.lcd_en,
-            self.lcd_d4,
-            self.lcd_d5,
-            self.lcd_d6,
-            self.lcd_d7,
-            self.lcd_columns,
-            self.lcd_rows
-        )
+        # Initialise the lcd class. The pins are kept so that they can be released in cleanup_display().
+        self.lcd, self.lcd_pins = backend.character_lcd(self.lcd_columns, self.lcd_rows)
 
         # wipe LCD screen before we start
         self.lcd.clear()
 
+        # Frame buffer renderer. Tracks what is on the panel so that each update only writes the changed cells.
+        self.renderer = FrameRenderer(self.lcd, self.lcd_columns, self.lcd_rows)
+
 
     def cleanup_display(self):
         """
         cleanup_display - Method used to clean up the digitalIO lines that are used to run the display.
         """
         self.lcd.clear() # Clear the LCD first - otherwise we won't be abe to update it.
-        self.lcd_rs.deinit()
-        self.lcd_en.deinit()
-        self.lcd_d4.deinit()
-        self.lcd_d5.deinit()
-        self.lcd_d6.deinit()
-        self.lcd_d7.deinit()
+        for pin in self.lcd_pins:
+            pin.deinit()
 
     def clear(self):
         """
         clear - Convenience method used to clear the display
         """
         self.lcd.clear()
+        self.renderer.reset()
 
     def update_screen(self, message):
         """
-        update_screen - Convenience method used to update the message.
+        update_screen - Convenience method used to update the message. Only the characters that differ from the last
+        frame are written, so the panel is never cleared and does not flicker.
 
         @param message is a string to be sent to the LCD screen configured.
+        @return the number of GPIO nibble writes the update took.
         """
-        self.lcd.clear()
-        self.lcd.message = message
+        return self.renderer.render(message)
 
     # End class ManagedDisplay definition
 
@@ -136,7 +242,40 @@ class TemperatureMachine(StateMachine):
             cool.to(off)
     )
 
-    def __init__(self, set_point = 72, debugging = True):
+    # Events that go straight to a mode from either of the others, for the set point program
+    to_off = heat.to(off) | cool.to(off)
+    to_heat = off.to(heat) | cool.to(heat)
+    to_cool = off.to(cool) | heat.to(cool)
+
+    # Periods in seconds of the jobs run on the display thread
+    DISPLAY_PERIOD = 1
+    SERIAL_PERIOD = 30
+
+    # Default control settings. The deadband is in degrees Fahrenheit, the minimum on and off times are in seconds and
+    # keep a real HVAC relay from short cycling.
+    DEADBAND = 1.0
+    MIN_ON_TIME = 60
+    MIN_OFF_TIME = 60
+
+    # Sampling and flush periods in seconds for the batched uplink
+    UPLINK_SAMPLE_PERIOD = 10
+    UPLINK_FLUSH_PERIOD = 120
+
+    # Serial port the Thermostat Server is connected to
+    SERIAL_PORT = '/dev/ttyUSB0'
+
+    # Period in seconds of the job that saves changed settings to the state store
+    STATE_PERIOD = 5
+
+    # Longest the set point program sleeps between transitions, so a wall clock that is set or changes for daylight
+    # saving time is caught up with within the hour
+    PROGRAM_MAX_SLEEP = 3600
+
+    def __init__(self, set_point = 72, debugging = True, sample_period = 2.0, max_staleness = 10.0, backend = None,
+                 telemetry_format = 'text', report_period = None, spool_path = None, controller = None,
+                 led_pins = (18, 23), sensor_address = Hardware.AHTX0_ADDRESS, mux_channel = None, ser = None,
+                 bus = None, fade_engine = None, tracer = None, metrics = None, device = None, state_store = None,
+                 program = None):
         """
         This is the class initializer. This will create the class variables needed. This design choice was made over
         defining the variables outside the init state so that garbage collection can be done quicker. To fully utilize
@@ -147,45 +286,297 @@ class TemperatureMachine(StateMachine):
         this class's file.
 
         @param set_point defaulted to 72 degrees. Provide an integer as the default entry temp.
-        @param DEBUG Default is true. Change for debugging statements to console to be toggled.
-        """
+        @param debugging Default is true. Traces the state changes, button presses, samples, light updates, display
+        refreshes and scheduler jobs into a Tracing.Tracer ring buffer, self.tracer, which can be dumped for
+        DecodeTrace.py. Off, nothing is traced.
+        @param sample_period defaulted to 2 seconds. Time between sensor reads taken by the sampler thread.
+        @param max_staleness defaulted to 10 seconds. Oldest cached reading that will be used before the sensor is read
+        again on demand.
+        @param backend is the hardware backend the devices are created on. Defaults to Hardware.get_backend(), which
+        is picked with the THERMOSTAT_BACKEND environment variable.
+        @param telemetry_format defaulted to 'text'. Either 'text' for the comma separated line the Thermostat Server has
+        always read, 'binary' for the compact frames in TelemetryProtocol, or 'batch' for the buffered, delta encoded
+        batches in Uplink, which are sampled every UPLINK_SAMPLE_PERIOD and held while the link is down.
+        @param report_period defaulted to SERIAL_PERIOD (30 seconds), or UPLINK_FLUSH_PERIOD (120 seconds) for 'batch'.
+        Seconds between reports to the Thermostat Server.
+        @param spool_path defaulted to None. File that holds unsent batches while the link is down when using 'batch'.
+        Without it they are held in memory.
+        @param controller defaulted to None. ControlEngine that decides when the heating or cooling runs. Defaults to a
+        HysteresisPolicy with a DEADBAND wide band and MIN_ON_TIME / MIN_OFF_TIME on the backend clock. The engine is
+        given the temperature and set point in tenths of a degree Fahrenheit, so its policy must be in tenths too.
+        @param led_pins defaulted to (18, 23). GPIO pins of the red and blue LEDs, or None if there are none.
+        @param sensor_address defaulted to 0x38. I2C address of the temperature sensor.
+        @param mux_channel defaulted to None. Channel of the I2C multiplexers the sensor is behind, if there is one. See
+        Hardware.mux_location().
+        @param ser defaulted to None. Serial port to report on, shared with other machines. Defaults to opening
+        SERIAL_PORT on first use.
+        @param bus defaulted to None. BusArbiter of the I2C bus, shared with other machines. Defaults to a new arbiter on
+        the backend clock.
+        @param fade_engine defaulted to None. FadeEngine the LEDs are faded by, shared with other machines. Defaults to a
+        new engine, which is started in run().
+        @param tracer defaulted to None. Tracing.Tracer to trace to, e.g. one shared with other machines. Defaults to a
+        new tracer when debugging and to no tracing otherwise.
+        @param metrics defaulted to None. Metrics.Registry to export the sensor read times, scheduler job timing, serial
+        traffic, temperature, set point and state changes to. Without it nothing is measured.
+        @param device defaulted to the sensor name, e.g. 'ahtx0@0x38'. Value of the device label of the metrics.
+        @param state_store defaulted to None. StateStore.StateStore the set point, state, control output and recent
+        readings are saved to under the device name. A state saved there by a previous run replaces set_point and the
+        initial 'off' state, the control engine carries on from it and the sensor is neither recalibrated nor read
+        before the first sample period if the last reading is still fresh.
+        @param program defaulted to None. SetpointProgram.SetpointProgram whose transitions set the set point and the
+        state, the state directly with the to_off, to_heat and to_cool events under inputLock. A change made with the
+        buttons holds until the next transition, including across a restart from the state store.
+        """
+
+        # Hardware backend and its clock. Every device below is created through the backend.
+        self.backend = backend if backend is not None else Hardware.get_backend()
+        self.clock = self.backend.clock
+
+        # Every I2C transaction goes through the arbiter, so the threads of this project never share the bus at once.
+        self.bus = bus if bus is not None else BusArbiter(self.clock.now)
+
+        # DEBUG flag - boolean value to indicate whether to trace what the machine is doing. Trace events are stored in
+        # a ring buffer rather than printed, so tracing doesn't hold up the display and button threads.
+        self.DEBUG = debugging
+        self.tracer = tracer if tracer is not None else (Tracing.Tracer() if debugging else None)
 
-        # Thread lock to ensure this multi thread project avoids resource sharing errors.
-        self.thread_lock = Lock()
+        # Name the machine is known by in the metrics and the state store
+        self.device = device if device is not None else Hardware.sensor_name(sensor_address, mux_channel)
+
+        # State saved before a restart. Only a state this machine can be in is restored.
+        self.stateStore = state_store
+        saved = state_store.restore(self.device) if state_store is not None else None
+        if saved is not None and saved.state not in [state.id for state in type(self).states]:
+            saved = None
+        self.savedState = saved
+        self.savedAt = None
 
         # Default temperature setPoint is 72 degrees Fahrenheit
-        self.setPoint = set_point
+        self.setPoint = saved.set_point if saved is not None else set_point
+
+        # Metrics, labelled with the device so a fleet can share one registry. Created before the state machine starts,
+        # as entering the initial state is exported.
+        self.registry = metrics
+        self.metrics = self.create_metrics(metrics) if metrics is not None else None
 
         # Continue display output
         self.endDisplay = False
 
-        # DEBUG flag - boolean value to indicate whether to print status messages on the console of the program
-        self.DEBUG = debugging
-
-        # Initialize our serial connection because we imported the entire package instead of just importing Serial and some of
-        # the other flags from the serial package, we need to reference those objects with dot notation.
-        # e.g. ser = serial.Serial
-        self.ser = serial.Serial(
-            port='/dev/ttyUSB0',           # Changed from ./ttyS0 (read) to /dev/ttyUSB0 (write)
-            baudrate=115200,               # This sets the speed of the serial interface in bits/seconds
-            parity=serial.PARITY_NONE,     # Disable parity
-            stopbits=serial.STOPBITS_ONE,  # Serial protocol will use one stop bit
-            bytesize=serial.EIGHTBITS,     # We are using 8-bit bytes
-            timeout=1                      # Configure a 1-second timeout
+        # Serial report settings. Binary frames are small enough to send many per second at 115200 baud.
+        if telemetry_format not in ('text', 'binary', 'batch'):
+            raise ValueError(f"Unknown telemetry format '{telemetry_format}', expected 'text', 'binary' or 'batch'")
+        self.telemetryFormat = telemetry_format
+        if report_period is None:
+            report_period = self.UPLINK_FLUSH_PERIOD if telemetry_format == 'batch' else self.SERIAL_PERIOD
+        self.reportPeriod = report_period
+        self.frameEncoder = FrameEncoder()
+
+        # Scheduler for the display thread jobs and the count of display refreshes used to alternate line 2
+        self.scheduler = Scheduler(self.clock.now, self.clock.wait, self.tracer, metrics, {'device': self.device})
+        self.displayTicks = 0
+
+        # Hardware settings. The serial port, LEDs, sensor and sampler are only acquired on first use or in start(), so
+        # creating the machine, e.g. to graph it, doesn't touch the hardware.
+        self.ledPins = led_pins
+        self.sensorAddress = sensor_address
+        self.muxChannel = mux_channel
+        self.samplePeriod = sample_period
+        self.maxStaleness = max_staleness
+        self.spoolPath = spool_path
+
+        # A shared serial port replaces the lazily opened one
+        if ser is not None:
+            self.ser = self._metered(ser)
+
+        # Both LEDs are faded by one engine thread, which is started in run()
+        self.fadeEngine = fade_engine if fade_engine is not None else FadeEngine(clock=self.clock.now,
+                                                                                wait=self.clock.wait)
+
+        # Heat / cool control. Every new sample is handed to the engine, and the lights only change when its output
+        # or the state does. The LEDs start dark, which is what the initial 'off' state shows.
+        if controller is None:
+            controller = ControlEngine(HysteresisPolicy(self.DEADBAND * TENTHS), self.MIN_ON_TIME, self.MIN_OFF_TIME,
+                                       self.clock.now)
+        self.controller = controller
+        self.controlLock = Lock()
+        self.lightsShown = ('off', False)
+
+        # Serializes the button handlers, run on the input worker, with the set point program, run on the scheduler
+        # thread, so only one of them sends an event or changes the set point at a time. Taken before controlLock.
+        self.inputLock = RLock()
+
+        # The last readings, saved with the settings so they survive a restart
+        self.recentReadings = deque(maxlen=state_store.readings) if state_store is not None else None
+        if saved is not None:
+            self.restore_state(saved)
+
+        # Run the init for the state machine, starting in the restored state if there is one
+        super().__init__(self, start_value=saved.state if saved is not None else None)
+
+        if state_store is not None:
+            state_store.attach(self.device, self.state_snapshot)
+
+        # Set point program, the index of the transition it last put in force and (date and time, transition) of its
+        # next one, for the display
+        self.program = program
+        self.programIndex = None
+        self.programNext = None
+
+    @cached_property
+    def ser(self):
+        """
+        Serial connection to the Thermostat Server, opened on first use. Changed from ./ttyS0 (read) to /dev/ttyUSB0
+        (write). The backend opens it at 115200 baud, no parity, one stop bit, 8-bit bytes and a 1-second timeout.
+        """
+        return self._metered(self.backend.serial_port(self.SERIAL_PORT))
+
+    def _metered(self, port):
+        """_metered - The serial port, wrapped to count its traffic if metrics are exported."""
+        return MeteredPort(port, self.registry, device=self.device) if self.registry is not None else port
+
+    @cached_property
+    def uplink(self):
+        """Batched uplink, only used with the 'batch' telemetry format. None otherwise."""
+        if self.telemetryFormat != 'batch':
+            return None
+        return Uplink(self.ser, self.clock, spool_path=self.spoolPath)
+
+    @cached_property
+    def redLight(self):
+        """Red LED on GPIO 18 unless other pins were given. GPIO 18 uses the hardware PWM block when it is enabled."""
+        return self._light(0)
+
+    @cached_property
+    def blueLight(self):
+        """Blue LED on GPIO 23 unless other pins were given."""
+        return self._light(1)
+
+    def _light(self, index):
+        """_light - Create the fade engine light for one of the LED pins, or a light on no pin if there are none."""
+        if self.ledPins is None:
+            return self.fadeEngine.light(Hardware.NullChannel())
+        return self.fadeEngine.light(self.backend.pwm_channel(self.ledPins[index]))
+
+    @cached_property
+    def thSensor(self):
+        """Our Temperature and Humidity sensor on the I2C bus"""
+        return self.backend.temperature_sensor(self.sensorAddress, self.muxChannel, calibrate=self.savedState is None)
+
+    @cached_property
+    def sampler(self):
+        """All temperature consumers read from this cache. The sampler thread is started in run()."""
+        read_time = read_errors = None
+        if self.registry is not None:
+            read_time = self.registry.histogram('thermostat_sensor_read_seconds',
+                                                'Time to read the sensor, including the wait for the I2C bus',
+                                                device=self.device)
+            read_errors = self.registry.counter('thermostat_sensor_read_errors_total', 'Sensor reads that failed',
+                                                device=self.device)
+        sampler = SensorSampler(self.thSensor, self.bus, self.samplePeriod, self.maxStaleness,
+                                self.clock.now, self.clock.wait, self.update_control, read_time, read_errors)
+        if self.recentReadings:
+            sampler.prime(self.recentReadings[-1])
+        return sampler
+
+    def _wall_offset(self):
+        """_wall_offset - Seconds to add to a time on the machine's clock to get the Unix time."""
+        return self.clock.wall_time().timestamp() - self.clock.now()
+
+    def restore_state(self, saved):
+        """
+        restore_state - Carry on from a state saved before a restart. The control engine keeps its output and the time
+        of its last switch, so the minimum on and off times still hold across the restart, and the saved readings are
+        kept as the recent readings. Called before the state machine starts.
+
+        @param saved is the StateStore.MachineState.
+        """
+        # Saved times are Unix times. One from the future, e.g. saved before the clock was set at boot, counts as now.
+        offset = self._wall_offset()
+        now = self.clock.now()
+        if saved.changed is not None:
+            self.controller.changed_at = min(saved.changed - offset, now)
+        self.controller.mode = saved.state
+        self.controller.output = saved.output and saved.state != 'off'
+        for timestamp, celsius, humidity, fahrenheit in saved.readings:
+            if fahrenheit is None:
+                fahrenheit = fahrenheit_tenths(celsius)
+            self.recentReadings.append(Reading(celsius, humidity, fahrenheit, min(timestamp - offset, now)))
+        if self.recentReadings:
+            self.controller.fahrenheit = self.recentReadings[-1].fahrenheit_tenths
+            self.controller.set_point = self.setPoint * TENTHS
+
+        # Tells the set point program whether it missed a transition while the machine was down
+        self.savedAt = saved.saved
+
+        # The LEDs start dark and are acquired in start(), which shows the restored state. Until then, entering it
+        # mustn't reach for them.
+        self.lightsShown = (saved.state, self.controller.output)
+
+    def state_snapshot(self):
+        """
+        state_snapshot - The machine's state to save. Called by the state store on whichever thread saves.
+
+        @return a StateStore.MachineState.
+        """
+        offset = self._wall_offset()
+        changed_at = self.controller.changed_at
+        return MachineState(
+            self.setPoint,
+            self.current_state.id,
+            bool(self.controller.output),
+            round(changed_at + offset, 3) if changed_at != float('-inf') else None,
+            [SavedReading(round(reading.timestamp + offset, 3), reading.celsius_tenths, reading.humidity_tenths,
+                          reading.fahrenheit_tenths) for reading in list(self.recentReadings)],
+            round(self.clock.now() + offset, 3)
         )
 
-        # Our two LEDs, utilizing GPIO 18, and GPIO 23
-        self.redLight = PWMLED(18)
-        self.blueLight = PWMLED(23)
+    def create_metrics(self, registry):
+        """
+        create_metrics - Create the gauges and counters this machine updates itself. The sensor, scheduler and serial
+        port metrics are created with those objects.
+
+        @param registry is the Metrics.Registry.
+        @return a MachineMetrics.
+        """
+        device = self.device
+        state_ids = [state.id for state in type(self).states]
+        metrics = MachineMetrics(
+            registry.gauge('thermostat_temperature_fahrenheit', 'Last temperature read', device=device),
+            registry.gauge('thermostat_humidity_percent', 'Last relative humidity read', device=device),
+            registry.gauge('thermostat_set_point_fahrenheit', 'Set point', device=device),
+            registry.gauge('thermostat_running', '1 while the heating or cooling is running', device=device),
+            {state: registry.gauge('thermostat_state', '1 for the current state', device=device, state=state)
+             for state in state_ids},
+            {state: registry.counter('thermostat_state_entries_total', 'Entries into each state, including the '
+                                     'initial one', device=device, state=state) for state in state_ids},
+        )
+        metrics.set_point.set(self.setPoint)
+        return metrics
 
-        # Create an I2C instance so that we can communicate with devices on the I2C bus.
-        i2c = board.I2C()
+    def on_enter_state(self, target):
+        """
+        on_enter_state - Action performed when the state machine enters any state, including the initial one. Exports
+        the new state.
+        """
+        if self.metrics is not None:
+            for state, gauge in self.metrics.state.items():
+                gauge.set(1 if state == target.id else 0)
+            self.metrics.entries[target.id].inc()
+        if self.stateStore is not None:
+            self.stateStore.changed()
 
-        # Initialize our Temperature and Humidity sensor
-        self.thSensor = adafruit_ahtx0.AHTx0(i2c)
+    def start(self):
+        """
+        start - Acquire all of the hardware now instead of on first use: the serial port, the LEDs and the sensor. Lets
+        a missing device fail at startup rather than part way through a run. Called by run().
+        """
+        for resource in ('ser', 'uplink', 'redLight', 'blueLight', 'thSensor', 'sampler'):
+            getattr(self, resource)
 
-        # Run the init for the state machine
-        super().__init__(self)
+        # The LEDs start dark. Show the state the machine is in, which may have been restored.
+        with self.controlLock:
+            self.lightsShown = ('off', False)
+        self.update_lights()
 
     def on_enter_heat(self):
         """
@@ -193,8 +584,8 @@ class TemperatureMachine(StateMachine):
         """
         self.update_lights()
 
-        if self.DEBUG:
-            print("* Changing state to heat")
+        if self.tracer is not None:
+            self.tracer.emit(STATE, self.tracer.intern('heat'))
 
     def on_exit_heat(self):
         """
@@ -208,8 +599,8 @@ class TemperatureMachine(StateMachine):
         """
         self.update_lights()
 
-        if self.DEBUG:
-            print("* Changing state to cool")
+        if self.tracer is not None:
+            self.tracer.emit(STATE, self.tracer.intern('cool'))
 
     def on_exit_cool(self):
         """
@@ -225,165 +616,364 @@ class TemperatureMachine(StateMachine):
         # Pseudocode called for two lines for expected result which I believe was toggling the lights off but how I
         # implemented update_lights() makes it so the lights turn off and not on unless the state is heat or cool.
 
-        if self.DEBUG:
-            print("* Changing state to off")
+        if self.tracer is not None:
+            self.tracer.emit(STATE, self.tracer.intern('off'))
 
     def process_temp_state_button(self):
         """
         process_temp_state_button - Utility method used to send events to the state machine. This is triggered by the
         button_pressed event handler for our first button
         """
-        if self.DEBUG:
-            print("Cycling Temperature State")
-        self.send('cycle')
+        with self.inputLock:
+            if self.tracer is not None:
+                self.tracer.emit(BUTTON, self.tracer.intern('cycle'), self.setPoint)
+            self.send('cycle')
 
     def process_temp_inc_button(self):
         """
         process_temp_inc_button - Utility method used to update the setPoint for the temperature. This will increase the
         setPoint by a single degree. This is triggered by the button_pressed event handler for our second button
         """
-        if self.DEBUG:
-            print("Increasing Set Point")
-        self.setPoint += 1
-        self.update_lights()
+        with self.inputLock:
+            if self.tracer is not None:
+                self.tracer.emit(BUTTON, self.tracer.intern('increase'), self.setPoint)
+            self.change_set_point(self.setPoint + 1)
 
     def process_temp_dec_button(self):
         """
         process_temp_dec_button - Utility method used to update the setPoint for the temperature. This will decrease the
         setPoint by a single degree. This is triggered by the button_pressed event handler for our third button.
         """
-        if self.DEBUG:
-            print("Decreasing Set Point")
-        self.setPoint -= 1
-        self.update_lights()
+        with self.inputLock:
+            if self.tracer is not None:
+                self.tracer.emit(BUTTON, self.tracer.intern('decrease'), self.setPoint)
+            self.change_set_point(self.setPoint - 1)
 
-    def update_lights(self):
+    def change_set_point(self, set_point):
         """
-        update_lights - Utility method to update the LED indicators on the Thermostat
+        change_set_point - Set the set point, from a button or the program, and export, save and act on it.
+
+        @param set_point is the new set point in whole degrees Fahrenheit.
         """
-        temp = floor(self.get_fahrenheit()) # Make sure we are comparing temperatures in the correct scale
-        self.redLight.off()
-        self.blueLight.off()
+        with self.inputLock:
+            self.setPoint = set_point
+            if self.metrics is not None:
+                self.metrics.set_point.set(self.setPoint)
+            if self.stateStore is not None:
+                self.stateStore.changed()
+            self.update_lights()
 
-        # Verify values for debug purposes
-        if self.DEBUG:
-            print(f"State: {self.current_state.id}")
-            print(f"SetPoint: {self.setPoint}")
-            print(f"Temp: {temp}")
-
-        # Determine visual identifiers
-        if self.heat.is_active:
-            # Heat is active. Now check if its above or equal to the set point.
-            if self.get_fahrenheit() >= self.setPoint:
-                # At or above the set point. Per requirements, we should have a solid light.
-                self.redLight.on()
-            else:
-                # Below the heating requirement. Show active status by pulsing the light.
-                self.redLight.pulse()
-
-        elif self.cool.is_active:
-            # Cooling is active. Now check if its below or equal to the set point.
-            if self.get_fahrenheit() <= self.setPoint:
-                # No cooling required because we're at or below the set point.
-                self.blueLight.on()
-            else:
-                # Cooling required. Show active state by pulsing the light.
-                self.blueLight.pulse()
+    def apply_transition(self, transition):
+        """
+        apply_transition - Put a set point program transition in force. Its mode is entered directly with one of the
+        to_ events, so going from heat to off doesn't pass through cool, and the state actions run as usual. Runs on
+        the scheduler thread, under inputLock so a button handler can't interleave with it.
+
+        @param transition is the SetpointProgram Transition.
+        """
+        with self.inputLock:
+            if self.tracer is not None:
+                self.tracer.emit(PROGRAM, transition.set_point, self.tracer.intern(transition.mode or 'unchanged'))
+            if transition.mode is not None and self.current_state.id != transition.mode:
+                self.send(f'to_{transition.mode}')
+            self.change_set_point(transition.set_point)
+
+    def run_program(self):
+        """
+        run_program - Timer job of the set point program. Puts the transition in force into effect if it isn't yet and
+        sleeps until the next one. Changes made with the buttons since the last transition are left alone.
+
+        @return the number of seconds until the next transition, at most PROGRAM_MAX_SLEEP.
+        """
+        now = self.clock.wall_time()
+        index = self.program.index_at(now)
+
+        # A restored state saved after the transition now in force already has it, or a hold made since
+        if self.programIndex is None and self.savedAt is not None:
+            until_next, _ = self.program.next_change(datetime.fromtimestamp(self.savedAt))
+            if until_next > now.timestamp() - self.savedAt:
+                self.programIndex = index
+
+        if index != self.programIndex:
+            self.programIndex = index
+            self.apply_transition(self.program.transitions[index])
+
+        seconds, transition = self.program.next_change(now)
+        self.programNext = (now + timedelta(seconds=seconds), transition)
+
+        # Waking a millisecond late keeps the wall clock's rounding from waking the timer just before the transition
+        return min(seconds + 0.001, self.PROGRAM_MAX_SLEEP)
+
+    def update_control(self, reading):
+        """
+        update_control - Hand a new sensor sample to the control engine and refresh the lights. Called by the sampler
+        for every reading it takes.
+
+        @param reading is the new SensorSampler Reading.
+        """
+        # Both in tenths of a degree, so the comparison with the set point is exact
+        fahrenheit = reading.fahrenheit_tenths
+        with self.controlLock:
+            running = self.controller.output
+            self.controller.update(self.current_state.id, fahrenheit, self.setPoint * TENTHS, reading.timestamp)
+        if self.stateStore is not None:
+            self.recentReadings.append(reading)
+            if self.controller.output != running:
+                self.stateStore.changed()
+        if self.tracer is not None:
+            self.tracer.emit(SAMPLE, fahrenheit, self.setPoint, int(bool(self.controller.output)))
+        if self.metrics is not None:
+            self.metrics.temperature.set(fahrenheit / TENTHS)
+            self.metrics.humidity.set(reading.humidity_tenths / TENTHS)
+            self.metrics.set_point.set(self.setPoint)
+            self.metrics.running.set(1 if self.controller.output else 0)
+        self.update_lights()
+
+    def update_lights(self):
+        """
+        update_lights - Utility method to update the LED indicators on the Thermostat from the control engine's output.
+        The LEDs are only touched when what they show changes, so a pulsing light isn't restarted.
+        """
+        with self.controlLock:
+            state = self.current_state.id
+
+            # The engine's output belongs to the state it last decided for. Until the next sample after a state
+            # change the new state shows as not running.
+            running = self.controller.output and self.controller.mode == state
+            if (state, running) == self.lightsShown:
+                return
+            self.lightsShown = (state, running)
+
+            self.redLight.off()
+            self.blueLight.off()
+
+            # Verify values for debug purposes
+            if self.tracer is not None:
+                self.tracer.emit(LIGHTS, self.tracer.intern(state), int(bool(running)),
+                                 Tracing.missing(self.controller.fahrenheit))
+
+            # Determine visual identifiers. A solid light means the set point is satisfied, pulsing means the heating
+            # or cooling is running.
+            if state == 'heat':
+                if running:
+                    self.redLight.pulse()
+                else:
+                    self.redLight.on()
+
+            elif state == 'cool':
+                if running:
+                    self.blueLight.pulse()
+                else:
+                    self.blueLight.on()
 
     def run(self):
         """
-        run - kickoff the display management functionality of the thermostat
+        run - acquire the hardware and kickoff the sensor sampler, the LED fades and the display management
+        functionality of the thermostat
         """
-        my_thread = Thread(target=self.manage_my_display)
+        self.start()
+        self.sampler.start()
+        self.fadeEngine.start()
+
+        my_thread = Thread(target=self.manage_my_display, name='Display')
         my_thread.start()
 
     def get_fahrenheit(self):
         """
-        Get the temperature in Fahrenheit
+        Get the temperature in Fahrenheit from the sampler cache. The sensor is only read here if the cached reading
+        is older than the sampler's max staleness.
         """
-        with self.thread_lock:
-            t = self.thSensor.temperature # Retrieves as Celsius.
-        return ((9 / 5) * t) + 32         # Convert to Fahrenheit
+        return self.sampler.get_fahrenheit()
+
+    def get_fahrenheit_tenths(self):
+        """
+        Get the temperature in tenths of a degree Fahrenheit from the sampler cache, see get_fahrenheit().
+        """
+        return self.sampler.get_fahrenheit_tenths()
 
     def setup_serial_output(self):
         """
         Configure output string for the Thermostat Server
         """
         # System requirements called for the variable to be 'output' but that shadows a function.
-        return f'{self.current_state.id},{self.get_fahrenheit():0.1f}F,{self.setPoint}F\n'
+        return f'{self.current_state.id},{format_tenths(self.get_fahrenheit_tenths())}F,{self.setPoint}F\n'
+
+    def setup_binary_output(self):
+        """
+        Configure the binary output frame for the Thermostat Server. Carries the same information as
+        setup_serial_output() plus the humidity, a sequence number and a CRC.
+        """
+        reading = self.sampler.latest()
+        return self.frameEncoder.encode_tenths(
+            self.current_state.id,
+            reading.fahrenheit_tenths,
+            reading.humidity_tenths,
+            self.setPoint * TENTHS
+        )
+
+    def refresh_display(self, screen):
+        """
+        refresh_display - Periodic job that redraws the LCD. Line 1 is the date and time. Line 2 shows the current
+        temperature for five refreshes and then the set point for five refreshes, followed by the time and set point of
+        the program's next transition for five refreshes if there is a program.
+
+        @param screen is the ManagedDisplay owned by the display thread.
+        """
+        # Setup display line 1
+        lcd_line_1 = self.clock.wall_time().strftime('%b %d  %H:%M:%S\n')
+
+        # Setup Display Line 2
+        page = self.displayTicks // 5 % (2 if self.programNext is None else 3)
+        if page == 0:
+            lcd_line_2 = f"Cur Temp:{format_tenths(self.get_fahrenheit_tenths())}F"
+        elif page == 1:
+            lcd_line_2 = f"Set Temp:{self.setPoint}F"
+        else:
+            at, transition = self.programNext
+            lcd_line_2 = f"Next {at:%H:%M} {transition.set_point}F"
+        self.displayTicks += 1
+
+        # Update Display
+        nibble_writes = screen.update_screen(lcd_line_1 + lcd_line_2)
+        if self.tracer is not None:
+            self.tracer.emit(DISPLAY, nibble_writes)
+
+    def send_serial_report(self):
+        """
+        send_serial_report - Periodic job that sends the current state to the Thermostat Server.
+        """
+        if self.telemetryFormat == 'batch':
+            self.uplink.flush()
+        elif self.telemetryFormat == 'binary':
+            self.ser.write(self.setup_binary_output())
+        else:
+            msg = self.setup_serial_output()    # String that's configured in setup_serial_output()
+            self.ser.write(msg.encode('utf-8')) # encode and serialize the string.
+
+    def record_uplink_sample(self):
+        """
+        record_uplink_sample - Periodic job that adds the current reading to the batched uplink's buffer.
+        """
+        # The uplink delta encodes whole samples in tenths itself, so it is handed degrees and percent
+        reading = self.sampler.latest()
+        self.uplink.record(
+            self.clock.wall_time().timestamp(),
+            self.current_state.id,
+            reading.fahrenheit_tenths / TENTHS,
+            reading.humidity_tenths / TENTHS,
+            self.setPoint
+        )
+
+    def add_jobs(self, screen=None):
+        """
+        add_jobs - Register the periodic jobs with the scheduler, starting from now.
+
+        @param screen is the ManagedDisplay to refresh, or None to leave out the display job, e.g. when replaying.
+        """
+        if screen is not None:
+            self.scheduler.add_job('display', self.DISPLAY_PERIOD, lambda: self.refresh_display(screen))
+
+        # Update server every 30 seconds unless a different report period was asked for
+        self.scheduler.add_job('serial', self.reportPeriod, self.send_serial_report, delay=self.reportPeriod)
+
+        # The batched uplink samples more often than it reports
+        if self.uplink is not None:
+            self.scheduler.add_job('uplink', self.UPLINK_SAMPLE_PERIOD, self.record_uplink_sample)
+
+        # The set point program sleeps until its next transition
+        if self.program is not None:
+            self.scheduler.add_timer('program', self.run_program)
+
+        # Changed settings are saved within a few seconds, the readings alone far less often
+        if self.stateStore is not None:
+            self.scheduler.add_job('state', self.STATE_PERIOD, self.stateStore.save_if_due, delay=self.STATE_PERIOD)
 
     def manage_my_display(self):
         """
         This function is designed to manage the LCD. This function is operated on its own thread. Any function calls
         to other threads need to be done through a thread lock, or you'll get an OS number 5 error.
+
+        The display refresh and the serial report are registered with the scheduler as independent
+        periodic jobs. Each job keeps its own period regardless of how long the others take.
         """
 
         # Initialize our display. Brought here so it can be thread safe.
-        screen = ManagedDisplay()
-        counter = 1
-        alt_counter = 1
-        while not self.endDisplay:
-            # Only display if the DEBUG flag is set
-            if self.DEBUG:
-                print("Processing Display Info...")
-
-            # Setup display line 1
-            lcd_line_1 = datetime.now().strftime('%b %d  %H:%M:%S\n')
-
-            # Setup Display Line 2
-            if alt_counter < 6:
-                # Output the current temp and increment the counter.
-                lcd_line_2 = f"Cur Temp:{self.get_fahrenheit():0.1f}F"
-                alt_counter = alt_counter + 1
-            else:
-                # Output the set point and reset the lights and counter if at 10 seconds.
-                lcd_line_2 = f"Set Temp:{self.setPoint}F"
-                alt_counter = alt_counter + 1
-
-                if alt_counter >= 11:
-                    # Run the routine to update the lights every 10 seconds to keep operations smooth
-                    self.update_lights()
-                    alt_counter = 1
-
-            # Update Display
-            screen.update_screen(lcd_line_1 + lcd_line_2)
-
-            # Update server every 30 seconds
-            if self.DEBUG:
-               print(f"Counter: {counter}")
-
-            if (counter % 30) == 0:
-                msg = self.setup_serial_output()    # String that's configured in setup_serial_output()
-                self.ser.write(msg.encode('utf-8')) # encode and serialize the string.
-                counter = 1
-            else:
-                counter = counter + 1
-            sleep(1)
+        screen = ManagedDisplay(self.backend)
+
+        self.add_jobs(screen)
+        self.scheduler.run(should_stop=lambda: self.endDisplay)
 
-        # Cleanup display
+        if self.DEBUG:
+            for name, stats in self.scheduler.stats().items():
+                print(f"Job {name}: {stats['missed']} missed deadlines, max lateness {stats['max_lateness']:0.3f}s")
+
+        # Cleanup display and stop sampling the sensor and fading the LEDs
         screen.cleanup_display()
+        self.sampler.stop()
+        self.fadeEngine.stop()
 
     # End class TemperatureMachine definition
 
 # Added an execution for the file statement because I want to use the graphing calls of the statemachine defined in
 # this file for documentation.
 if __name__ == '__main__':
+    import sys
+
+    # python Thermostat.py --trace FILE traces the machine and writes the trace to FILE on exit, for DecodeTrace.py
+    trace_path = sys.argv[sys.argv.index('--trace') + 1] if '--trace' in sys.argv else None
+
+    # python Thermostat.py --metrics PORT|SOCKET serves the metrics in the Prometheus format at /metrics on a local TCP
+    # port or a Unix domain socket
+    registry = metrics_server = None
+    if '--metrics' in sys.argv:
+        from Metrics import Registry, MetricsServer
+        metrics_address = sys.argv[sys.argv.index('--metrics') + 1]
+        registry = Registry()
+        metrics_server = MetricsServer(registry, ('127.0.0.1', int(metrics_address)) if metrics_address.isdigit()
+                                       else metrics_address)
+
+    # python Thermostat.py --state FILE keeps the set point, state and recent readings in FILE.a and FILE.b, so a
+    # restart carries on where the last run left off
+    state_store = StateStore(sys.argv[sys.argv.index('--state') + 1]) if '--state' in sys.argv else None
+
+    # python Thermostat.py --program FILE runs the set point program written in FILE, see SetpointProgram.py
+    program = SetpointProgram.load(sys.argv[sys.argv.index('--program') + 1]) if '--program' in sys.argv else None
 
     # Set up our State Machine
-    tsm = TemperatureMachine(68, False)
+    tsm = TemperatureMachine(68, False, tracer=Tracing.Tracer() if trace_path is not None else None, metrics=registry,
+                             state_store=state_store, program=program)
+    if metrics_server is not None:
+        metrics_server.start()
+
+    # python Thermostat.py --record FILE logs the sensor readings, button presses, transitions and serial traffic so
+    # the session can be replayed against new code with Recording.py
+    recorder = None
+    if '--record' in sys.argv:
+        from Recording import EventRecorder
+        recorder = EventRecorder(sys.argv[sys.argv.index('--record') + 1])
+        recorder.attach(tsm)
+
     tsm.run()
 
+    # Button presses are timestamped and debounced in the gpiozero callbacks and handled one at a time on the input
+    # pipeline's worker thread, so a handler never runs inside a callback.
+    inputs = InputPipeline(tsm.clock.now)
+
     # Configure our green button to use GPIO 24 and to execute the method to cycle the thermostat when pressed.
-    greenButton = Button(24)
-    greenButton.when_pressed = tsm.process_temp_state_button
+    greenButton = tsm.backend.button(24)
+    inputs.add_button('green', greenButton, tsm.process_temp_state_button)
 
-    # Configure our Red button to use GPIO 25 and to execute the function to increase the setpoint by a degree.
-    redButton = Button(25)
-    redButton.when_pressed = tsm.process_temp_inc_button
+    # Configure our Red button to use GPIO 25 and to execute the function to increase the setpoint by a degree. Holding
+    # the button repeats the increase.
+    redButton = tsm.backend.button(25)
+    inputs.add_button('red', redButton, tsm.process_temp_inc_button, repeat=True)
 
-    # Configure our Blue button to use GPIO 12 and to execute the function to decrease the setpoint by a degree.
-    blueButton = Button(12)
-    blueButton.when_pressed = tsm.process_temp_dec_button
+    # Configure our Blue button to use GPIO 12 and to execute the function to decrease the setpoint by a degree. Holding
+    # the button repeats the decrease.
+    blueButton = tsm.backend.button(12)
+    inputs.add_button('blue', blueButton, tsm.process_temp_dec_button, repeat=True)
+
+    inputs.start()
 
     # Set up loop variable
     repeat = True
@@ -402,6 +992,25 @@ if __name__ == '__main__':
             # Stop the loop
             repeat = False
 
+            # Stop handling button presses and report how quickly they were handled
+            inputs.stop()
+            latency = inputs.latency_percentiles()
+            print(f"Button to LED latency: p50 {latency['p50'] * 1000:0.1f}ms, p99 {latency['p99'] * 1000:0.1f}ms, "
+                  f"max {latency['max'] * 1000:0.1f}ms")
+
             # Close down the display
             tsm.endDisplay = True
-            sleep(1)
\ No newline at end of file
+            tsm.scheduler.stop()
+            sleep(1)
+
+            if recorder is not None:
+                recorder.close()
+
+            if state_store is not None:
+                state_store.close()
+
+            if trace_path is not None:
+                print(f"Wrote {tsm.tracer.dump(trace_path)} trace events to {trace_path}")
+
+            if metrics_server is not None:
+                metrics_server.stop()
\ No newline at end of file
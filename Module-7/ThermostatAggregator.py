@@ -0,0 +1,269 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Reports can be persisted to a TimeSeriesStore with #
+#               --store DIR.                                       #
+#                                                                  #
+#    3          Lines prefixed with 'zone:' from a ZoneManager are #
+#               tracked as separate devices.                       #
+#------------------------------------------------------------------#
+
+"""
+ThermostatAggregator.py - asyncio based Thermostat Server for a rack of thermostats. Where ThermostatServer-Simulator.py
+blocks on one serial port, the aggregator watches any number of serial ports, ptys or TCP stand-ins at once with
+non-blocking reads on a single event loop. Reports are parsed as they arrive and the latest state of every device is
+kept in memory.
+
+Usage: python ThermostatAggregator.py [--binary] [--store DIR] /dev/ttyUSB0 [/dev/ttyUSB1 ...] [tcp:host:port ...]
+"""
+
+import asyncio
+import os
+import sys
+
+from collections import namedtuple
+from time import monotonic, time
+
+# Streaming decoder for devices sending binary report frames
+from TelemetryProtocol import StreamDecoder
+
+# DeviceState - The latest report from one thermostat. Temperatures are in Fahrenheit, humidity is None for text
+# reports, received is the monotonic time the report was parsed.
+DeviceState = namedtuple('DeviceState', ['state', 'fahrenheit', 'set_point', 'humidity', 'received'])
+
+
+def parse_line(line):
+    """
+    parse_line - Parse one text report, e.g. 'heat,71.3F,72F'.
+
+    @param line is the report without its newline, as bytes or str.
+    @return a tuple of (state, fahrenheit, set_point), or None if the line is not a valid report.
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', 'replace')
+    fields = line.strip().lower().split(',')
+    if len(fields) != 3:
+        return None
+
+    state, temperature, set_point = fields
+    try:
+        return state, float(temperature.rstrip('f')), float(set_point.rstrip('f'))
+    except ValueError:
+        return None
+
+
+class TelemetryAggregator:
+    """
+    TelemetryAggregator - Keeps the latest state of every thermostat it is watching. Each device is read with
+    non-blocking reads on the event loop and its reports are parsed straight out of the received chunks.
+    """
+
+    def __init__(self, on_report=None):
+        """
+        Set up an aggregator with no devices.
+
+        @param on_report is an optional callable on_report(name, device_state) called for every parsed report.
+        """
+        self.devices = {}
+        self.on_report = on_report
+
+        # Statistics
+        self.reports = 0
+        self.bad_lines = 0
+        self.bytes_received = 0
+
+        self._pending = {}
+        self._decoders = {}
+
+    def feed(self, name, chunk, binary=False):
+        """
+        feed - Process bytes received from a device.
+
+        @param name is the device name.
+        @param chunk is the bytes received.
+        @param binary is True if the device sends TelemetryProtocol frames instead of text lines.
+        """
+        self.bytes_received += len(chunk)
+
+        if binary:
+            decoder = self._decoders.get(name)
+            if decoder is None:
+                decoder = self._decoders[name] = StreamDecoder()
+            for frame in decoder.feed(chunk):
+                self._update(name, frame.state, frame.fahrenheit, frame.set_point, frame.humidity)
+            return
+
+        data = self._pending.pop(name, b'') + chunk
+        *lines, remainder = data.split(b'\n')
+        if remainder:
+            self._pending[name] = remainder
+
+        for line in lines:
+            if len(line) <= 1:
+                continue
+
+            # A ZoneManager sends one line per zone as 'zone:report'
+            device = name
+            zone, separator, rest = line.partition(b':')
+            if separator:
+                device = f"{name}/{zone.decode('utf-8', 'replace')}"
+                line = rest
+
+            report = parse_line(line)
+            if report is None:
+                self.bad_lines += 1
+                continue
+            self._update(device, *report, None)
+
+    def _update(self, name, state, fahrenheit, set_point, humidity):
+        """_update - Store a parsed report as the device's latest state."""
+        device_state = DeviceState(state, fahrenheit, set_point, humidity, monotonic())
+        self.devices[name] = device_state
+        self.reports += 1
+        if self.on_report is not None:
+            self.on_report(name, device_state)
+
+    async def watch_fd(self, name, fd, binary=False):
+        """
+        watch_fd - Read a file descriptor (a serial port or pty) until it is closed or the task is cancelled.
+
+        @param name is the device name.
+        @param fd is an open file descriptor. It is switched to non-blocking mode.
+        @param binary is True if the device sends binary frames.
+        """
+        loop = asyncio.get_running_loop()
+        closed = loop.create_future()
+        os.set_blocking(fd, False)
+
+        def readable():
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                return
+            except OSError:
+                chunk = b''
+            if not chunk:
+                loop.remove_reader(fd)
+                if not closed.done():
+                    closed.set_result(None)
+                return
+            self.feed(name, chunk, binary)
+
+        loop.add_reader(fd, readable)
+        try:
+            await closed
+        finally:
+            loop.remove_reader(fd)
+
+    async def watch_serial(self, port, binary=False):
+        """
+        watch_serial - Open a serial port or pty with the thermostat's serial settings and watch it.
+
+        @param port is the device path, e.g. /dev/ttyUSB0.
+        @param binary is True if the device sends binary frames.
+        """
+        import serial
+        ser = serial.Serial(
+            port=port,
+            baudrate=115200,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=0
+        )
+        try:
+            await self.watch_fd(port, ser.fileno(), binary)
+        finally:
+            ser.close()
+
+    async def watch_tcp(self, host, port, binary=False):
+        """
+        watch_tcp - Connect to a TCP stand-in for a serial port (e.g. a ser2net bridge) and watch it.
+
+        @param host is the host name.
+        @param port is the TCP port.
+        @param binary is True if the device sends binary frames.
+        """
+        name = f'tcp:{host}:{port}'
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    break
+                self.feed(name, chunk, binary)
+        finally:
+            writer.close()
+
+    def watch(self, address, binary=False):
+        """
+        watch - Create the watcher coroutine for an address.
+
+        @param address is a device path, or tcp:host:port.
+        @param binary is True if the device sends binary frames.
+        @return the coroutine.
+        """
+        if address.startswith('tcp:'):
+            _, host, port = address.split(':')
+            return self.watch_tcp(host, int(port), binary)
+        return self.watch_serial(address, binary)
+
+    # End class TelemetryAggregator definition
+
+
+async def report_loop(aggregator, period=5.0):
+    """
+    report_loop - Print the latest state of every device once per period.
+
+    @param aggregator is the TelemetryAggregator to report on.
+    @param period is the number of seconds between reports.
+    """
+    while True:
+        await asyncio.sleep(period)
+        now = monotonic()
+        print(f"{len(aggregator.devices)} devices, {aggregator.reports} reports, {aggregator.bad_lines} bad lines")
+        for name, device in sorted(aggregator.devices.items()):
+            humidity = '' if device.humidity is None else f" {device.humidity:0.1f}%"
+            print(f"  {name}: {device.state} {device.fahrenheit:0.1f}F set {device.set_point:0.0f}F{humidity} "
+                  f"({now - device.received:0.1f}s ago)")
+
+
+async def main(addresses, binary=False, store=None):
+    """
+    main - Watch every address and print the device table until interrupted.
+
+    @param addresses is a list of device paths or tcp:host:port addresses.
+    @param binary is True if the devices send binary frames.
+    @param store is an optional TimeSeriesStore that every report is appended to.
+    """
+    def store_report(name, device):
+        store.append(name, time(), device.state, device.fahrenheit, device.set_point, device.humidity)
+
+    aggregator = TelemetryAggregator(store_report if store is not None else None)
+    await asyncio.gather(report_loop(aggregator), *(aggregator.watch(address, binary) for address in addresses))
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    binary = '--binary' in arguments
+    if binary:
+        arguments.remove('--binary')
+
+    store = None
+    if '--store' in arguments:
+        from TimeSeriesStore import TimeSeriesStore
+        position = arguments.index('--store')
+        store = TimeSeriesStore(arguments[position + 1])
+        del arguments[position:position + 2]
+
+    try:
+        asyncio.run(main(arguments or ['/dev/ttyUSB0'], binary, store))
+    except KeyboardInterrupt:
+        print("Exiting...")
+    finally:
+        if store is not None:
+            store.close()
@@ -12,16 +12,40 @@
 # Version   |   Description
 #------------------------------------------------------------------
 #    1          Initial Development
+#    2          Added the binary frame decoder. Run with --binary
+#               when the thermostat sends TelemetryProtocol frames.
+#    3          Added the batched uplink decoder. Run with --batch
+#               when the thermostat uses the 'batch' format. Every
+#               batch is acknowledged so the thermostat can stop
+#               holding it.
+#    4          Batches are acknowledged with their session id as
+#               well as their sequence number.
 #------------------------------------------------------------------
 
 # Load the time module so that we can utilize the sleep method to 
 # inject a pause into our operation
 import time
 
+# Used to check the command line for the --binary option
+import sys
+
 # This imports the Python serial package to handle communications over the
 # Raspberry Pi's serial port. 
 import serial
 
+# Streaming decoder for the binary report frames
+from TelemetryProtocol import StreamDecoder
+
+# Decoder and acknowledgement for the batched uplink
+from Uplink import BatchDecoder, encode_ack
+
+# BINARY flag - True when the thermostat is sending binary frames instead of
+# text lines
+BINARY = '--binary' in sys.argv
+
+# BATCH flag - True when the thermostat is sending uplink batches
+BATCH = '--batch' in sys.argv
+
 # Because we imported the entire package instead of just importing Serial and
 # some of the other flags from the serial package, we need to reference those
 # objects with dot notation.
@@ -44,9 +68,36 @@ ser = serial.Serial(
 # Setup loop variable
 repeat = True
 
+# Decoder for binary mode. Keeps partial frames between reads.
+decoder = StreamDecoder()
+
+# Decoder for batch mode
+batch_decoder = BatchDecoder()
+
 # Loop until the user enters a keyboard interrupt with CTRL-C
 while repeat:
         try:
+                if BATCH:
+                        # Print every sample in each complete batch, then
+                        # acknowledge the batch.
+                        for session, sequence, samples in batch_decoder.feed(ser.read(ser.in_waiting or 1)):
+                                for sample in samples:
+                                        stamp = time.strftime('%H:%M:%S', time.localtime(sample.timestamp))
+                                        print(f"{stamp} {sample.state},{sample.fahrenheit:0.1f}f,"
+                                              f"{sample.set_point:0.0f}f,{sample.humidity:0.1f}%")
+                                ser.write(encode_ack(session, sequence))
+                        continue
+
+                if BINARY:
+                        # Read whatever has arrived (at least one byte, so
+                        # this still blocks for up to the timeout) and
+                        # print every complete frame.
+                        for frame in decoder.feed(ser.read(ser.in_waiting or 1)):
+                                print(f"{frame.state},{frame.fahrenheit:0.1f}f,"
+                                      f"{frame.set_point:0.0f}f,{frame.humidity:0.1f}%"
+                                      f" #{frame.sequence}")
+                        continue
+
                 # Read a line from the serial port. 
                 # This also decodes the result into an utf-8 String (utf-8 is the
                 # default North American English character set) and
@@ -63,4 +114,13 @@ while repeat:
         except KeyboardInterrupt:
                 # We only reach here when the user has processed a Keyboard
                 # Interrupt by pressing CTRL-C, so Exit cleanly
-                repeat = False
\ No newline at end of file
+                repeat = False
+
+                if BINARY:
+                        print(f"{decoder.frames} frames, {decoder.crc_errors} "
+                              f"CRC errors, {decoder.frames_lost} lost")
+
+                if BATCH:
+                        print(f"{batch_decoder.batches} batches, "
+                              f"{batch_decoder.samples} samples, "
+                              f"{batch_decoder.duplicates} duplicates")
\ No newline at end of file
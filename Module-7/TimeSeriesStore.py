@@ -0,0 +1,348 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#------------------------------------------------------------------#
+
+"""
+TimeSeriesStore.py - Append only store for the thermostat reports received by the Thermostat Server. Each device has a
+directory holding a file of fixed width raw records and one file of fixed width rollup records for each of the 1 minute,
+1 hour and 1 day buckets. The rollups (count, min, average and max temperature) are updated as reports arrive, so a
+query over weeks of data reads a few hundred rollup records instead of scanning every report. The files are memory
+mapped for queries and the records are found with a binary search on their timestamps.
+
+Usage: python TimeSeriesStore.py [weeks]   - benchmark writes and range queries in a temporary directory
+"""
+
+import mmap
+import os
+import re
+
+from collections import namedtuple
+import struct
+
+# Raw record: timestamp (unix seconds), temperature and set point in tenths of a degree Fahrenheit, humidity in tenths
+# of a percent (0xFFFF when the report had none) and the state code.
+RAW = struct.Struct('<dhhHBx')
+
+# Rollup record: bucket start (unix seconds), number of reports, min and max temperature, and the sum of the
+# temperatures so the average can be merged across buckets.
+ROLLUP = struct.Struct('<dIffd')
+
+# Every record starts with its timestamp
+TIMESTAMP = struct.Struct('<d')
+
+# Bucket sizes in seconds
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+BUCKETS = (MINUTE, HOUR, DAY)
+
+STATES = ('off', 'heat', 'cool')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+NO_HUMIDITY = 0xFFFF
+
+# Sample - One raw report
+Sample = namedtuple('Sample', ['timestamp', 'state', 'fahrenheit', 'set_point', 'humidity'])
+
+# Bucket - One rollup bucket
+Bucket = namedtuple('Bucket', ['start', 'count', 'minimum', 'average', 'maximum'])
+
+
+class RecordFile:
+    """
+    RecordFile - A file of fixed width records that is appended to and read through a memory map. The map is
+    refreshed when the file has grown since it was last mapped.
+    """
+
+    def __init__(self, path, record):
+        """
+        Open the file, creating it if needed.
+
+        @param path is the file path.
+        @param record is the struct.Struct of one record. The first field must be a float64 timestamp.
+        """
+        self.path = path
+        self.record = record
+        self._file = open(path, 'ab')
+        self._map = None
+        self._mapped_size = 0
+
+        # Drop a partial record left by a crash in the middle of a write
+        size = os.path.getsize(path)
+        if size % record.size:
+            self._file.truncate(size - size % record.size)
+
+    def append(self, *values):
+        """append - Add one record to the end of the file."""
+        self._file.write(self.record.pack(*values))
+
+    def _view(self):
+        """_view - Map the file, remapping if it has grown. Returns None while the file is empty."""
+        self._file.flush()
+        size = os.path.getsize(self.path)
+        if size != self._mapped_size:
+            if self._map is not None:
+                self._map.close()
+            self._map = None
+            if size:
+                with open(self.path, 'rb') as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._map
+
+    def __len__(self):
+        """Number of complete records in the file."""
+        self._file.flush()
+        return os.path.getsize(self.path) // self.record.size
+
+    def last(self):
+        """last - The last record, or None if the file is empty."""
+        view = self._view()
+        if view is None:
+            return None
+        return self.record.unpack_from(view, len(view) - self.record.size)
+
+    def bisect(self, timestamp):
+        """
+        bisect - Binary search for the first record at or after a timestamp.
+
+        @param timestamp is the unix time to search for.
+        @return the record index.
+        """
+        view = self._view()
+        if view is None:
+            return 0
+
+        size = self.record.size
+        low, high = 0, len(view) // size
+        while low < high:
+            middle = (low + high) // 2
+            if TIMESTAMP.unpack_from(view, middle * size)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def range(self, start, end):
+        """
+        range - Records with timestamps in [start, end).
+
+        @return an iterator of unpacked record tuples.
+        """
+        view = self._view()
+        if view is None:
+            return iter(())
+        first = self.bisect(start)
+        last = self.bisect(end)
+        return self.record.iter_unpack(view[first * self.record.size:last * self.record.size])
+
+    def close(self):
+        """close - Close the file and its map."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    # End class RecordFile definition
+
+
+class DeviceSeries:
+    """
+    DeviceSeries - The raw reports and rollups of one device. The open bucket of each rollup is kept in memory and
+    written out when a report lands in a later bucket. Reports are expected in time order; one older than an open
+    bucket is counted in that bucket.
+    """
+
+    def __init__(self, directory):
+        """
+        Open or create the device's files and rebuild the open buckets from the raw reports that are newer than the
+        last written rollup.
+
+        @param directory is the device directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.raw = RecordFile(os.path.join(directory, 'raw.bin'), RAW)
+        self.rollups = {bucket: RecordFile(os.path.join(directory, f'rollup_{bucket}.bin'), ROLLUP)
+                        for bucket in BUCKETS}
+
+        # Open bucket per size as a list of [start, count, minimum, maximum, total]
+        self._open = {bucket: None for bucket in BUCKETS}
+        self._recover()
+
+    def _recover(self):
+        """_recover - Replay the raw reports that aren't in a written rollup yet into the open buckets."""
+        for bucket, rollup in self.rollups.items():
+            last = rollup.last()
+            since = last[0] + bucket if last is not None else float('-inf')
+            for timestamp, temperature, _, _, _ in self.raw.range(since, float('inf')):
+                self._roll(bucket, timestamp, temperature / 10)
+
+    def _roll(self, bucket, timestamp, fahrenheit):
+        """_roll - Add one temperature to the open bucket of the given size, closing the old bucket if needed."""
+        start = timestamp - timestamp % bucket
+        current = self._open[bucket]
+
+        if current is not None and start > current[0]:
+            self.rollups[bucket].append(current[0], current[1], current[2], current[3], current[4])
+            current = None
+
+        if current is None:
+            self._open[bucket] = [start, 1, fahrenheit, fahrenheit, fahrenheit]
+        else:
+            current[1] += 1
+            current[2] = min(current[2], fahrenheit)
+            current[3] = max(current[3], fahrenheit)
+            current[4] += fahrenheit
+
+    def append(self, timestamp, state, fahrenheit, set_point, humidity=None):
+        """
+        append - Store one report and update the rollups.
+
+        @param timestamp is the unix time of the report.
+        @param state is 'off', 'heat' or 'cool'.
+        @param fahrenheit is the temperature.
+        @param set_point is the set point.
+        @param humidity is the relative humidity in percent, or None.
+        """
+        temperature = round(fahrenheit * 10)
+        self.raw.append(
+            timestamp,
+            temperature,
+            round(set_point * 10),
+            NO_HUMIDITY if humidity is None else round(humidity * 10),
+            STATE_CODES.get(state, 0)
+        )
+        for bucket in BUCKETS:
+            self._roll(bucket, timestamp, temperature / 10)
+
+    def samples(self, start, end):
+        """
+        samples - Raw reports with timestamps in [start, end).
+
+        @return a list of Samples.
+        """
+        return [Sample(timestamp, STATES[code], temperature / 10, set_point / 10,
+                       None if humidity == NO_HUMIDITY else humidity / 10)
+                for timestamp, temperature, set_point, humidity, code in self.raw.range(start, end)]
+
+    def buckets(self, start, end, bucket=HOUR):
+        """
+        buckets - Rollup buckets that start in [start, end), including the open bucket.
+
+        @param bucket is the bucket size, MINUTE, HOUR or DAY.
+        @return a list of Buckets.
+        """
+        result = [Bucket(first, count, minimum, total / count, maximum)
+                  for first, count, minimum, maximum, total in self.rollups[bucket].range(start, end)]
+
+        current = self._open[bucket]
+        if current is not None and start <= current[0] < end:
+            result.append(Bucket(current[0], current[1], current[2], current[4] / current[1], current[3]))
+        return result
+
+    def summary(self, start, end, bucket=HOUR):
+        """
+        summary - Merge the rollup buckets over a range into a single min / average / max.
+
+        @param bucket is the bucket size to read, coarser is faster but aligns the range to the bucket.
+        @return a Bucket for the whole range, or None if there is no data.
+        """
+        count, minimum, maximum, total = 0, float('inf'), float('-inf'), 0.0
+        for item in self.buckets(start, end, bucket):
+            count += item.count
+            minimum = min(minimum, item.minimum)
+            maximum = max(maximum, item.maximum)
+            total += item.average * item.count
+        if not count:
+            return None
+        return Bucket(start, count, minimum, total / count, maximum)
+
+    def close(self):
+        """close - Close the files. The open buckets are not written, they are rebuilt from the raw reports on reopen."""
+        self.raw.close()
+        for rollup in self.rollups.values():
+            rollup.close()
+
+    # End class DeviceSeries definition
+
+
+class TimeSeriesStore:
+    """
+    TimeSeriesStore - A directory of DeviceSeries, one per device. Devices are created on their first report.
+    """
+
+    def __init__(self, directory):
+        """
+        Open the store.
+
+        @param directory is the root directory. It is created if it doesn't exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._series = {}
+
+    def series(self, device):
+        """
+        series - The DeviceSeries for a device, opening it if needed.
+
+        @param device is the device name. Characters that aren't safe in a file name are replaced.
+        """
+        series = self._series.get(device)
+        if series is None:
+            safe = re.sub(r'[^A-Za-z0-9_.-]', '_', device)
+            series = self._series[device] = DeviceSeries(os.path.join(self.directory, safe))
+        return series
+
+    def append(self, device, timestamp, state, fahrenheit, set_point, humidity=None):
+        """append - Store one report for a device. See DeviceSeries.append()."""
+        self.series(device).append(timestamp, state, fahrenheit, set_point, humidity)
+
+    def close(self):
+        """close - Close every device."""
+        for series in self._series.values():
+            series.close()
+        self._series = {}
+
+    # End class TimeSeriesStore definition
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+
+    from math import sin, pi
+    from time import perf_counter
+
+    weeks = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    interval = 30
+    count = int(weeks * 7 * DAY / interval)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = TimeSeriesStore(directory)
+        series = store.series('/dev/ttyUSB0')
+
+        started = perf_counter()
+        for number in range(count):
+            timestamp = 1700000000 + number * interval
+            series.append(timestamp, 'heat', 70 + 4 * sin(2 * pi * timestamp / DAY), 72, 40.0)
+        elapsed = perf_counter() - started
+        print(f"Wrote {count} reports ({weeks:0.1f} weeks at {interval}s) in {elapsed:0.2f}s")
+
+        end = 1700000000 + count * interval
+        for name, bucket in (('1 minute', MINUTE), ('1 hour', HOUR), ('1 day', DAY)):
+            started = perf_counter()
+            result = series.summary(1700000000, end, bucket)
+            elapsed = perf_counter() - started
+            print(f"Whole range from {name} rollups: {elapsed * 1000:0.2f} ms "
+                  f"(min {result.minimum:0.1f} avg {result.average:0.1f} max {result.maximum:0.1f})")
+
+        started = perf_counter()
+        samples = series.samples(1700000000, end)
+        elapsed = perf_counter() - started
+        print(f"Whole range from raw reports: {elapsed * 1000:0.2f} ms ({len(samples)} reports)")
+
+        store.close()
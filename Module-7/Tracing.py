@@ -0,0 +1,220 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          TENTHS arguments for fixed point temperatures.     #
+#------------------------------------------------------------------#
+
+"""
+Tracing.py - Low overhead event tracing for the hot paths of the thermostat, in place of the DEBUG prints. A print
+writes to stdout synchronously and holds up the display and button threads while the terminal catches up. A trace event
+is a fixed size record of seven 64 bit integers packed into a preallocated ring buffer with one struct.pack_into():
+
+    timestamp (perf_counter_ns), thread (threading ident), event id, phase, a, b, c
+
+Nothing is formatted or allocated when an event is traced, and the oldest events are overwritten once the buffer is
+full. Code that traces keeps a tracer attribute that is None when tracing is off, so a disabled trace point costs one
+attribute test:
+
+    if self.tracer is not None:
+        self.tracer.emit(LIGHTS, self.tracer.intern(state), running, set_point)
+
+Event types are defined once at module level with the names and kinds of their arguments. Strings are interned to
+small integers and temperatures are stored in hundredths. dump() writes the buffer with the event types, the interned
+strings and the thread names, and DecodeTrace.py turns a dump into text or Chrome trace JSON.
+"""
+
+import json
+import struct
+
+from collections import namedtuple
+from itertools import count
+from threading import Lock, enumerate as threads, get_ident
+from time import perf_counter_ns, time
+
+# Argument kinds. INT is stored as is, STRING as the id from Tracer.intern(), TENTHS is an integer number of tenths,
+# e.g. a FixedPoint temperature, and CENTI is stored as round(value * 100).
+INT = 'int'
+STRING = 'str'
+TENTHS = 'tenths'
+CENTI = 'centi'
+
+# How a missing (None) TENTHS or CENTI argument is stored
+MISSING = -(1 << 63)
+
+# Phases. Chrome's trace viewer draws a BEGIN and the next END of the same event on the same thread as one slice.
+INSTANT = 0
+BEGIN = 1
+END = 2
+
+# EventType - A kind of trace event. fields is a tuple of (name, kind) for the arguments a, b and c in order.
+EventType = namedtuple('EventType', ['id', 'name', 'fields'])
+
+# Layout of a record. The thread ident is unsigned, everything else signed.
+RECORD = struct.Struct('<qQqqqqq')
+RECORD_FIELDS = 7
+
+# Dump file layout: MAGIC, the length of the JSON header as a little endian uint32, the header, then the records
+MAGIC = b'THTRACE1'
+HEADER_LENGTH = struct.Struct('<I')
+
+# Every event type defined so far, indexed by id. Id 0 is never used, so an unwritten record is all zeros.
+EVENT_TYPES = [EventType(0, 'none', ())]
+_event_lock = Lock()
+
+
+def define(name, /, **fields):
+    """
+    define - Define an event type. Called at module level by the code that traces it.
+
+    @param name is the event's name, shown by the decoder.
+    @param fields is up to three argument names with their kinds (INT, STRING, TENTHS or CENTI), in the order they are
+    passed to Tracer.emit().
+    @return the event id to pass to Tracer.emit().
+    """
+    if len(fields) > RECORD_FIELDS - 4:
+        raise ValueError(f"Event '{name}' has {len(fields)} fields, at most {RECORD_FIELDS - 4} are stored")
+    for field, kind in fields.items():
+        if kind not in (INT, STRING, TENTHS, CENTI):
+            raise ValueError(f"Unknown kind '{kind}' for field '{field}' of event '{name}'")
+
+    with _event_lock:
+        event = EventType(len(EVENT_TYPES), name, tuple(fields.items()))
+        EVENT_TYPES.append(event)
+    return event.id
+
+
+def centi(value):
+    """centi - Store a float such as a temperature as an integer number of hundredths. None is stored as the minimum."""
+    return MISSING if value is None else round(value * 100)
+
+
+def missing(value):
+    """missing - Store an integer that may be None, such as a TENTHS temperature before the first reading."""
+    return MISSING if value is None else value
+
+
+class Tracer:
+    """
+    Tracer - Ring buffer of trace records. emit() may be called from any thread without a lock: each call claims its own
+    slot from an itertools.count, whose next() is atomic under the GIL.
+    """
+
+    def __init__(self, capacity=65536, clock=perf_counter_ns):
+        """
+        Allocate the buffer.
+
+        @param capacity is the number of records kept. Defaults to 65536, which is 3.5MB.
+        @param clock is a callable returning the time in integer nanoseconds. Defaults to time.perf_counter_ns.
+        """
+        self.capacity = capacity
+        self.clock = clock
+        self._records = bytearray(RECORD.size * capacity)
+        self._next = count().__next__
+        self._pack = RECORD.pack_into
+
+        # Interned strings, by string and by id
+        self._string_ids = {}
+        self._strings = []
+        self._string_lock = Lock()
+
+        # Names of the threads seen by name_thread(), by ident
+        self._thread_names = {}
+
+        # The clock and wall time when tracing started, so the decoder can give both
+        self.started = clock()
+        self.wallStarted = time()
+
+    def emit(self, event, a=0, b=0, c=0, phase=INSTANT):
+        """
+        emit - Record an event.
+
+        @param event is the id returned by define().
+        @param a, b and c are the event's integer arguments.
+        @param phase is INSTANT, BEGIN or END.
+        """
+        self._pack(self._records, self._next() % self.capacity * RECORD.size, self.clock(), get_ident(), event, phase,
+                   a, b, c)
+
+    def begin(self, event, a=0, b=0, c=0):
+        """begin - Record the start of a span, e.g. a scheduler job."""
+        self.emit(event, a, b, c, BEGIN)
+
+    def end(self, event, a=0, b=0, c=0):
+        """end - Record the end of the span last begun for event on this thread."""
+        self.emit(event, a, b, c, END)
+
+    def intern(self, string):
+        """
+        intern - The id a string is stored as. New strings take the lock once, after which this is a dictionary lookup.
+
+        @param string is the string.
+        @return its integer id.
+        """
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            with self._string_lock:
+                string_id = self._string_ids.get(string)
+                if string_id is None:
+                    string_id = len(self._strings)
+                    self._strings.append(string)
+                    self._string_ids[string] = string_id
+        return string_id
+
+    def name_thread(self, name):
+        """
+        name_thread - Name the calling thread in the dump. Threads that are still running when the dump is taken are
+        named from threading automatically, this keeps the name of one that may have finished by then.
+        """
+        self._thread_names[get_ident()] = name
+
+    def snapshot(self):
+        """
+        snapshot - Copy the records out of the buffer, oldest first. Events emitted while the copy is taken may or may
+        not be in it.
+
+        @return a tuple of (packed records, number of events emitted since the tracer was created).
+        """
+        # Claiming a slot is the only way to read the count. The claimed slot is left out of the copy.
+        emitted = self._next()
+        records = bytes(self._records)
+        if emitted <= self.capacity:
+            return records[:emitted * RECORD.size], emitted
+
+        # The buffer has wrapped, so the oldest record is the one the next event would overwrite
+        start = emitted % self.capacity * RECORD.size
+        return records[start:] + records[:start], emitted
+
+    def dump(self, path):
+        """
+        dump - Write the buffer to a file for DecodeTrace.py.
+
+        @param path is the file to write.
+        @return the number of records written.
+        """
+        records, emitted = self.snapshot()
+        thread_names = {thread.ident: thread.name for thread in threads() if thread.ident is not None}
+        thread_names.update(self._thread_names)
+
+        header = json.dumps({
+            'record_format': RECORD.format,
+            'started_ns': self.started,
+            'wall_started': self.wallStarted,
+            'capacity': self.capacity,
+            'emitted': emitted,
+            'events': [[event.name, [list(field) for field in event.fields]] for event in EVENT_TYPES],
+            'strings': list(self._strings),
+            'threads': {str(ident): name for ident, name in thread_names.items()},
+        }).encode('utf-8')
+
+        with open(path, 'wb') as trace_file:
+            trace_file.write(MAGIC)
+            trace_file.write(HEADER_LENGTH.pack(len(header)))
+            trace_file.write(header)
+            trace_file.write(records)
+        return len(records) // RECORD.size
+
+    # End class Tracer definition
@@ -0,0 +1,543 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Time steps are signed, as the wall clock can step  #
+#               back, and samples stay buffered until their batch  #
+#               is encoded.                                        #
+#                                                                  #
+#    3          Batches and acknowledgements carry a session id    #
+#               picked at startup, so a server that outlives a     #
+#               restart doesn't take the restarted sequence for    #
+#               resent batches. Payloads too large for the length  #
+#               field are rejected and the batch is split.         #
+#------------------------------------------------------------------#
+
+"""
+Uplink.py - Batched serial uplink for the thermostat. Samples are taken more often than the old 30 second report and
+kept in a bounded ring buffer. On each flush the buffered samples are packed into one batch frame with every value
+delta encoded against the previous sample, and optionally zlib compressed. A steady sample costs about three bytes,
+so the thermostat can send finer grained data for about the same serial bandwidth.
+
+The server acknowledges each batch. Batches that can't be written, or aren't acknowledged in time, are held in memory
+or in a spool file on disk while the link is down and are backfilled, oldest first, once it comes back.
+
+Batch frame:
+    sync 0xB7, payload length (uint16), session (uint32), sequence (uint16), flags (bit 0 = zlib), payload,
+    CRC16-CCITT
+Acknowledgement frame (server to thermostat):
+    sync 0xB8, session (uint32), sequence (uint16), CRC16-CCITT
+
+All multi-byte fields are little endian and the CRCs cover every byte after the sync byte.
+
+The sequence restarts at 0 whenever the thermostat does, so each Uplink picks a random session id when it is created
+and batches are told apart by (session, sequence). Batches spooled before a restart keep the session they were sent
+with.
+"""
+
+import os
+import struct
+import zlib
+
+# crc_hqx is the CRC16-CCITT (polynomial 0x1021) implemented in C
+from binascii import crc_hqx
+from collections import deque, namedtuple
+from itertools import islice
+
+BATCH_SYNC = 0xB7
+ACK_SYNC = 0xB8
+CRC_INITIAL = 0xFFFF
+
+BATCH_HEADER = struct.Struct('<HIHB')
+ACK = struct.Struct('<IH')
+CRC = struct.Struct('<H')
+
+FLAG_COMPRESSED = 0x01
+
+# Largest payload that fits in the length field
+MAX_PAYLOAD = 0xFFFF
+
+STATES = ('off', 'heat', 'cool')
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# Sample - One uplink sample. Timestamp is unix seconds, temperatures are Fahrenheit and humidity is percent.
+Sample = namedtuple('Sample', ['timestamp', 'state', 'fahrenheit', 'humidity', 'set_point'])
+
+
+def _put_varint(out, value):
+    """_put_varint - Append an unsigned LEB128 varint to a bytearray."""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    """_zigzag - Map a signed integer to an unsigned one, keeping small magnitudes small: 0, -1, 1, -2 to 0, 1, 2, 3."""
+    return (value << 1) ^ (value >> 63)
+
+
+def _unzigzag(value):
+    """_unzigzag - Undo _zigzag()."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def _put_signed(out, value):
+    """_put_signed - Append a zigzag encoded signed varint to a bytearray."""
+    _put_varint(out, _zigzag(value))
+
+
+def _get_varint(data, position):
+    """_get_varint - Read an unsigned varint. Returns the value and the next position."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _get_signed(data, position):
+    """_get_signed - Read a zigzag encoded signed varint. Returns the value and the next position."""
+    value, position = _get_varint(data, position)
+    return _unzigzag(value), position
+
+
+def encode_samples(samples):
+    """
+    encode_samples - Delta encode samples into a batch payload. Times are kept in tenths of a second and temperatures,
+    humidity and set points in tenths. The first sample is stored whole. Every later sample stores its time step with a
+    flag bit that says whether the state or set point changed, then the temperature and humidity deltas, then the new
+    state and set point delta only if they changed. The time step is zigzag encoded, as the samples are stamped with
+    the wall clock, which can be stepped back, e.g. when a Pi without a real time clock sets it from NTP at boot.
+
+    @param samples is a list of Samples in time order.
+    @return the payload as bytes.
+    """
+    out = bytearray()
+    _put_varint(out, len(samples))
+    if not samples:
+        return bytes(out)
+
+    first = samples[0]
+    time = round(first.timestamp * 10)
+    temperature = round(first.fahrenheit * 10)
+    humidity = round(first.humidity * 10)
+    set_point = round(first.set_point * 10)
+    state = STATE_CODES[first.state]
+
+    _put_varint(out, time)
+    out.append(state)
+    _put_signed(out, temperature)
+    _put_varint(out, humidity)
+    _put_signed(out, set_point)
+
+    for sample in samples[1:]:
+        next_time = round(sample.timestamp * 10)
+        next_temperature = round(sample.fahrenheit * 10)
+        next_humidity = round(sample.humidity * 10)
+        next_set_point = round(sample.set_point * 10)
+        next_state = STATE_CODES[sample.state]
+
+        changed = next_state != state or next_set_point != set_point
+        _put_varint(out, (_zigzag(next_time - time) << 1) | changed)
+        _put_signed(out, next_temperature - temperature)
+        _put_signed(out, next_humidity - humidity)
+        if changed:
+            out.append(next_state)
+            _put_signed(out, next_set_point - set_point)
+
+        time, temperature, humidity, set_point, state = (next_time, next_temperature, next_humidity, next_set_point,
+                                                          next_state)
+
+    return bytes(out)
+
+
+def decode_samples(payload):
+    """
+    decode_samples - Decode a batch payload made by encode_samples().
+
+    @param payload is the payload bytes.
+    @return a list of Samples.
+    """
+    count, position = _get_varint(payload, 0)
+    if not count:
+        return []
+
+    time, position = _get_varint(payload, position)
+    state = payload[position]
+    position += 1
+    temperature, position = _get_signed(payload, position)
+    humidity, position = _get_varint(payload, position)
+    set_point, position = _get_signed(payload, position)
+
+    samples = [Sample(time / 10, STATES[state], temperature / 10, humidity / 10, set_point / 10)]
+    for _ in range(count - 1):
+        head, position = _get_varint(payload, position)
+        time += _unzigzag(head >> 1)
+        delta, position = _get_signed(payload, position)
+        temperature += delta
+        delta, position = _get_signed(payload, position)
+        humidity += delta
+        if head & 1:
+            state = payload[position]
+            position += 1
+            delta, position = _get_signed(payload, position)
+            set_point += delta
+        samples.append(Sample(time / 10, STATES[state], temperature / 10, humidity / 10, set_point / 10))
+
+    return samples
+
+
+def encode_batch(session, sequence, samples, compress=True):
+    """
+    encode_batch - Build a batch frame.
+
+    @param session is the sender's session id, a 32 bit number.
+    @param sequence is the batch sequence number. Only the low 16 bits are sent.
+    @param samples is a list of Samples in time order.
+    @param compress is True to zlib compress the payload when that makes it smaller.
+    @return the frame as bytes.
+    @raises ValueError if the payload is larger than MAX_PAYLOAD, even compressed.
+    """
+    payload = encode_samples(samples)
+    flags = 0
+    if compress:
+        packed = zlib.compress(payload, 9)
+        if len(packed) < len(payload):
+            payload = packed
+            flags |= FLAG_COMPRESSED
+
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Batch payload of {len(payload)} bytes is larger than {MAX_PAYLOAD}")
+
+    body = BATCH_HEADER.pack(len(payload), session, sequence & 0xFFFF, flags) + payload
+    return bytes((BATCH_SYNC,)) + body + CRC.pack(crc_hqx(body, CRC_INITIAL))
+
+
+def encode_ack(session, sequence):
+    """
+    encode_ack - Build the acknowledgement the server sends for a batch.
+
+    @param session is the batch's session id.
+    @param sequence is the batch sequence number.
+    @return the frame as bytes.
+    """
+    body = ACK.pack(session, sequence & 0xFFFF)
+    return bytes((ACK_SYNC,)) + body + CRC.pack(crc_hqx(body, CRC_INITIAL))
+
+
+def split_frames(buffer, sync, header_length, payload_length):
+    """
+    split_frames - Pull complete, CRC checked frames off the front of a receive buffer. Bytes that don't start a valid
+    frame are skipped until the next sync byte. The consumed bytes are removed from the buffer.
+
+    @param buffer is a bytearray of received bytes.
+    @param sync is the sync byte of the frames to find.
+    @param header_length is the number of bytes after the sync byte that come before the payload.
+    @param payload_length is a callable that returns the payload length from the buffer and frame position.
+    @return a tuple of (list of frame bodies without the sync byte and CRC, number of bytes discarded).
+    """
+    frames = []
+    discarded = 0
+    position = 0
+    end = len(buffer)
+
+    while position < end:
+        if buffer[position] != sync:
+            next_sync = buffer.find(sync, position + 1)
+            next_sync = end if next_sync < 0 else next_sync
+            discarded += next_sync - position
+            position = next_sync
+            continue
+
+        if end - position < 1 + header_length:
+            break
+        length = 1 + header_length + payload_length(buffer, position) + CRC.size
+        if end - position < length:
+            break
+
+        body = bytes(buffer[position + 1:position + length - CRC.size])
+        if crc_hqx(body, CRC_INITIAL) != CRC.unpack_from(buffer, position + length - CRC.size)[0]:
+            discarded += 1
+            position += 1
+            continue
+
+        frames.append(body)
+        position += length
+
+    del buffer[:position]
+    return frames, discarded
+
+
+class BatchDecoder:
+    """
+    BatchDecoder - Server side streaming decoder for batch frames. Chunks can be fed in with any boundaries. Batches
+    that were resent because their acknowledgement was lost are recognised by session and sequence number and dropped.
+    """
+
+    # Number of recent (session, sequence) pairs remembered for spotting resent batches
+    HISTORY = 1024
+
+    def __init__(self):
+        """Set up an empty receive buffer and zero the statistics."""
+        self._buffer = bytearray()
+        self._recent = deque(maxlen=self.HISTORY)
+        self._recent_set = set()
+
+        # Statistics
+        self.batches = 0
+        self.samples = 0
+        self.duplicates = 0
+        self.bytes_discarded = 0
+
+    def feed(self, chunk):
+        """
+        feed - Add received bytes and decode every complete batch.
+
+        @param chunk is the bytes received.
+        @return a list of (session, sequence, list of Samples) tuples. Every batch returned should be acknowledged,
+        including duplicates, which are returned with an empty sample list.
+        """
+        self._buffer += chunk
+        bodies, discarded = split_frames(self._buffer, BATCH_SYNC, BATCH_HEADER.size,
+                                         lambda buffer, position: BATCH_HEADER.unpack_from(buffer, position + 1)[0])
+        self.bytes_discarded += discarded
+
+        batches = []
+        for body in bodies:
+            _, session, sequence, flags = BATCH_HEADER.unpack_from(body)
+            key = (session, sequence)
+            if key in self._recent_set:
+                self.duplicates += 1
+                batches.append((session, sequence, []))
+                continue
+
+            if len(self._recent) == self.HISTORY:
+                self._recent_set.discard(self._recent[0])
+            self._recent.append(key)
+            self._recent_set.add(key)
+
+            payload = body[BATCH_HEADER.size:]
+            if flags & FLAG_COMPRESSED:
+                payload = zlib.decompress(payload)
+            samples = decode_samples(payload)
+
+            self.batches += 1
+            self.samples += len(samples)
+            batches.append((session, sequence, samples))
+        return batches
+
+    # End class BatchDecoder definition
+
+
+class Uplink:
+    """
+    Uplink - Thermostat side of the batched uplink. record() adds a sample to the ring buffer. flush() packs the buffer
+    into batch frames and sends them after any backlog. A batch stays outstanding until the server acknowledges it.
+    If a write fails, or a batch goes unacknowledged for ack_timeout seconds, the link is marked down. Unsent batches
+    then go to the spool file, or to a bounded in-memory backlog if there is no spool file. They are resent, oldest
+    first, on a later flush.
+    """
+
+    def __init__(self, ser, clock, batch_size=64, capacity=4096, compress=True, spool_path=None, ack_timeout=10.0,
+                 max_backlog=256, session=None):
+        """
+        Set up the uplink.
+
+        @param ser is the open serial port.
+        @param clock is the clock object used for acknowledgement timeouts, e.g. the hardware backend's clock.
+        @param batch_size is the largest number of samples in one batch.
+        @param capacity is the size of the sample ring buffer. The oldest samples are dropped once it is full.
+        @param compress is True to zlib compress batches when that makes them smaller.
+        @param spool_path is an optional file that holds unsent batches while the link is down, so they survive a
+        restart. Without it they are held in memory.
+        @param ack_timeout is the number of seconds to wait for an acknowledgement before the link is considered down.
+        Set to None to send without waiting for acknowledgements.
+        @param max_backlog is the most batches held in memory while the link is down when there is no spool file.
+        @param session is the 32 bit session id sent with every batch. Defaults to a random one, so it differs on
+        every restart.
+        """
+        self.ser = ser
+        self.clock = clock
+        self.batch_size = batch_size
+        self.compress = compress
+        self.spool_path = spool_path
+        self.ack_timeout = ack_timeout
+
+        self._samples = deque(maxlen=capacity)
+        self._backlog = deque(maxlen=max_backlog)
+        self._outstanding = {}
+        self._ack_buffer = bytearray()
+        self._sequence = 0
+        self.session = session if session is not None else int.from_bytes(os.urandom(4), 'little')
+
+        self.link_up = True
+
+        # Statistics
+        self.samples_recorded = 0
+        self.samples_dropped = 0
+        self.batches_sent = 0
+        self.batches_acked = 0
+        self.batches_resent = 0
+        self.bytes_sent = 0
+
+    def record(self, timestamp, state, fahrenheit, humidity, set_point):
+        """
+        record - Add a sample to the ring buffer.
+
+        @param timestamp is the unix time of the sample.
+        @param state is the state id.
+        @param fahrenheit is the temperature.
+        @param humidity is the relative humidity.
+        @param set_point is the set point.
+        """
+        if len(self._samples) == self._samples.maxlen:
+            self.samples_dropped += 1
+        self._samples.append(Sample(timestamp, state, fahrenheit, humidity, set_point))
+        self.samples_recorded += 1
+
+    def _next_batch(self):
+        """
+        _next_batch - Encode up to batch_size samples from the front of the ring buffer and take them off it. A batch
+        too large for one frame is halved until it fits. If the encoding fails the samples are left in the buffer.
+        """
+        count = min(self.batch_size, len(self._samples))
+        while True:
+            try:
+                frame = encode_batch(self.session, self._sequence, list(islice(self._samples, count)), self.compress)
+                break
+            except ValueError:
+                if count == 1:
+                    raise
+                count //= 2
+        for _ in range(count):
+            self._samples.popleft()
+        self._sequence = (self._sequence + 1) & 0xFFFF
+        return frame
+
+    def _poll_acks(self):
+        """_poll_acks - Read acknowledgements the server has sent and retire the matching batches."""
+        try:
+            waiting = self.ser.in_waiting
+            if waiting:
+                self._ack_buffer += self.ser.read(waiting)
+        except OSError:
+            self.link_up = False
+            return
+
+        bodies, _ = split_frames(self._ack_buffer, ACK_SYNC, ACK.size, lambda buffer, position: 0)
+        for body in bodies:
+            if self._outstanding.pop(ACK.unpack_from(body), None) is not None:
+                self.batches_acked += 1
+                self.link_up = True
+
+    def _expire(self):
+        """_expire - Move batches whose acknowledgement is overdue back to the backlog and mark the link down."""
+        now = self.clock.now()
+        expired = sorted((sent, key) for key, (sent, _) in self._outstanding.items() if now - sent > self.ack_timeout)
+        if not expired:
+            return
+
+        # Expired batches were sent before anything that is held now, so they go back at the front
+        self._hold([self._outstanding.pop(key)[1] for _, key in expired], front=True)
+        self.batches_resent += len(expired)
+        self.link_up = False
+
+    def _hold(self, frames, front=False):
+        """
+        _hold - Keep unsent frames until the link is back, on disk if there is a spool file.
+
+        @param frames is a list of frames, oldest first.
+        @param front is True if the frames are older than everything already held.
+        """
+        if not frames:
+            return
+
+        if self.spool_path is None:
+            if front:
+                self._backlog.extendleft(reversed(frames))
+            else:
+                self._backlog.extend(frames)
+            return
+
+        if front and os.path.exists(self.spool_path):
+            # Rewrite the spool with the frames in front, replacing the old file in one step
+            with open(self.spool_path, 'rb') as spool:
+                held = spool.read()
+            temporary = self.spool_path + '.tmp'
+            with open(temporary, 'wb') as spool:
+                spool.write(b''.join(frames) + held)
+                spool.flush()
+                os.fsync(spool.fileno())
+            os.replace(temporary, self.spool_path)
+            return
+
+        with open(self.spool_path, 'ab') as spool:
+            spool.write(b''.join(frames))
+            spool.flush()
+            os.fsync(spool.fileno())
+
+    def _take_backlog(self):
+        """_take_backlog - Remove and return every held frame, oldest first."""
+        frames = list(self._backlog)
+        self._backlog.clear()
+
+        if self.spool_path is not None and os.path.exists(self.spool_path):
+            with open(self.spool_path, 'rb') as spool:
+                buffer = bytearray(spool.read())
+            os.remove(self.spool_path)
+            bodies, _ = split_frames(buffer, BATCH_SYNC, BATCH_HEADER.size,
+                                     lambda data, position: BATCH_HEADER.unpack_from(data, position + 1)[0])
+            frames = [bytes((BATCH_SYNC,)) + body + CRC.pack(crc_hqx(body, CRC_INITIAL)) for body in bodies] + frames
+        return frames
+
+    def _send(self, frames):
+        """_send - Write frames in order. Stops at the first failure and holds that frame and the rest."""
+        for index, frame in enumerate(frames):
+            try:
+                self.ser.write(frame)
+            except OSError:
+                self.link_up = False
+                self._hold(frames[index:], front=True)
+                return
+
+            self.batches_sent += 1
+            self.bytes_sent += len(frame)
+            if self.ack_timeout is not None:
+                # Keyed by (session, sequence), as held batches from before a restart have another session
+                _, session, sequence, _ = BATCH_HEADER.unpack_from(frame, 1)
+                self._outstanding[(session, sequence)] = (self.clock.now(), frame)
+
+    def flush(self):
+        """
+        flush - Check acknowledgements, then send any backlog followed by the buffered samples. While the link is down,
+        new batches go straight to the backlog and only the oldest held batch is sent, to probe whether the link is
+        back.
+        """
+        if self.ack_timeout is not None:
+            self._poll_acks()
+            self._expire()
+
+        # Batches encoded before one that fails are still sent. The failed batch's samples stay in the buffer.
+        frames = []
+        try:
+            while self._samples:
+                frames.append(self._next_batch())
+        finally:
+            if self.link_up:
+                self._send(self._take_backlog() + frames)
+            else:
+                # Probe with the oldest held batch, so the server still receives batches in order, and hold the rest
+                # until it is acknowledged
+                frames = self._take_backlog() + frames
+                self._hold(frames[1:])
+                self._send(frames[:1])
+
+    # End class Uplink definition
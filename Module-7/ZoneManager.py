@@ -0,0 +1,262 @@
+#------------------------------------------------------------------#
+# Change History                                                   #
+#------------------------------------------------------------------#
+# Version   |   Description                                        #
+#------------------------------------------------------------------#
+#    1          Initial Development                                #
+#                                                                  #
+#    2          Zones share a BusArbiter instead of a bus lock,    #
+#               one 80ms measurement per sample.                   #
+#                                                                  #
+#    3          Zone hardware is acquired when the worker starts.  #
+#                                                                  #
+#    4          Optional Prometheus metrics per zone.              #
+#                                                                  #
+#    5          Temperatures are shown from integer tenths.        #
+#                                                                  #
+#    6          Zone settings can be kept in a shared StateStore.  #
+#                                                                  #
+#    7          Each zone can run its own set point program.       #
+#------------------------------------------------------------------#
+
+"""
+ZoneManager.py - Runs many independent thermostat zones in one process. Each zone is a TemperatureMachine with its own
+sensor (by address or multiplexer channel), LEDs, set point and control engine. The zones share one I2C bus arbiter, one
+serial port, one fade engine and one LCD, and everything periodic runs as jobs on a single worker thread's Scheduler:
+    - one sample job per zone, staggered across the sample period so the bus reads are spread out and never overlap
+    - one display job that pages the LCD between the zones
+    - one report job that sends a line per zone to the Thermostat Server, prefixed with the zone name
+    - one timer per zone with a set point program, asleep until that zone's next transition
+
+Usage: python ZoneManager.py [zones] [hours]   - run simulated zones on a stepped clock and print the statistics
+"""
+
+from collections import namedtuple
+from threading import Thread
+
+import Hardware
+from FadeEngine import FadeEngine
+from FixedPoint import format_tenths
+from I2cArbiter import BusArbiter
+from Metrics import MeteredPort
+from Scheduler import Scheduler
+from Thermostat import ManagedDisplay, TemperatureMachine
+
+# ZoneConfig - How one zone is wired. led_pins is (red, blue) or None for a zone without LEDs, mux_channel is None for a
+# sensor directly on the bus, or 0 to Hardware.MUX_CHANNELS - 1 across the chained multiplexers. program is the zone's
+# SetpointProgram, or None to leave the set point to the buttons.
+ZoneConfig = namedtuple('ZoneConfig', ['name', 'set_point', 'led_pins', 'sensor_address', 'mux_channel', 'program'],
+                        defaults=(None,))
+
+
+class ZoneManager:
+    """
+    ZoneManager - Owns the shared devices and the worker thread, and runs every zone's jobs on it.
+    """
+
+    # Periods in seconds of the shared jobs
+    DISPLAY_PERIOD = 1
+    PAGE_PERIOD = 5
+    SERIAL_PERIOD = 30
+
+    # Bus time in seconds of one zone's sample. The AHT20 takes 80ms per measurement and the arbiter reads the temperature
+    # and the humidity from one measurement.
+    SAMPLE_BUS_TIME = 0.08
+
+    def __init__(self, zones, backend=None, sample_period=2.0, report_period=None, debugging=False, metrics=None,
+                 state_store=None):
+        """
+        Create the shared devices and a TemperatureMachine per zone.
+
+        @param zones is a list of ZoneConfigs.
+        @param backend is the hardware backend. Defaults to Hardware.get_backend().
+        @param sample_period is the number of seconds between reads of each zone's sensor. It is stretched if the bus
+        can't read every zone in that time, leaving half of the bus time free.
+        @param report_period is the number of seconds between reports. Defaults to SERIAL_PERIOD.
+        @param debugging is True to print the job statistics when the worker stops.
+        @param metrics is a Metrics.Registry to export every zone's metrics to, labelled with the zone name, and the
+        worker's job timing and serial traffic, labelled 'zones'. None to export nothing.
+        @param state_store is a StateStore.StateStore every zone's set point, state and recent readings are saved to by
+        zone name, and restored from when a zone's name is found in it. None to save nothing.
+        """
+        self.backend = backend if backend is not None else Hardware.get_backend()
+        self.clock = self.backend.clock
+        self.samplePeriod = max(sample_period, 2 * self.SAMPLE_BUS_TIME * len(zones))
+        self.reportPeriod = report_period if report_period is not None else self.SERIAL_PERIOD
+        self.DEBUG = debugging
+
+        # Shared by every zone
+        self.bus = BusArbiter(self.clock.now)
+        port = self.backend.serial_port(TemperatureMachine.SERIAL_PORT)
+        self.ser = MeteredPort(port, metrics, device='zones') if metrics is not None else port
+        self.fadeEngine = FadeEngine(clock=self.clock.now, wait=self.clock.wait)
+        self.scheduler = Scheduler(self.clock.now, self.clock.wait, metrics=metrics, labels={'device': 'zones'})
+        self.stateStore = state_store
+
+        # Zones by name, in the order they were given. The sampler threads are never started, the worker samples.
+        self.zones = {}
+        for config in zones:
+            self.zones[config.name] = TemperatureMachine(
+                config.set_point, False, self.samplePeriod, 2 * self.samplePeriod, backend=self.backend,
+                led_pins=config.led_pins, sensor_address=config.sensor_address, mux_channel=config.mux_channel,
+                ser=port, bus=self.bus, fade_engine=self.fadeEngine, metrics=metrics, device=config.name,
+                state_store=state_store, program=config.program
+            )
+
+        self.page = 0
+        self.endDisplay = False
+        self._thread = None
+
+        # Statistics
+        self.sampleErrors = 0
+        self.reports = 0
+
+    def zone(self, name):
+        """
+        zone - Look up a zone, e.g. to send its buttons' events.
+
+        @param name is the zone name.
+        @return the zone's TemperatureMachine.
+        """
+        return self.zones[name]
+
+    def sample_zone(self, zone):
+        """
+        sample_zone - Job that reads one zone's sensor. The reading drives the zone's control engine and lights.
+
+        @param zone is the zone's TemperatureMachine.
+        """
+        try:
+            zone.sampler.sample()
+        except OSError:
+            # The previous reading stays in the zone's cache. It is retried on the next release.
+            self.sampleErrors += 1
+
+    def refresh_display(self, screen):
+        """
+        refresh_display - Job that draws the current page. Each zone is shown for PAGE_PERIOD seconds in turn.
+
+        @param screen is the shared ManagedDisplay.
+        """
+        names = list(self.zones)
+        ticks_per_page = max(1, round(self.PAGE_PERIOD / self.DISPLAY_PERIOD))
+        name = names[self.page // ticks_per_page % len(names)]
+        self.page += 1
+
+        zone = self.zones[name]
+        screen.update_screen(f"{name[:10]:<10}{zone.current_state.id:>6}\n"
+                             f"{format_tenths(zone.get_fahrenheit_tenths())}F  Set {zone.setPoint}F")
+
+    def send_reports(self):
+        """
+        send_reports - Job that sends every zone's state to the Thermostat Server in one write. Each line is the zone's
+        usual report prefixed with 'name:'.
+        """
+        lines = ''.join(f'{name}:{zone.setup_serial_output()}' for name, zone in self.zones.items())
+        self.ser.write(lines.encode('utf-8'))
+        self.reports += len(self.zones)
+
+    def run(self, should_stop=None):
+        """
+        run - Register the jobs and run them on the calling thread until stop() is called or should_stop() is True.
+
+        @param should_stop is an optional callable checked after every job.
+        """
+        screen = ManagedDisplay(self.backend)
+        for zone in self.zones.values():
+            zone.start()
+
+        # Spread the zones' first reads across one sample period so the bus load is even
+        for index, (name, zone) in enumerate(self.zones.items()):
+            self.scheduler.add_job(f'sample {name}', self.samplePeriod, lambda zone=zone: self.sample_zone(zone),
+                                   delay=index * self.samplePeriod / len(self.zones))
+
+        self.scheduler.add_job('display', self.DISPLAY_PERIOD, lambda: self.refresh_display(screen))
+        self.scheduler.add_job('serial', self.reportPeriod, self.send_reports, delay=self.reportPeriod)
+
+        # Each program sleeps in the scheduler's heap until its own next transition, so zones without a change due cost
+        # nothing
+        for name, zone in self.zones.items():
+            if zone.program is not None:
+                self.scheduler.add_timer(f'program {name}', zone.run_program)
+
+        # One save covers every zone
+        if self.stateStore is not None:
+            self.scheduler.add_job('state', TemperatureMachine.STATE_PERIOD, self.stateStore.save_if_due,
+                                   delay=TemperatureMachine.STATE_PERIOD)
+
+        self.scheduler.run(should_stop=lambda: self.endDisplay or (should_stop is not None and should_stop()))
+
+        if self.DEBUG:
+            for name, stats in self.scheduler.stats().items():
+                print(f"Job {name}: {stats['missed']} missed deadlines, max lateness {stats['max_lateness']:0.3f}s")
+            for name, stats in self.bus.stats().items():
+                print(f"Sensor {name}: {stats['reads']} reads, {stats['coalesced']} coalesced, "
+                      f"{stats['bus_time']:0.2f}s on the bus")
+
+        screen.cleanup_display()
+
+    def start(self):
+        """start - Start the fade engine and run the jobs on the worker thread."""
+        self.fadeEngine.start()
+        self._thread = Thread(target=self.run, name='ZoneManager', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop - Stop the worker thread and the fade engine."""
+        self.endDisplay = True
+        self.scheduler.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.fadeEngine.stop()
+
+    # End class ZoneManager definition
+
+
+if __name__ == '__main__':
+    import sys
+
+    from time import perf_counter
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    hours = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    if not 0 < count <= Hardware.MUX_CHANNELS:
+        sys.exit(f"The zones' sensors are on mux channels, so there can be 1 to {Hardware.MUX_CHANNELS} zones")
+
+    backend = Hardware.use_backend('sim')
+
+    # Hand out the GPIO pins the thermostat and LCD don't use as LED pairs, the zones after that have no LEDs. Every
+    # sensor has the same fixed address, so each one is on its own multiplexer channel, eight to a multiplexer.
+    free = [pin for pin in range(2, 28) if pin not in Hardware.LCD_PINS + (12, 18, 23, 24, 25)]
+    pairs = list(zip(free[0::2], free[1::2]))
+    configs = [ZoneConfig(f'zone{number}', 68 + number % 5, pairs[number] if number < len(pairs) else None,
+                          Hardware.AHTX0_ADDRESS, number) for number in range(count)]
+    manager = ZoneManager(configs, backend)
+
+    # Read the reports back from the other end of the pty so the writes never block
+    from SimulateThermostat import drain_serial
+    lines = []
+    Thread(target=drain_serial, args=(backend.serial_peers[TemperatureMachine.SERIAL_PORT], lines), daemon=True).start()
+
+    # Give each zone its own room temperature
+    for number, zone in enumerate(manager.zones.values()):
+        zone.thSensor.curve = Hardware.daily_curve(mean=19.0 + number % 7, phase=number * 3600)
+        zone.send('cycle')
+
+    started = perf_counter()
+    manager.run(should_stop=lambda: backend.clock.now() >= hours * 3600)
+    elapsed = perf_counter() - started
+
+    stats = manager.scheduler.stats()
+    missed = sum(job['missed'] for job in stats.values())
+    print(f"{count} zones for {hours:0.1f} simulated hours in {elapsed:0.2f}s on one worker thread")
+    bus = manager.bus.stats()
+    print(f"Sensor reads: {sum(sensor.measurements for sensor in backend.sensors)}, "
+          f"reports: {manager.reports}, missed deadlines: {missed}")
+    print(f"Control switching events: {sum(zone.controller.switches for zone in manager.zones.values())}")
+    print(f"Last report: {lines[-1] if lines else None}")
+    print(f"Sample period: {manager.samplePeriod:0.2f}s per zone")
+    print(f"Bus time: {sum(device['bus_time'] for device in bus.values()):0.1f}s, "
+          f"longest transaction {max(device['max_bus_time'] for device in bus.values()) * 1000:0.0f}ms")
+    backend.close()